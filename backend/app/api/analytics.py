@@ -1,53 +1,117 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.database import get_db
-from app.models.user import User
-from app.api.auth import get_current_user
+from app.api.auth import Principal, get_principal
+from app.api.rate_limits import rate_limit
+from app.api.conditional import make_etag, time_bucket, check_not_modified
 from app.services.analytics_service import AnalyticsService
+from app.services.llm_usage import llm_usage
+from app.services.response_cache import help_craft_cache
+from app.services.version_service import VersionService
 
-router = APIRouter()
+# Analytics queries scan whole tables; cap how often each user can run them
+router = APIRouter(dependencies=[Depends(rate_limit("analytics", "60/minute", free="20/minute"))])
+
+def _admin_required_exception() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail="Admin access required"
+    )
 
 @router.get("/me")
 async def get_my_analytics(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    response: Response,
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get analytics for current user"""
-    return AnalyticsService.get_user_analytics(current_user.id, db)
+    etag = make_etag("analytics-me", current_user.id, current_user.data_version, time_bucket(3600))
+    if cached := check_not_modified(request, response, etag):
+        return cached
+    
+    return await AnalyticsService.get_user_analytics(current_user.id, db)
 
 @router.get("/platform")
 async def get_platform_analytics(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    response: Response,
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get overall platform analytics (for admin/tracking progress)"""
+    global_stamp = await VersionService.get_global_stamp(db)
+    etag = make_etag("analytics-platform", global_stamp, time_bucket(3600))
+    if cached := check_not_modified(request, response, etag):
+        return cached
+    
     # In production, add admin check here
-    return AnalyticsService.get_platform_analytics(db)
+    return await AnalyticsService.get_platform_analytics(db)
 
 @router.get("/timeline")
 async def get_message_timeline(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    response: Response,
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get timeline of user's messages"""
-    return AnalyticsService.get_message_timeline(current_user.id, db)
+    etag = make_etag("analytics-timeline", current_user.id, current_user.data_version)
+    if cached := check_not_modified(request, response, etag):
+        return cached
+    
+    return await AnalyticsService.get_message_timeline(current_user.id, db)
 
 @router.get("/growth")
 async def get_growth_data(
+    request: Request,
+    response: Response,
     days: int = 30,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get growth chart data"""
+    global_stamp = await VersionService.get_global_stamp(db)
+    etag = make_etag("analytics-growth", days, global_stamp, time_bucket(3600))
+    if cached := check_not_modified(request, response, etag):
+        return cached
+    
     # In production, add admin check here
-    return AnalyticsService.get_growth_chart_data(db, days)
+    return await AnalyticsService.get_growth_chart_data(db, days)
 
 @router.get("/retention")
 async def get_retention_metrics(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    response: Response,
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get user retention metrics"""
+    global_stamp = await VersionService.get_global_stamp(db)
+    etag = make_etag("analytics-retention", global_stamp, time_bucket(3600))
+    if cached := check_not_modified(request, response, etag):
+        return cached
+    
     # In production, add admin check here
-    return AnalyticsService.get_retention_metrics(db)
+    return await AnalyticsService.get_retention_metrics(db)
+
+@router.get("/llm-usage")
+async def get_llm_usage(
+    days: int = Query(30, ge=1, le=365),
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get LLM calls, tokens and estimated cost per call site, tier, day and user (admin only)"""
+    if not current_user.is_admin:
+        raise _admin_required_exception()
+    
+    return await AnalyticsService.get_llm_usage(db, days)
+
+@router.get("/llm-usage/live")
+async def get_live_llm_usage(current_user: Principal = Depends(get_principal)):
+    """This worker's LLM usage and help-craft cache savings since it started, with estimated cost (admin only)"""
+    if not current_user.is_admin:
+        raise _admin_required_exception()
+    
+    return {**llm_usage.stats(), "help_craft_cache": help_craft_cache.stats()}
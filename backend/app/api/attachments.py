@@ -0,0 +1,426 @@
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Header, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import BaseModel, Field
+from typing import AsyncIterator, List, Optional, Tuple
+from datetime import datetime
+import uuid
+
+from app.core.config import settings
+from app.core.database import get_db
+from app.core.security import create_download_token, decode_download_token
+from app.models.attachment import Attachment, AttachmentUpload, UploadStatus
+from app.api.auth import Principal, get_principal, get_token_principal
+from app.services.storage_service import get_storage, StorageError
+from app.services.blob_service import BlobService
+from app.services.media_service import MediaService, VARIANTS, media_pipeline
+
+router = APIRouter()
+
+class UploadCreate(BaseModel):
+    filename: Optional[str] = None
+    content_type: str = "application/octet-stream"
+    total_size: int = Field(..., gt=0)
+    sha256: Optional[str] = Field(None, pattern=r"^[0-9a-fA-F]{64}$")  # Lets re-uploads skip the transfer
+
+class UploadStatusResponse(BaseModel):
+    upload_id: str
+    bytes_received: int
+    total_size: int
+    status: str
+    attachment_id: Optional[int] = None  # Set when the upload was satisfied without transferring bytes
+
+class AttachmentResponse(BaseModel):
+    id: int
+    filename: Optional[str] = None
+    content_type: str
+    size: int
+    created_at: datetime
+    variants: List[str] = []  # Generated derivatives, e.g. "thumb", "preview_jpeg"
+
+class DownloadUrlResponse(BaseModel):
+    url: str
+    expires_in: int
+    variant: Optional[str] = None  # None for the original
+
+def _upload_status(upload: AttachmentUpload, attachment_id: Optional[int] = None) -> UploadStatusResponse:
+    return UploadStatusResponse(
+        upload_id=upload.id,
+        bytes_received=upload.bytes_received,
+        total_size=upload.total_size,
+        status=upload.status.value,
+        attachment_id=attachment_id
+    )
+
+def _attachment_response(attachment: Attachment, variants: Optional[List[str]] = None) -> AttachmentResponse:
+    return AttachmentResponse(
+        id=attachment.id,
+        filename=attachment.filename,
+        content_type=attachment.content_type,
+        size=attachment.size,
+        created_at=attachment.created_at,
+        variants=variants or []
+    )
+
+async def _get_attachment(attachment_id: int, user_id: int, db: AsyncSession) -> Attachment:
+    attachment = (await db.scalars(select(Attachment).where(
+        Attachment.id == attachment_id,
+        Attachment.user_id == user_id
+    ))).first()
+    
+    if not attachment:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Attachment not found"
+        )
+    
+    return attachment
+
+async def _get_upload(upload_id: str, user_id: int, db: AsyncSession) -> AttachmentUpload:
+    upload = (await db.scalars(select(AttachmentUpload).where(
+        AttachmentUpload.id == upload_id,
+        AttachmentUpload.user_id == user_id
+    ))).first()
+    
+    if not upload:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Upload not found"
+        )
+    
+    return upload
+
+async def _limit_body(chunks: AsyncIterator[bytes], max_bytes: int) -> AsyncIterator[bytes]:
+    """Pass the body through, failing once it exceeds what the upload still expects"""
+    received = 0
+    async for data in chunks:
+        received += len(data)
+        if received > max_bytes:
+            raise StorageError("Chunk exceeds the declared upload size")
+        yield data
+
+def _parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single 'bytes=' range into inclusive (start, end); None means the whole object"""
+    
+    if not range_header:
+        return None
+    
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        raise ValueError("Unsupported range")
+    
+    start_text, _, end_text = spec.strip().partition("-")
+    if start_text:
+        start = int(start_text)
+        end = min(int(end_text), size - 1) if end_text else size - 1
+    else:
+        # Suffix range: the last N bytes
+        start = max(size - int(end_text), 0)
+        end = size - 1
+    
+    if start > end or start >= size:
+        raise ValueError("Unsatisfiable range")
+    
+    return start, end
+
+@router.post("/uploads", response_model=UploadStatusResponse, status_code=status.HTTP_201_CREATED)
+async def create_upload(
+    upload_data: UploadCreate,
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    """Start a resumable chunked upload"""
+    
+    upload_id = uuid.uuid4().hex
+    
+    if upload_data.sha256:
+        # Only the user's own blobs are matched, so the hash can't probe other users' files
+        blob = await BlobService.find_user_blob(current_user.id, upload_data.sha256.lower(), db)
+        # A blob garbage collected since the lookup falls back to a normal upload
+        if blob and blob.size == upload_data.total_size and await BlobService.add_reference(blob.sha256, db):
+            upload = AttachmentUpload(
+                id=upload_id,
+                user_id=current_user.id,
+                storage_key=blob.storage_key,
+                filename=upload_data.filename,
+                content_type=upload_data.content_type,
+                total_size=blob.size,
+                bytes_received=blob.size,
+                backend_state={},
+                status=UploadStatus.COMPLETED
+            )
+            attachment = Attachment(
+                user_id=current_user.id,
+                storage_key=blob.storage_key,
+                filename=upload_data.filename,
+                content_type=upload_data.content_type,
+                size=blob.size
+            )
+            db.add_all([upload, attachment])
+            await db.commit()
+            
+            return _upload_status(upload, attachment.id)
+    
+    storage_key = f"attachments/{current_user.id}/{upload_id}"
+    backend_state = await get_storage().start_upload(storage_key, upload_data.content_type)
+    
+    upload = AttachmentUpload(
+        id=upload_id,
+        user_id=current_user.id,
+        storage_key=storage_key,
+        filename=upload_data.filename,
+        content_type=upload_data.content_type,
+        total_size=upload_data.total_size,
+        bytes_received=0,
+        backend_state=backend_state,
+        status=UploadStatus.IN_PROGRESS
+    )
+    db.add(upload)
+    await db.commit()
+    
+    return _upload_status(upload)
+
+@router.get("/uploads/{upload_id}", response_model=UploadStatusResponse)
+async def get_upload(
+    upload_id: str,
+    current_user: Principal = Depends(get_token_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get upload progress (the offset to resume from)"""
+    return _upload_status(await _get_upload(upload_id, current_user.id, db))
+
+@router.put("/uploads/{upload_id}", response_model=UploadStatusResponse)
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(..., alias="Upload-Offset"),
+    current_user: Principal = Depends(get_token_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    """Append the streamed request body at Upload-Offset"""
+    
+    upload = await _get_upload(upload_id, current_user.id, db)
+    
+    if upload.status != UploadStatus.IN_PROGRESS:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Upload is not in progress"
+        )
+    
+    if upload_offset != upload.bytes_received:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={"message": "Offset mismatch", "bytes_received": upload.bytes_received}
+        )
+    
+    # Backend state is mutated in place, so work on a copy the ORM will see as changed
+    backend_state = dict(upload.backend_state or {})
+    try:
+        written = await get_storage().write_chunk(
+            upload.storage_key,
+            backend_state,
+            upload_offset,
+            _limit_body(request.stream(), upload.total_size - upload_offset),
+            upload.total_size
+        )
+    except StorageError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    
+    upload.bytes_received = upload_offset + written
+    upload.backend_state = backend_state
+    await db.commit()
+    
+    return _upload_status(upload)
+
+@router.post("/uploads/{upload_id}/complete", response_model=AttachmentResponse)
+async def complete_upload(
+    upload_id: str,
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    """Finish an upload and turn it into an attachment"""
+    
+    upload = await _get_upload(upload_id, current_user.id, db)
+    
+    if upload.status != UploadStatus.IN_PROGRESS or upload.bytes_received != upload.total_size:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={"message": "Upload is incomplete", "bytes_received": upload.bytes_received}
+        )
+    
+    await get_storage().complete_upload(upload.storage_key, upload.backend_state or {})
+    
+    # Identical content already stored collapses onto the existing blob; the
+    # reference and the attachment holding it are committed together
+    uploaded_key = upload.storage_key
+    blob = await BlobService.ingest(uploaded_key, upload.total_size, db)
+    
+    attachment = Attachment(
+        user_id=current_user.id,
+        storage_key=blob.storage_key,
+        filename=upload.filename,
+        content_type=upload.content_type,
+        size=upload.total_size
+    )
+    db.add(attachment)
+    upload.storage_key = blob.storage_key
+    upload.status = UploadStatus.COMPLETED
+    await db.commit()
+    await db.refresh(attachment)
+    
+    if blob.storage_key != uploaded_key:
+        # Same bytes are already stored - drop the duplicate copy
+        await get_storage().delete(uploaded_key)
+    
+    if MediaService.is_image(attachment.content_type):
+        media_pipeline.enqueue(blob.sha256)
+    
+    return _attachment_response(attachment, await MediaService.list_variants(blob.storage_key, db))
+
+@router.delete("/uploads/{upload_id}")
+async def abort_upload(
+    upload_id: str,
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    """Abort an upload and discard received bytes"""
+    
+    upload = await _get_upload(upload_id, current_user.id, db)
+    
+    if upload.status == UploadStatus.IN_PROGRESS:
+        await get_storage().abort_upload(upload.storage_key, upload.backend_state or {})
+        upload.status = UploadStatus.ABORTED
+        await db.commit()
+    
+    return {"message": "Upload aborted"}
+
+@router.get("/{attachment_id}", response_model=AttachmentResponse)
+async def get_attachment(
+    attachment_id: int,
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get attachment metadata, including which lightweight variants are ready"""
+    
+    attachment = await _get_attachment(attachment_id, current_user.id, db)
+    
+    return _attachment_response(attachment, await MediaService.list_variants(attachment.storage_key, db))
+
+@router.get("/{attachment_id}/url", response_model=DownloadUrlResponse)
+async def get_download_url(
+    attachment_id: int,
+    variant: Optional[str] = Query(None, description="Derivative to serve instead of the original, e.g. thumb"),
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get an expiring download URL for an attachment or one of its variants"""
+    
+    attachment = await _get_attachment(attachment_id, current_user.id, db)
+    expires_in = settings.ATTACHMENT_URL_EXPIRE_SECONDS
+    
+    if variant:
+        if variant not in VARIANTS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown variant. Available: {', '.join(VARIANTS)}"
+            )
+        
+        derived = await MediaService.get_variant(attachment.storage_key, variant, db)
+        if not derived:
+            # Don't silently fall back to the full-size original
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Variant not available"
+            )
+        
+        url = await get_storage().presigned_url(derived.storage_key, expires_in)
+    else:
+        url = await get_storage().presigned_url(attachment.storage_key, expires_in, attachment.filename)
+    
+    if not url:
+        url = f"/api/attachments/download/{create_download_token(attachment.id, expires_in, variant)}"
+    
+    return DownloadUrlResponse(url=url, expires_in=expires_in, variant=variant)
+
+@router.delete("/{attachment_id}")
+async def delete_attachment(
+    attachment_id: int,
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    """Delete an attachment; its bytes are reclaimed once no attachment references them"""
+    
+    attachment = await _get_attachment(attachment_id, current_user.id, db)
+    
+    await BlobService.release(attachment.storage_key, db)
+    await db.delete(attachment)
+    await db.commit()
+    
+    return {"message": "Attachment deleted"}
+
+@router.get("/download/{token}")
+async def download_attachment(
+    token: str,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    db: AsyncSession = Depends(get_db)
+):
+    """Stream an attachment through a signed URL, honoring HTTP Range requests"""
+    
+    decoded = decode_download_token(token)
+    if decoded is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid or expired download link"
+        )
+    
+    attachment_id, variant = decoded
+    attachment = await db.get(Attachment, attachment_id)
+    
+    if not attachment:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Attachment not found"
+        )
+    
+    storage_key, size, content_type = attachment.storage_key, attachment.size, attachment.content_type
+    filename = attachment.filename or str(attachment.id)
+    disposition = "attachment"
+    if variant:
+        derived = await MediaService.get_variant(attachment.storage_key, variant, db)
+        if not derived:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Variant not available"
+            )
+        storage_key, size, content_type = derived.storage_key, derived.size, derived.content_type
+        filename = f"{attachment.id}-{variant}"
+        disposition = "inline"
+    
+    try:
+        byte_range = _parse_range(range_header, size)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    
+    start, end = byte_range or (0, size - 1)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(end - start + 1),
+        "Content-Disposition": f'{disposition}; filename="{filename}"'
+    }
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    
+    return StreamingResponse(
+        get_storage().read_range(storage_key, start, end),
+        status_code=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+        media_type=content_type,
+        headers=headers
+    )
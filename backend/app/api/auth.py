@@ -1,7 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
+from typing import Dict, List, Optional
 from jose import JWTError, jwt
 import pyotp
 import qrcode
@@ -10,53 +12,193 @@ import base64
 
 from app.core.database import get_db
 from app.core.security import (
-    verify_password, 
-    get_password_hash, 
     create_access_token,
     MessageEncryption
 )
 from app.core.config import settings
-from app.models.user import User
+from app.models.user import User, SubscriptionTier
 from app.models.companion import AICompanion, CompanionPersonality
-from app.api.schemas import UserCreate, UserLogin, Token, UserResponse, TwoFactorSetup, TwoFactorVerify
+from app.api.schemas import (
+    UserCreate, UserLogin, Token, UserResponse, TwoFactorSetup, TwoFactorVerify,
+    RefreshRequest, RefreshedToken, SessionResponse
+)
 from app.services.email_service import EmailService
+from app.services.user_cache import UserCache, user_cache
+from app.services.password_service import PasswordHasherBusy, password_hasher
+from app.services.session_service import SessionService
+from app.api.rate_limits import rate_limit_by_ip
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
 
-# Dependency to get current user from token
-async def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
-) -> User:
-    """Get current authenticated user"""
+class Principal:
+    """The authenticated caller, built from token claims and (optionally) the cached users row.
     
-    credentials_exception = HTTPException(
+    Carries what most endpoints need without hydrating the User ORM entity;
+    use get_current_user where the full User is required.
+    """
+    
+    def __init__(
+        self,
+        id: int,
+        email: str,
+        subscription_tier: SubscriptionTier,
+        is_admin: bool,
+        token_version: int,
+        encryption_key: Optional[str] = None,
+        data_version: int = 0,
+        search_index_enabled: bool = False
+    ):
+        self.id = id
+        self.email = email
+        self.subscription_tier = subscription_tier
+        self.is_admin = is_admin
+        self.token_version = token_version
+        self.encryption_key = encryption_key
+        self.data_version = data_version
+        self.search_index_enabled = search_index_enabled
+
+def create_user_token(user) -> str:
+    """Access token carrying the claims Principal is built from"""
+    return create_access_token(data={
+        "sub": user.email,
+        "user_id": user.id,
+        "tier": (user.subscription_tier or SubscriptionTier.FREE).value,
+        "admin": bool(user.is_admin),
+        "tv": user.token_version or 0
+    })
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    
+
+def _decode_claims(token: str) -> Dict:
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
+        raise _credentials_exception()
     
-    user = db.query(User).filter(User.email == email).first()
-    if user is None:
-        raise credentials_exception
+    if payload.get("sub") is None:
+        raise _credentials_exception()
+    
+    return payload
+
+async def _cached_user_snapshot(db: AsyncSession, user_id: Optional[int], email: Optional[str] = None) -> Optional[Dict]:
+    """A users row as a plain dict, from the auth cache or a single-table query"""
+    
+    snapshot = await user_cache.get(user_id) if user_id else None
+    if snapshot and (email is None or snapshot["email"] == email):
+        return snapshot
+    
+    generation = user_cache.generation(user_id) if user_id else 0
+    condition = User.email == email if email else User.id == user_id
+    row = (await db.execute(select(User.__table__).where(condition))).mappings().first()
+    if row is None:
+        return None
+    
+    snapshot = dict(row)
+    await user_cache.set(snapshot["id"], snapshot, generation)
+    return snapshot
+
+async def _load_user_snapshot(claims: Dict, db: AsyncSession) -> Dict:
+    """The caller's users row, rejecting deactivated accounts and revoked tokens"""
+    
+    snapshot = await _cached_user_snapshot(db, claims.get("user_id"), claims["sub"])
+    
+    if snapshot is None or not snapshot["is_active"] or claims.get("tv", 0) != (snapshot["token_version"] or 0):
+        raise _credentials_exception()
+    
+    return snapshot
+
+def _principal_from_snapshot(snapshot: Dict) -> Principal:
+    return Principal(
+        id=snapshot["id"],
+        email=snapshot["email"],
+        subscription_tier=snapshot["subscription_tier"] or SubscriptionTier.FREE,
+        is_admin=bool(snapshot["is_admin"]),
+        token_version=snapshot["token_version"] or 0,
+        encryption_key=snapshot["encryption_key"],
+        data_version=snapshot["data_version"] or 0,
+        search_index_enabled=bool(snapshot["search_index_enabled"])
+    )
+
+async def get_token_principal(token: str = Depends(oauth2_scheme)) -> Principal:
+    """Principal from token claims alone - no cache or database lookup.
+    
+    Tier, admin and revocation changes only apply once the token is reissued,
+    so use this for endpoints that just need the caller's ID.
+    """
+    
+    claims = _decode_claims(token)
+    if claims.get("user_id") is None:
+        raise _credentials_exception()
+    
+    return Principal(
+        id=claims["user_id"],
+        email=claims["sub"],
+        subscription_tier=SubscriptionTier(claims.get("tier", SubscriptionTier.FREE.value)),
+        is_admin=claims.get("admin", False),
+        token_version=claims.get("tv", 0)
+    )
+
+async def get_principal(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_db)
+) -> Principal:
+    """Principal checked against the cached users row (token version, deactivation, current tier)"""
+    
+    return _principal_from_snapshot(await _load_user_snapshot(_decode_claims(token), db))
+
+# Dependency to get current user from token
+async def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_db)
+) -> User:
+    """Get current authenticated user as a full User entity"""
+    
+    snapshot = await _load_user_snapshot(_decode_claims(token), db)
+    
+    # Attach the row so handlers can modify and commit it
+    user = UserCache.to_user(snapshot)
+    db.add(user)
     
     return user
 
-@router.post("/signup", response_model=Token, status_code=status.HTTP_201_CREATED)
-async def signup(user_data: UserCreate, db: Session = Depends(get_db)):
+def _hasher_busy_exception() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many sign-in attempts right now, please retry shortly",
+        headers={"Retry-After": "1"}
+    )
+
+async def _hash_password(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise _hasher_busy_exception()
+
+async def _issue_refresh_token(user_id: int, request: Request, db: AsyncSession) -> str:
+    return await SessionService.issue(
+        user_id,
+        db,
+        device_info=(request.headers.get("user-agent") or "")[:255] or None,
+        ip_address=request.client.host if request.client else None
+    )
+
+@router.post(
+    "/signup",
+    response_model=Token,
+    status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(rate_limit_by_ip("signup", "10/hour"))]
+)
+async def signup(user_data: UserCreate, request: Request, db: AsyncSession = Depends(get_db)):
     """Register a new user"""
     
     # Check if user exists
-    existing_user = db.query(User).filter(User.email == user_data.email).first()
+    existing_user = (await db.scalars(select(User).where(User.email == user_data.email))).first()
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -66,14 +208,14 @@ async def signup(user_data: UserCreate, db: Session = Depends(get_db)):
     # Create user
     user = User(
         email=user_data.email,
-        hashed_password=get_password_hash(user_data.password),
+        hashed_password=await _hash_password(user_data.password),
         full_name=user_data.full_name,
         encryption_key=MessageEncryption.generate_user_key()
     )
     
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     
     # Create AI Companion for user
     companion = AICompanion(
@@ -81,7 +223,7 @@ async def signup(user_data: UserCreate, db: Session = Depends(get_db)):
         personality=CompanionPersonality.SUPPORTIVE_FRIEND
     )
     db.add(companion)
-    db.commit()
+    await db.commit()
     
     # Send welcome email
     EmailService.send_welcome_email(
@@ -90,23 +232,34 @@ async def signup(user_data: UserCreate, db: Session = Depends(get_db)):
     )
     
     # Generate access token
-    access_token = create_access_token(
-        data={"sub": user.email, "user_id": user.id}
-    )
+    access_token = create_user_token(user)
+    refresh_token = await _issue_refresh_token(user.id, request, db)
     
     return {
         "access_token": access_token,
+        "refresh_token": refresh_token,
         "token_type": "bearer",
         "user": user
     }
 
-@router.post("/login", response_model=Token)
-async def login(credentials: UserLogin, db: Session = Depends(get_db)):
+@router.post("/login", response_model=Token, dependencies=[Depends(rate_limit_by_ip("login", "20/minute"))])
+async def login(credentials: UserLogin, request: Request, db: AsyncSession = Depends(get_db)):
     """Login user"""
     
     # Find user
-    user = db.query(User).filter(User.email == credentials.email).first()
-    if not user or not verify_password(credentials.password, user.hashed_password):
+    user = (await db.scalars(select(User).where(User.email == credentials.email))).first()
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect email or password"
+        )
+    
+    try:
+        verified, new_hash = await password_hasher.verify_and_update(credentials.password, user.hashed_password)
+    except PasswordHasherBusy:
+        raise _hasher_busy_exception()
+    
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password"
@@ -119,19 +272,101 @@ async def login(credentials: UserLogin, db: Session = Depends(get_db)):
             detail="Account is disabled"
         )
     
+    # Transparently upgrade bcrypt (or outdated argon2) hashes
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
+    
     # Generate access token
-    access_token = create_access_token(
-        data={"sub": user.email, "user_id": user.id}
-    )
+    access_token = create_user_token(user)
+    refresh_token = await _issue_refresh_token(user.id, request, db)
     
     return {
         "access_token": access_token,
+        "refresh_token": refresh_token,
         "token_type": "bearer",
         "user": user
     }
 
+@router.post("/refresh", response_model=RefreshedToken, dependencies=[Depends(rate_limit_by_ip("refresh", "60/minute"))])
+async def refresh(refresh_data: RefreshRequest, request: Request, db: AsyncSession = Depends(get_db)):
+    """Exchange a refresh token for a new access token and a new refresh token (no password check)"""
+    
+    invalid_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid or expired refresh token"
+    )
+    
+    rotated = await SessionService.rotate(
+        refresh_data.refresh_token,
+        db,
+        ip_address=request.client.host if request.client else None
+    )
+    if rotated is None:
+        raise invalid_exception
+    
+    user_id, refresh_token = rotated
+    snapshot = await _cached_user_snapshot(db, user_id)
+    if snapshot is None or not snapshot["is_active"]:
+        await SessionService.revoke(refresh_token, db)
+        raise invalid_exception
+    
+    return {
+        "access_token": create_user_token(_principal_from_snapshot(snapshot)),
+        "refresh_token": refresh_token,
+        "token_type": "bearer"
+    }
+
+@router.post("/logout")
+async def logout(refresh_data: RefreshRequest, db: AsyncSession = Depends(get_db)):
+    """Revoke a refresh token; the current access token lapses on its own"""
+    await SessionService.revoke(refresh_data.refresh_token, db)
+    return {"message": "Logged out"}
+
+@router.post("/logout-all")
+async def logout_all(
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    """Revoke every session and every access token issued so far"""
+    
+    revoked = await SessionService.revoke_all(current_user.id, db)
+    await db.execute(
+        update(User)
+        .where(User.id == current_user.id)
+        .values(token_version=User.token_version + 1)
+    )
+    UserCache.invalidate_on_commit(db, current_user.id)
+    await db.commit()
+    
+    return {"message": "Logged out everywhere", "sessions_revoked": revoked}
+
+@router.get("/sessions", response_model=List[SessionResponse])
+async def list_sessions(
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    """List active sign-in sessions"""
+    return await SessionService.list_active(current_user.id, db)
+
+@router.delete("/sessions/{session_id}")
+async def revoke_session(
+    session_id: int,
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    """Sign out one session"""
+    
+    if not await SessionService.revoke_by_id(session_id, current_user.id, db):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session not found"
+        )
+    
+    return {"message": "Session revoked"}
+
 @router.post("/2fa/setup", response_model=TwoFactorSetup)
-async def setup_2fa(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def setup_2fa(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
     """Setup 2FA for user"""
     
     # Generate TOTP secret
@@ -155,7 +390,7 @@ async def setup_2fa(db: Session = Depends(get_db), current_user: User = Depends(
     
     # Save secret (not enabled yet)
     current_user.totp_secret = secret
-    db.commit()
+    await db.commit()
     
     return {
         "secret": secret,
@@ -165,7 +400,7 @@ async def setup_2fa(db: Session = Depends(get_db), current_user: User = Depends(
 @router.post("/2fa/verify")
 async def verify_2fa(
     verification: TwoFactorVerify,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """Verify and enable 2FA"""
@@ -186,7 +421,7 @@ async def verify_2fa(
     
     # Enable 2FA
     current_user.is_2fa_enabled = True
-    db.commit()
+    await db.commit()
     
     return {"message": "2FA enabled successfully"}
 
@@ -1,15 +1,31 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import json
+import random
 
-from app.core.database import get_db
-from app.models.user import User
+from app.core.config import settings
+from app.core.database import get_db, AsyncSessionLocal
 from app.models.companion import AICompanion, CompanionConversation, CompanionPersonality
-from app.services.companion_service import AICompanionService
-from app.api.auth import get_current_user
-from pydantic import BaseModel
+from app.models.user import User
+from app.services.companion_service import AICompanionService, CHECKIN_FALLBACKS
+from app.services.llm_client import llm_client, LLMOverloaded, LLMUnavailable
+from app.services.llm_scheduler import LLMShed, bind_caller
+from app.services.summary_service import ConversationSummaryService
+from app.services.memory_service import vector_memory
+from app.api.auth import Principal, get_principal
+from app.api.rate_limits import rate_limit
+from app.services.version_service import VersionService
+from pydantic import BaseModel, Field
+
+async def _bind_llm_caller(current_user: Principal = Depends(get_principal)):
+    # LLM calls made while serving this request are scheduled as this user's
+    bind_caller(current_user.id, current_user.subscription_tier)
 
-router = APIRouter()
+router = APIRouter(dependencies=[Depends(_bind_llm_caller)])
 
 class ChatMessage(BaseModel):
     message: str
@@ -23,65 +39,119 @@ class PersonalityUpdate(BaseModel):
     personality: CompanionPersonality
     custom_instructions: str = None
 
-@router.post("/chat", response_model=ChatResponse)
-async def chat_with_companion(
-    chat_data: ChatMessage,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    """Chat with AI companion"""
+class CheckinSettings(BaseModel):
+    daily_checkin_enabled: bool
+    checkin_time: Optional[str] = Field(None, pattern=r"^([01][0-9]|2[0-3]):[0-5][0-9]$")  # "HH:MM" UTC
+
+def _llm_overloaded_exception(retry_after: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Your companion is busy right now, please retry shortly",
+        headers={"Retry-After": str(retry_after)}
+    )
+
+async def _load_chat_context(user_id: int, db: AsyncSession) -> Tuple[AICompanion, List[Dict]]:
+    """Get or create the user's companion and its turns not yet in the summary (oldest first)"""
     
-    # Get or create user's companion
-    companion = db.query(AICompanion).filter(
-        AICompanion.user_id == current_user.id
-    ).first()
+    companion = (await db.scalars(select(AICompanion).where(
+        AICompanion.user_id == user_id
+    ))).first()
     
     if not companion:
         companion = AICompanion(
-            user_id=current_user.id,
+            user_id=user_id,
             personality=CompanionPersonality.SUPPORTIVE_FRIEND
         )
         db.add(companion)
-        db.commit()
-        db.refresh(companion)
+        await db.commit()
+        await db.refresh(companion)
     
-    # Get conversation history
-    conversations = db.query(CompanionConversation).filter(
-        CompanionConversation.companion_id == companion.id
-    ).order_by(CompanionConversation.created_at.desc()).limit(10).all()
+    conversations = (await db.scalars(select(CompanionConversation).where(
+        CompanionConversation.companion_id == companion.id,
+        CompanionConversation.id > (companion.summarized_through_id or 0)
+    ).order_by(CompanionConversation.id.desc()).limit(
+        settings.COMPANION_RECENT_TURNS + settings.COMPANION_SUMMARY_BATCH_TURNS
+    ))).all()
     
     conversation_history = [
         {
+            "id": conv.id,
             "user_message": conv.user_message,
             "companion_response": conv.companion_response
         }
         for conv in reversed(conversations)
     ]
     
-    # Generate response
-    result = await AICompanionService.generate_response(
-        user_message=chat_data.message,
-        personality=companion.personality,
-        conversation_history=conversation_history,
-        user_context=companion.user_context or {},
-        custom_instructions=companion.custom_instructions
+    return companion, conversation_history
+
+async def _recall_memories(user_id: int, companion_id: int, user_message: str, conversation_history: List[Dict], db: AsyncSession) -> List[str]:
+    """Past moments relevant to the message, skipping turns already in the prompt verbatim"""
+    return await vector_memory.recall(
+        user_id, companion_id, user_message, db,
+        exclude=[("conversation", turn["id"]) for turn in conversation_history]
     )
-    
-    # Save conversation
+
+async def _save_conversation(
+    companion: AICompanion,
+    user_id: int,
+    user_message: str,
+    response: str,
+    detected_emotion: str,
+    db: AsyncSession
+) -> CompanionConversation:
     conversation = CompanionConversation(
         companion_id=companion.id,
-        user_message=chat_data.message,
-        companion_response=result["response"],
-        detected_emotion=result["detected_emotion"],
-        message_count=len(conversations) + 1
+        user_message=user_message,
+        companion_response=response,
+        detected_emotion=detected_emotion,
+        message_count=companion.total_conversations + 1
     )
     db.add(conversation)
     
     # Update companion stats
-    companion.last_interaction = conversation.created_at
+    companion.last_interaction = datetime.utcnow()
     companion.total_conversations += 1
+    await VersionService.bump(db, user_id)
     
-    db.commit()
+    await db.commit()
+    
+    return conversation
+
+@router.post(
+    "/chat",
+    response_model=ChatResponse,
+    dependencies=[Depends(rate_limit("companion-chat", "60/minute", free="10/minute"))]
+)
+async def chat_with_companion(
+    chat_data: ChatMessage,
+    background_tasks: BackgroundTasks,
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    """Chat with AI companion"""
+    
+    companion, conversation_history = await _load_chat_context(current_user.id, db)
+    memories = await _recall_memories(current_user.id, companion.id, chat_data.message, conversation_history, db)
+    
+    # Generate response
+    try:
+        result = await AICompanionService.generate_response(
+            user_message=chat_data.message,
+            personality=companion.personality,
+            conversation_history=conversation_history,
+            user_context=companion.user_context or {},
+            custom_instructions=companion.custom_instructions,
+            conversation_summary=companion.conversation_summary,
+            memories=memories
+        )
+    except LLMOverloaded as e:
+        raise _llm_overloaded_exception(e.retry_after)
+    
+    await _save_conversation(
+        companion, current_user.id, chat_data.message, result["response"], result["detected_emotion"], db
+    )
+    if ConversationSummaryService.needs_summary(len(conversation_history) + 1):
+        background_tasks.add_task(ConversationSummaryService.summarize, companion.id)
     
     return ChatResponse(
         response=result["response"],
@@ -89,17 +159,106 @@ async def chat_with_companion(
         suggestions=result["suggestions"]
     )
 
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def _stream_chat(
+    user_id: int,
+    companion_id: int,
+    user_message: str,
+    personality: CompanionPersonality,
+    conversation_history: List[Dict],
+    user_context: Dict,
+    custom_instructions: str,
+    conversation_summary: str,
+    memories: List[str]
+) -> AsyncIterator[str]:
+    """Yield SSE events for a streamed reply, then persist the finished turn"""
+    
+    tokens = []
+    detected_emotion = "reflective"
+    
+    async for kind, value in AICompanionService.stream_response(
+        user_message=user_message,
+        personality=personality,
+        conversation_history=conversation_history,
+        user_context=user_context,
+        custom_instructions=custom_instructions,
+        conversation_summary=conversation_summary,
+        memories=memories
+    ):
+        if kind == "token":
+            tokens.append(value)
+            yield _sse("token", {"text": value})
+        else:
+            if kind == "emotion":
+                detected_emotion = value
+            yield _sse(kind, value)
+    
+    # The generator outlives the request dependencies, so it owns its session
+    async with AsyncSessionLocal() as db:
+        companion = await db.get(AICompanion, companion_id)
+        conversation = await _save_conversation(
+            companion, user_id, user_message, "".join(tokens), detected_emotion, db
+        )
+        yield _sse("done", {"conversation_id": conversation.id})
+
+@router.post(
+    "/chat/stream",
+    dependencies=[Depends(rate_limit("companion-chat", "60/minute", free="10/minute"))]
+)
+async def stream_chat_with_companion(
+    chat_data: ChatMessage,
+    background_tasks: BackgroundTasks,
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    """Chat with AI companion, streaming the reply as Server-Sent Events.
+    
+    Events: "token" ({"text"}) as the reply is generated, then "emotion",
+    "suggestions" and finally "done" ({"conversation_id"}) once the turn is saved.
+    """
+    
+    # Once streaming starts the status is sent, so shed up front
+    try:
+        llm_client.scheduler.check((current_user.id, current_user.subscription_tier))
+    except LLMShed as e:
+        raise _llm_overloaded_exception(e.retry_after)
+    
+    companion, conversation_history = await _load_chat_context(current_user.id, db)
+    memories = await _recall_memories(current_user.id, companion.id, chat_data.message, conversation_history, db)
+    
+    # Runs once the stream has finished and the turn is saved
+    if ConversationSummaryService.needs_summary(len(conversation_history) + 1):
+        background_tasks.add_task(ConversationSummaryService.summarize, companion.id)
+    
+    return StreamingResponse(
+        _stream_chat(
+            current_user.id,
+            companion.id,
+            chat_data.message,
+            companion.personality,
+            conversation_history,
+            companion.user_context or {},
+            companion.custom_instructions,
+            companion.conversation_summary,
+            memories
+        ),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.put("/personality")
 async def update_personality(
     update_data: PersonalityUpdate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
 ):
     """Update companion personality"""
     
-    companion = db.query(AICompanion).filter(
+    companion = (await db.scalars(select(AICompanion).where(
         AICompanion.user_id == current_user.id
-    ).first()
+    ))).first()
     
     if not companion:
         raise HTTPException(
@@ -109,21 +268,47 @@ async def update_personality(
     
     companion.personality = update_data.personality
     companion.custom_instructions = update_data.custom_instructions
+    companion.checkin_for = None  # Pre-generated check-in was written in the old voice
     
-    db.commit()
+    await db.commit()
     
     return {"message": "Personality updated successfully"}
 
-@router.get("/daily-checkin")
+@router.put("/checkin-settings")
+async def update_checkin_settings(
+    update_data: CheckinSettings,
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    """Enable or disable the daily check-in and set its time"""
+    
+    companion = (await db.scalars(select(AICompanion).where(
+        AICompanion.user_id == current_user.id
+    ))).first()
+    
+    if not companion:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Companion not found"
+        )
+    
+    companion.daily_checkin_enabled = update_data.daily_checkin_enabled
+    companion.checkin_time = update_data.checkin_time
+    
+    await db.commit()
+    
+    return {"message": "Check-in settings updated successfully"}
+
+@router.get("/daily-checkin", dependencies=[Depends(rate_limit("companion-checkin", "30/hour"))])
 async def get_daily_checkin(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get daily check-in message"""
+    """Get daily check-in message (pre-generated by the scheduler; generated on demand otherwise)"""
     
-    companion = db.query(AICompanion).filter(
+    companion = (await db.scalars(select(AICompanion).where(
         AICompanion.user_id == current_user.id
-    ).first()
+    ))).first()
     
     if not companion:
         raise HTTPException(
@@ -131,27 +316,46 @@ async def get_daily_checkin(
             detail="Companion not found"
         )
     
-    checkin_message = await AICompanionService.generate_daily_checkin(
-        personality=companion.personality,
-        user_context=companion.user_context or {}
-    )
+    today = datetime.utcnow().date()
+    if companion.checkin_for == today and companion.checkin_message:
+        return {"message": companion.checkin_message}
+    
+    try:
+        checkin_message = await AICompanionService.generate_daily_checkin(
+            personality=companion.personality,
+            user_context=companion.user_context or {},
+            fallback=False
+        )
+    except LLMOverloaded as e:
+        raise _llm_overloaded_exception(e.retry_after)
+    except LLMUnavailable:
+        # Not stored, so the next request (or the scheduler) tries again; an
+        # earlier day's check-in reads better than a canned one
+        return {"message": companion.checkin_message or random.choice(CHECKIN_FALLBACKS)}
+    
+    companion.checkin_message = checkin_message
+    companion.checkin_for = today
+    await db.commit()
     
     return {"message": checkin_message}
 
 class MessageCraftRequest(BaseModel):
     intent: str
 
-@router.post("/help-craft-message")
+@router.post(
+    "/help-craft-message",
+    dependencies=[Depends(rate_limit("companion-craft", "30/minute", free="5/minute"))]
+)
 async def help_craft_message(
     request: MessageCraftRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get help crafting a message to future self"""
     
-    companion = db.query(AICompanion).filter(
+    companion = (await db.scalars(select(AICompanion).where(
         AICompanion.user_id == current_user.id
-    ).first()
+    ))).first()
     
     if not companion:
         raise HTTPException(
@@ -159,10 +363,15 @@ async def help_craft_message(
             detail="Companion not found"
         )
     
-    result = await AICompanionService.help_craft_message(
-        user_intent=request.intent,
-        personality=companion.personality,
-        user_context=companion.user_context or {}
-    )
+    user_name = await db.scalar(select(User.full_name).where(User.id == current_user.id))
+    
+    try:
+        result = await AICompanionService.help_craft_message(
+            user_intent=request.intent,
+            personality=companion.personality,
+            user_name=user_name
+        )
+    except LLMOverloaded as e:
+        raise _llm_overloaded_exception(e.retry_after)
     
     return result
@@ -0,0 +1,33 @@
+from fastapi import Request, Response, status
+from typing import Optional
+import time
+
+def make_etag(*parts) -> str:
+    """Build a weak ETag from version stamp parts"""
+    return 'W/"' + "-".join(str(part) for part in parts) + '"'
+
+def time_bucket(seconds: int) -> int:
+    """Current time window, for views whose output drifts with the clock"""
+    return int(time.time() // seconds)
+
+def check_not_modified(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """Set the ETag on the response and return a 304 if the client already has this version"""
+    
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+    
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return None
+    
+    # Weak comparison: W/"x" and "x" refer to the same version
+    opaque_tag = etag.removeprefix("W/")
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == opaque_tag:
+            return Response(
+                status_code=status.HTTP_304_NOT_MODIFIED,
+                headers={"ETag": etag, "Cache-Control": "private, no-cache"}
+            )
+    
+    return None
@@ -1,63 +1,126 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.database import get_db
-from app.models.user import User
-from app.api.auth import get_current_user
+from app.api.auth import Principal, get_principal
+from app.api.conditional import make_etag, time_bucket, check_not_modified
 from app.services.delivery_service import DeliveryService
+from app.services.version_service import VersionService
+from pydantic import BaseModel
+from typing import List
 
 router = APIRouter()
 
+class BulkMarkRead(BaseModel):
+    message_ids: List[int] = []
+    all_delivered: bool = False
+
 @router.get("/stats")
 async def get_delivery_stats(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    response: Response,
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get overall delivery statistics"""
-    return DeliveryService.get_delivery_stats(db)
+    global_stamp = await VersionService.get_global_stamp(db)
+    etag = make_etag("delivery-stats", global_stamp, time_bucket(60))
+    if cached := check_not_modified(request, response, etag):
+        return cached
+    
+    return await DeliveryService.get_delivery_stats(db)
 
 @router.get("/upcoming")
 async def get_upcoming_deliveries(
+    request: Request,
+    response: Response,
     days: int = 7,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get messages scheduled for delivery in the next N days"""
-    return DeliveryService.get_upcoming_deliveries(db, days)
+    global_stamp = await VersionService.get_global_stamp(db)
+    etag = make_etag("delivery-upcoming", days, global_stamp, time_bucket(60))
+    if cached := check_not_modified(request, response, etag):
+        return cached
+    
+    return await DeliveryService.get_upcoming_deliveries(db, days)
 
 @router.get("/overdue")
 async def get_overdue_deliveries(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    response: Response,
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get messages that should have been delivered but weren't"""
-    return DeliveryService.get_overdue_deliveries(db)
+    global_stamp = await VersionService.get_global_stamp(db)
+    etag = make_etag("delivery-overdue", global_stamp, time_bucket(60))
+    if cached := check_not_modified(request, response, etag):
+        return cached
+    
+    return await DeliveryService.get_overdue_deliveries(db)
 
 @router.get("/timeline")
 async def get_delivery_timeline(
+    request: Request,
+    response: Response,
     days: int = 30,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get delivery timeline for charts"""
-    return DeliveryService.get_delivery_timeline(db, days)
+    global_stamp = await VersionService.get_global_stamp(db)
+    etag = make_etag("delivery-timeline", days, global_stamp, time_bucket(3600))
+    if cached := check_not_modified(request, response, etag):
+        return cached
+    
+    return await DeliveryService.get_delivery_timeline(db, days)
 
 @router.get("/my-stats")
 async def get_my_delivery_stats(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    response: Response,
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get delivery stats for current user"""
-    return DeliveryService.get_user_delivery_stats(current_user.id, db)
+    etag = make_etag("delivery-my-stats", current_user.id, current_user.data_version, time_bucket(3600))
+    if cached := check_not_modified(request, response, etag):
+        return cached
+    
+    return await DeliveryService.get_user_delivery_stats(current_user.id, db)
+
+@router.post("/mark-read")
+async def mark_messages_as_read(
+    selection: BulkMarkRead,
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    """Mark several delivered messages (or all of them) as read"""
+    
+    if not selection.all_delivered and not selection.message_ids:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Provide message_ids or set all_delivered"
+        )
+    
+    updated = await DeliveryService.mark_many_as_read(
+        current_user.id,
+        db,
+        message_ids=None if selection.all_delivered else selection.message_ids
+    )
+    
+    return {"updated": updated}
 
 @router.post("/mark-read/{message_id}")
 async def mark_message_as_read(
     message_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
 ):
     """Mark a message as read"""
-    success = DeliveryService.mark_as_read(message_id, current_user.id, db)
+    success = await DeliveryService.mark_as_read(message_id, current_user.id, db)
     
     if not success:
         raise HTTPException(
@@ -69,8 +132,15 @@ async def mark_message_as_read(
 
 @router.get("/performance")
 async def get_delivery_performance(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    response: Response,
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get delivery performance metrics"""
-    return DeliveryService.get_delivery_performance(db)
+    global_stamp = await VersionService.get_global_stamp(db)
+    etag = make_etag("delivery-performance", global_stamp)
+    if cached := check_not_modified(request, response, etag):
+        return cached
+    
+    return await DeliveryService.get_delivery_performance(db)
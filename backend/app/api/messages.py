@@ -1,18 +1,38 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, insert, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from datetime import datetime
+import json
+import logging
 
-from app.core.database import get_db
+from app.core.database import get_db, AsyncSessionLocal
 from app.core.security import MessageEncryption
 from app.models.user import User
 from app.models.message import Message, MessageType, MessageStatus, DeliveryTiming
-from app.api.auth import get_current_user
+from app.models.companion import AICompanion, CompanionConversation
+from app.models import MessageReaction
+from app.api.auth import Principal, get_principal, get_current_user
+from app.api.conditional import make_etag, check_not_modified
 from app.services.timing_service import AITimingService
 from app.services.payment_service import PaymentService
-from pydantic import BaseModel
+from app.services.version_service import VersionService
+from app.services.search_service import SearchService
+from app.services.memory_service import vector_memory
+from pydantic import BaseModel, ValidationError
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Rows inserted per statement/commit during bulk import
+BULK_IMPORT_CHUNK_SIZE = 500
+
+# Longest NDJSON line accepted by bulk import; longer lines are reported and skipped unread
+BULK_IMPORT_MAX_LINE_BYTES = 256 * 1024
+
+# Rows fetched from the server-side cursor per chunk during export
+EXPORT_CHUNK_SIZE = 500
 
 class MessageCreate(BaseModel):
     content: str
@@ -37,16 +57,29 @@ class MessageResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class BulkMessageSelection(BaseModel):
+    message_ids: List[int] = []
+    status: MessageStatus | None = None
+
+class BulkImportError(BaseModel):
+    line: int
+    error: str
+
+class BulkImportResponse(BaseModel):
+    imported: int
+    failed: int
+    errors: List[BulkImportError]
+
 @router.post("/", response_model=MessageResponse, status_code=status.HTTP_201_CREATED)
 async def create_message(
     message_data: MessageCreate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
 ):
     """Create a new message to future self"""
     
     # Check message limit based on subscription tier
-    limit_check = PaymentService.check_message_limit(current_user, db)
+    limit_check = await PaymentService.check_message_limit(current_user, db)
     if not limit_check["allowed"]:
         raise HTTPException(
             status_code=status.HTTP_402_PAYMENT_REQUIRED,
@@ -64,7 +97,7 @@ async def create_message(
     )
     
     # Calculate optimal delivery time using AI
-    optimal_delivery = AITimingService.calculate_optimal_delivery(
+    optimal_delivery = await AITimingService.calculate_optimal_delivery(
         message_content=message_data.content,
         user_id=current_user.id,
         delivery_timing=message_data.delivery_timing,
@@ -93,8 +126,17 @@ async def create_message(
     )
     
     db.add(message)
-    db.commit()
-    db.refresh(message)
+    await VersionService.bump(db, current_user.id)
+    if await SearchService.is_enabled(current_user.id, db):
+        await db.flush()
+        await SearchService.index_messages(
+            current_user.id,
+            current_user.encryption_key,
+            [(message.id, message_data.content)],
+            db
+        )
+    await db.commit()
+    await db.refresh(message)
     
     # Decrypt for response
     decrypted_content = MessageEncryption.decrypt(
@@ -117,20 +159,253 @@ async def create_message(
     
     return response
 
+async def _insert_import_chunk(
+    chunk: List[Tuple[int, MessageCreate]],
+    current_user: Principal,
+    user_patterns: Dict,
+    db: AsyncSession
+) -> List[BulkImportError]:
+    """Encrypt, schedule and insert one chunk of imported messages.
+    
+    Any failure rolls the chunk back and reports each of its lines, so the
+    rest of the import carries on.
+    """
+    
+    try:
+        encrypted_contents = MessageEncryption.encrypt_many(
+            [message_data.content for _, message_data in chunk],
+            current_user.encryption_key
+        )
+        
+        rows = []
+        for (_, message_data), encrypted_content in zip(chunk, encrypted_contents):
+            message_context = AITimingService._analyze_message_context(message_data.content)
+            scheduled_for = AITimingService.calculate_delivery_from_analysis(
+                message_data.delivery_timing,
+                user_patterns,
+                message_context,
+                message_data.scheduled_for
+            )
+            rows.append({
+                "user_id": current_user.id,
+                "encrypted_content": encrypted_content,
+                "message_type": message_data.message_type,
+                "delivery_timing": message_data.delivery_timing,
+                "scheduled_for": scheduled_for,
+                "tags": message_data.tags,
+                "category": message_data.category,
+                "status": MessageStatus.SCHEDULED
+            })
+        
+        message_ids = (await db.scalars(
+            insert(Message).returning(Message.id, sort_by_parameter_order=True),
+            rows
+        )).all()
+        await VersionService.bump(db, current_user.id)
+        if await SearchService.is_enabled(current_user.id, db):
+            await SearchService.index_messages(
+                current_user.id,
+                current_user.encryption_key,
+                zip(message_ids, [message_data.content for _, message_data in chunk]),
+                db
+            )
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Bulk import chunk failed for user {current_user.id}: {str(e)}")
+        return [BulkImportError(line=line, error="Failed to store message") for line, _ in chunk]
+    
+    return []
+
+@router.post("/bulk", response_model=BulkImportResponse)
+async def bulk_import_messages(
+    request: Request,
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    """Import messages from a streamed NDJSON body (one message object per line)"""
+    
+    # Tier limit and user patterns are resolved once for the whole import
+    limit_check = await PaymentService.check_message_limit(current_user, db)
+    remaining = limit_check["remaining"]
+    user_patterns = await AITimingService._analyze_user_patterns(current_user.id, db)
+    
+    imported = 0
+    errors: List[BulkImportError] = []
+    chunk: List[Tuple[int, MessageCreate]] = []
+    
+    async def flush_chunk():
+        nonlocal imported, remaining
+        chunk_errors = await _insert_import_chunk(chunk, current_user, user_patterns, db)
+        errors.extend(chunk_errors)
+        imported += len(chunk) - len(chunk_errors)
+        if remaining is not None:
+            # Rows that were not stored don't count against the tier limit
+            remaining += len(chunk_errors)
+        logger.info(f"Bulk import for user {current_user.id}: {imported} messages imported")
+        chunk.clear()
+    
+    async def handle_line(line_number: int, raw_line: bytes):
+        nonlocal remaining
+        if not raw_line.strip():
+            return
+        
+        try:
+            message_data = MessageCreate.model_validate(json.loads(raw_line))
+        except json.JSONDecodeError as e:
+            errors.append(BulkImportError(line=line_number, error=f"Invalid JSON: {e.msg}"))
+            return
+        except UnicodeDecodeError:
+            errors.append(BulkImportError(line=line_number, error="Invalid JSON: not UTF-8 encoded"))
+            return
+        except ValidationError as e:
+            details = "; ".join(
+                f"{'.'.join(str(loc) for loc in err['loc'])}: {err['msg']}" for err in e.errors()
+            )
+            errors.append(BulkImportError(line=line_number, error=details))
+            return
+        
+        if remaining is not None:
+            if remaining <= 0:
+                errors.append(BulkImportError(line=line_number, error="Message limit reached for your tier"))
+                return
+            remaining -= 1
+        
+        chunk.append((line_number, message_data))
+        if len(chunk) >= BULK_IMPORT_CHUNK_SIZE:
+            await flush_chunk()
+    
+    def line_too_long(line_number: int):
+        errors.append(BulkImportError(line=line_number, error=f"Line exceeds {BULK_IMPORT_MAX_LINE_BYTES} bytes"))
+    
+    # Only the current partial line is buffered, and never beyond the line cap
+    buffer = bytearray()
+    oversized = False  # The current line was already reported as too long; skip to its end
+    line_number = 0
+    async for data in request.stream():
+        start = 0
+        while (end := data.find(b"\n", start)) >= 0:
+            line_number += 1
+            if oversized:
+                oversized = False
+            elif len(buffer) + end - start > BULK_IMPORT_MAX_LINE_BYTES:
+                line_too_long(line_number)
+            else:
+                buffer += data[start:end]
+                await handle_line(line_number, bytes(buffer))
+            buffer.clear()
+            start = end + 1
+        
+        if oversized:
+            continue
+        if len(buffer) + len(data) - start > BULK_IMPORT_MAX_LINE_BYTES:
+            line_too_long(line_number + 1)
+            buffer.clear()
+            oversized = True
+        else:
+            buffer += data[start:]
+    
+    if buffer:
+        await handle_line(line_number + 1, bytes(buffer))
+    if chunk:
+        await flush_chunk()
+    
+    errors.sort(key=lambda error: error.line)
+    
+    return BulkImportResponse(
+        imported=imported,
+        failed=len(errors),
+        errors=errors
+    )
+
+def _bulk_selection_conditions(selection: BulkMessageSelection, user_id: int) -> List:
+    """WHERE clause for a bulk message operation, always scoped to the user"""
+    
+    if not selection.message_ids and selection.status is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Provide message_ids or a status filter"
+        )
+    
+    conditions = [Message.user_id == user_id]
+    if selection.message_ids:
+        conditions.append(Message.id.in_(selection.message_ids))
+    if selection.status is not None:
+        conditions.append(Message.status == selection.status)
+    return conditions
+
+@router.post("/bulk-archive")
+async def bulk_archive_messages(
+    selection: BulkMessageSelection,
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    """Archive delivered/read messages matching the IDs and/or status filter"""
+    
+    conditions = _bulk_selection_conditions(selection, current_user.id)
+    result = await db.execute(
+        update(Message)
+        .where(*conditions, Message.status.in_([MessageStatus.DELIVERED, MessageStatus.READ]))
+        .values(status=MessageStatus.ARCHIVED)
+        .execution_options(synchronize_session=False)
+    )
+    
+    if result.rowcount:
+        await VersionService.bump(db, current_user.id)
+    await db.commit()
+    
+    return {"archived": result.rowcount}
+
+@router.post("/bulk-delete")
+async def bulk_delete_messages(
+    selection: BulkMessageSelection,
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    """Delete messages matching the IDs and/or status filter"""
+    
+    conditions = _bulk_selection_conditions(selection, current_user.id)
+    
+    # Core DELETE skips the ORM cascade, so remove reactions, search postings and memories explicitly
+    await SearchService.remove_messages(select(Message.id).where(*conditions), db)
+    await vector_memory.remove_messages(current_user.id, select(Message.id).where(*conditions), db)
+    await db.execute(
+        delete(MessageReaction)
+        .where(MessageReaction.message_id.in_(select(Message.id).where(*conditions)))
+        .execution_options(synchronize_session=False)
+    )
+    result = await db.execute(
+        delete(Message)
+        .where(*conditions)
+        .execution_options(synchronize_session=False)
+    )
+    
+    if result.rowcount:
+        await VersionService.bump(db, current_user.id)
+    await db.commit()
+    
+    return {"deleted": result.rowcount}
+
 @router.get("/", response_model=List[MessageResponse])
 async def get_messages(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db),
     status: MessageStatus = None
 ):
     """Get all messages for current user"""
     
-    query = db.query(Message).filter(Message.user_id == current_user.id)
+    etag = make_etag("messages", status.value if status else "all", current_user.id, current_user.data_version)
+    if cached := check_not_modified(request, response, etag):
+        return cached
+    
+    query = select(Message).where(Message.user_id == current_user.id)
     
     if status:
-        query = query.filter(Message.status == status)
+        query = query.where(Message.status == status)
     
-    messages = query.order_by(Message.created_at.desc()).all()
+    messages = (await db.scalars(query.order_by(Message.created_at.desc()))).all()
     
     # Decrypt messages
     response = []
@@ -153,18 +428,156 @@ async def get_messages(
     
     return response
 
+def _isoformat(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+def _export_line(record: Dict) -> str:
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+async def _export_account(user_id: int, encryption_key: str) -> AsyncIterator[str]:
+    """Yield NDJSON export records, reading each table through a server-side cursor"""
+    
+    # The generator outlives the request dependencies, so it owns its session
+    async with AsyncSessionLocal() as db:
+        yield _export_line({"type": "export", "user_id": user_id, "exported_at": _isoformat(datetime.utcnow())})
+        
+        messages = await db.stream_scalars(
+            select(Message)
+            .where(Message.user_id == user_id)
+            .order_by(Message.id)
+            .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+        )
+        async for partition in messages.partitions():
+            yield "".join(_export_line({
+                "type": "message",
+                "id": message.id,
+                "content": MessageEncryption.decrypt(message.encrypted_content, encryption_key),
+                "message_type": message.message_type.value,
+                "status": message.status.value,
+                "delivery_timing": message.delivery_timing.value,
+                "scheduled_for": _isoformat(message.scheduled_for),
+                "delivered_at": _isoformat(message.delivered_at),
+                "read_at": _isoformat(message.read_at),
+                "created_at": _isoformat(message.created_at),
+                "tags": message.tags,
+                "category": message.category,
+                "attachment_urls": message.attachment_urls
+            }) for message in partition)
+        
+        reactions = await db.stream_scalars(
+            select(MessageReaction)
+            .join(Message, MessageReaction.message_id == Message.id)
+            .where(Message.user_id == user_id)
+            .order_by(MessageReaction.id)
+            .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+        )
+        async for partition in reactions.partitions():
+            yield "".join(_export_line({
+                "type": "reaction",
+                "id": reaction.id,
+                "message_id": reaction.message_id,
+                "reaction_type": reaction.reaction_type,
+                "content": MessageEncryption.decrypt(reaction.encrypted_content, encryption_key)
+                if reaction.encrypted_content else None,
+                "attachment_url": reaction.attachment_url,
+                "created_at": _isoformat(reaction.created_at)
+            }) for reaction in partition)
+        
+        conversations = await db.stream_scalars(
+            select(CompanionConversation)
+            .join(AICompanion, CompanionConversation.companion_id == AICompanion.id)
+            .where(AICompanion.user_id == user_id)
+            .order_by(CompanionConversation.id)
+            .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+        )
+        async for partition in conversations.partitions():
+            yield "".join(_export_line({
+                "type": "companion_conversation",
+                "id": conversation.id,
+                "user_message": conversation.user_message,
+                "companion_response": conversation.companion_response,
+                "detected_emotion": conversation.detected_emotion,
+                "created_at": _isoformat(conversation.created_at)
+            }) for conversation in partition)
+
+@router.post("/search/enable")
+async def enable_search(
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Opt in to message search and index existing messages"""
+    indexed = await SearchService.enable(current_user, db)
+    return {"message": "Search enabled", "indexed": indexed}
+
+@router.post("/search/disable")
+async def disable_search(
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Opt out of message search and drop the search index"""
+    await SearchService.disable(current_user, db)
+    return {"message": "Search disabled"}
+
+@router.get("/search", response_model=List[MessageResponse])
+async def search_messages(
+    q: str,
+    limit: int = 20,
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    """Search messages by words; only matching messages are decrypted"""
+    
+    if not current_user.search_index_enabled:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Search is not enabled for this account"
+        )
+    
+    messages = await SearchService.search(current_user, q, db, limit=min(limit, 100))
+    
+    return [
+        MessageResponse(
+            id=message.id,
+            content=MessageEncryption.decrypt(message.encrypted_content, current_user.encryption_key),
+            message_type=message.message_type.value,
+            status=message.status.value,
+            delivery_timing=message.delivery_timing.value,
+            scheduled_for=message.scheduled_for,
+            delivered_at=message.delivered_at,
+            created_at=message.created_at,
+            tags=message.tags
+        )
+        for message in messages
+    ]
+
+@router.get("/export")
+async def export_messages(current_user: Principal = Depends(get_principal)):
+    """Stream an NDJSON export of the user's messages, reactions and companion conversations"""
+    
+    return StreamingResponse(
+        _export_account(current_user.id, current_user.encryption_key),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="future-you-export.ndjson"'}
+    )
+
 @router.get("/{message_id}", response_model=MessageResponse)
 async def get_message(
     message_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    response: Response,
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
 ):
     """Get specific message"""
     
-    message = db.query(Message).filter(
+    etag = make_etag("message", message_id, current_user.id, current_user.data_version)
+    if cached := check_not_modified(request, response, etag):
+        return cached
+    
+    message = (await db.scalars(select(Message).where(
         Message.id == message_id,
         Message.user_id == current_user.id
-    ).first()
+    ))).first()
     
     if not message:
         raise HTTPException(
@@ -192,15 +605,15 @@ async def get_message(
 @router.delete("/{message_id}")
 async def delete_message(
     message_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_principal),
+    db: AsyncSession = Depends(get_db)
 ):
     """Delete a message"""
     
-    message = db.query(Message).filter(
+    message = (await db.scalars(select(Message).where(
         Message.id == message_id,
         Message.user_id == current_user.id
-    ).first()
+    ))).first()
     
     if not message:
         raise HTTPException(
@@ -208,7 +621,10 @@ async def delete_message(
             detail="Message not found"
         )
     
-    db.delete(message)
-    db.commit()
+    await SearchService.remove_messages([message.id], db)
+    await vector_memory.remove_messages(current_user.id, [message.id], db)
+    await db.delete(message)
+    await VersionService.bump(db, current_user.id)
+    await db.commit()
     
     return {"message": "Message deleted successfully"}
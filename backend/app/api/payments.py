@@ -1,11 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 
 from app.core.database import get_db
 from app.models.user import User, SubscriptionTier
 from app.api.auth import get_current_user
 from app.services.payment_service import PaymentService
+from app.services.version_service import VersionService
 
 router = APIRouter()
 
@@ -22,7 +24,7 @@ class CheckoutResponse(BaseModel):
 async def create_checkout_session(
     request: CheckoutRequest,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Create Stripe checkout session for subscription upgrade"""
     
@@ -58,7 +60,7 @@ async def create_checkout_session(
 async def create_portal_session(
     return_url: str,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Create Stripe customer portal session for managing subscription"""
     
@@ -84,7 +86,7 @@ async def create_portal_session(
 @router.post("/webhook")
 async def stripe_webhook(
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Handle Stripe webhook events"""
     
@@ -107,26 +109,29 @@ async def stripe_webhook(
     
     # Process the webhook action
     if result.get("action") == "upgrade_user":
-        user = db.query(User).filter(User.id == result["user_id"]).first()
+        user = (await db.scalars(select(User).where(User.id == result["user_id"]))).first()
         if user:
             user.subscription_tier = SubscriptionTier(result["tier"])
             user.subscription_status = "active"
             user.stripe_customer_id = result.get("stripe_customer_id")
             user.stripe_subscription_id = result.get("stripe_subscription_id")
-            db.commit()
+            await VersionService.bump(db, user.id)
+            await db.commit()
     
     elif result.get("action") == "downgrade_user":
-        user = db.query(User).filter(User.id == result["user_id"]).first()
+        user = (await db.scalars(select(User).where(User.id == result["user_id"]))).first()
         if user:
             user.subscription_tier = SubscriptionTier.FREE
             user.subscription_status = "cancelled"
-            db.commit()
+            await VersionService.bump(db, user.id)
+            await db.commit()
     
     elif result.get("action") == "update_subscription_status":
-        user = db.query(User).filter(User.id == result["user_id"]).first()
+        user = (await db.scalars(select(User).where(User.id == result["user_id"]))).first()
         if user:
             user.subscription_status = result["status"]
-            db.commit()
+            await VersionService.bump(db, user.id)
+            await db.commit()
     
     return {"status": "success"}
 
@@ -138,22 +143,22 @@ async def get_pricing():
 @router.get("/check-limit")
 async def check_message_limit(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Check if user can create more messages"""
-    return PaymentService.check_message_limit(current_user, db)
+    return await PaymentService.check_message_limit(current_user, db)
 
 @router.get("/mrr")
 async def get_mrr(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Get Monthly Recurring Revenue (admin only)"""
     
     # In production, add admin check here
     # For now, anyone can see it
     
-    return PaymentService.calculate_mrr(db)
+    return await PaymentService.calculate_mrr(db)
 
 @router.get("/subscription")
 async def get_subscription_info(
@@ -0,0 +1,51 @@
+from fastapi import Depends, HTTPException, Request, status
+from app.core.config import settings
+from app.models.user import SubscriptionTier
+from app.services.rate_limiter import parse_limit, rate_limiter
+
+def _too_many_requests(retry_after: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Rate limit exceeded, please slow down",
+        headers={"Retry-After": str(retry_after)}
+    )
+
+def rate_limit(name: str, default: str, **tier_limits: str):
+    """Per-user limit for a route, e.g. rate_limit("companion-chat", "20/minute", free="5/minute").
+    
+    Tiers not listed use the default; the key includes the tier, so an upgrade
+    starts a fresh window.
+    """
+    from app.api.auth import Principal, get_principal
+    
+    limits = {tier: parse_limit(default) for tier in SubscriptionTier}
+    for tier, limit in tier_limits.items():
+        limits[SubscriptionTier(tier)] = parse_limit(limit)
+    
+    async def dependency(current_user: Principal = Depends(get_principal)):
+        if not settings.RATE_LIMIT_ENABLED:
+            return
+        
+        tier = current_user.subscription_tier
+        limit, window = limits[tier]
+        retry_after = await rate_limiter.hit(f"rl:{name}:{tier.value}:{current_user.id}", limit, window)
+        if retry_after is not None:
+            raise _too_many_requests(retry_after)
+    
+    return dependency
+
+def rate_limit_by_ip(name: str, limit: str):
+    """Per-client-address limit for unauthenticated routes such as login"""
+    
+    count, window = parse_limit(limit)
+    
+    async def dependency(request: Request):
+        if not settings.RATE_LIMIT_ENABLED:
+            return
+        
+        client = request.client.host if request.client else "unknown"
+        retry_after = await rate_limiter.hit(f"rl:{name}:ip:{client}", count, window)
+        if retry_after is not None:
+            raise _too_many_requests(retry_after)
+    
+    return dependency
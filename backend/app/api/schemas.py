@@ -13,9 +13,28 @@ class UserLogin(BaseModel):
 
 class Token(BaseModel):
     access_token: str
+    refresh_token: Optional[str] = None
     token_type: str = "bearer"
     user: "UserResponse"
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class RefreshedToken(BaseModel):
+    access_token: str
+    refresh_token: str
+    token_type: str = "bearer"
+
+class SessionResponse(BaseModel):
+    id: int
+    device_info: Optional[str]
+    ip_address: Optional[str]
+    created_at: datetime
+    expires_at: datetime
+    
+    class Config:
+        from_attributes = True
+
 class UserResponse(BaseModel):
     id: int
     email: str
@@ -29,6 +48,9 @@ class UserResponse(BaseModel):
     class Config:
         from_attributes = True
 
+# Token refers to UserResponse before it is defined
+Token.model_rebuild()
+
 class TwoFactorSetup(BaseModel):
     secret: str
     qr_code: str
@@ -10,16 +10,124 @@ class Settings(BaseSettings):
     SECRET_KEY: str = "dev-secret-key-change-in-production"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    REFRESH_TOKEN_EXPIRE_DAYS: int = 30
+    
+    # Authenticated user and refresh session caches (Redis tier is shared between workers)
+    AUTH_CACHE_TTL_SECONDS: int = 15
+    AUTH_CACHE_MAX_ENTRIES: int = 10000
+    AUTH_CACHE_REDIS: bool = False
+    AUTH_CACHE_REDIS_TTL_SECONDS: int = 300
+    
+    # Rate limiting (Redis makes limits global across workers and replicas)
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_REDIS: bool = False
+    RATE_LIMIT_LEASE_FRACTION: float = 0.1  # Share of a limit a worker may reserve per Redis call
+    RATE_LIMIT_MAX_KEYS: int = 100000
+    
+    # Password hashing (argon2id, run off the event loop)
+    ARGON2_MEMORY_COST_KIB: int = 19456
+    ARGON2_TIME_COST: int = 2
+    ARGON2_PARALLELISM: int = 1
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_QUEUE: int = 64
     ENCRYPTION_KEY: str = "dev-encryption-key-change-in-production"
     
     # OpenAI
     OPENAI_API_KEY: str = "sk-test"
+    LLM_BACKEND: str = "openai"  # "openai" or "fake" (deterministic local stand-in for load tests)
+    LLM_MAX_CONCURRENCY: int = 16  # Completions in flight per worker
+    LLM_MAX_CONNECTIONS: int = 20
+    LLM_TIMEOUT_SECONDS: float = 20.0
+    LLM_CONNECT_TIMEOUT_SECONDS: float = 5.0
+    LLM_MAX_RETRIES: int = 1
+    LLM_HEALTH_BACKOFF_SECONDS: float = 30.0  # Doubles after each failed probe
+    LLM_HEALTH_BACKOFF_MAX_SECONDS: float = 600.0
+    
+    # LLM scheduling: the LLM_MAX_CONCURRENCY slots are shared fairly between users
+    LLM_USER_MAX_CONCURRENCY: int = 2  # Slots one free user may hold
+    LLM_PAID_USER_MAX_CONCURRENCY: int = 4  # Premium, lifetime and ultra
+    LLM_PAID_WEIGHT: int = 3  # Paid calls are dequeued this many times as often as free ones
+    LLM_USER_MAX_QUEUED: int = 4  # Further calls from a user with this many waiting get a 429
+    LLM_MAX_QUEUE_WAIT_SECONDS: float = 5.0  # Calls expected to wait longer get a 429 up front
+    LLM_SCHEDULER_REDIS: bool = False  # Also enforce limits across workers
+    LLM_GLOBAL_MAX_CONCURRENCY: int = 64  # All workers together, with LLM_SCHEDULER_REDIS
+    
+    # Circuit breaker per model, judged over its last LLM_BREAKER_WINDOW calls
+    LLM_BREAKER_WINDOW: int = 20
+    LLM_BREAKER_MIN_CALLS: int = 10
+    LLM_BREAKER_ERROR_RATE: float = 0.5
+    LLM_BREAKER_SLOW_CALL_SECONDS: float = 6.0  # Time to first token for streams
+    LLM_BREAKER_SLOW_RATE: float = 0.5
+    LLM_BREAKER_OPEN_SECONDS: float = 30.0  # Then one trial call decides
+    
+    # Fake LLM backend: time to first token follows the distribution, then tokens stream at a fixed rate
+    FAKE_LLM_LATENCY_DISTRIBUTION: str = "lognormal"  # "fixed", "uniform" or "lognormal"
+    FAKE_LLM_LATENCY_P50_MS: float = 600.0
+    FAKE_LLM_LATENCY_P99_MS: float = 3000.0
+    FAKE_LLM_TOKENS_PER_SECOND: float = 60.0
+    FAKE_LLM_ERROR_RATE: float = 0.0
+    FAKE_LLM_TIMEOUT_RATE: float = 0.0
+    FAKE_LLM_OUTAGE: bool = False
+    FAKE_LLM_SEED: int = 0
+    
+    # Companion chat: overall deadline, and a cheaper model to fall back to (or race against a slow primary)
+    COMPANION_CHAT_TIMEOUT_SECONDS: float = 12.0
+    COMPANION_FALLBACK_MODEL: Optional[str] = "gpt-3.5-turbo"
+    COMPANION_HEDGE_AFTER_SECONDS: Optional[float] = 6.0  # None: only fall back after the primary fails
+    
+    # Companion prompt size (tokens); older turns are folded into a rolling summary
+    COMPANION_PROMPT_TOKEN_BUDGET: int = 1500
+    COMPANION_RECENT_TURNS: int = 6  # Turns kept verbatim before they're summarized
+    COMPANION_SUMMARY_BATCH_TURNS: int = 4  # Summarize once this many turns have aged out
+    COMPANION_SUMMARY_MAX_TOKENS: int = 300
+    COMPANION_CONTEXT_MAX_TOKENS: int = 200
+    COMPANION_MEMORY_MAX_TOKENS: int = 250
+    
+    # Companion vector memory ("hashing" runs offline; "openai" uses the embeddings API)
+    MEMORY_EMBEDDER: str = "hashing"
+    MEMORY_HASHING_DIM: int = 256
+    MEMORY_OPENAI_MODEL: str = "text-embedding-3-small"
+    MEMORY_OPENAI_DIM: int = 1536
+    MEMORY_TOP_K: int = 4
+    MEMORY_MIN_SIMILARITY: Optional[float] = None  # Defaults to the embedder's own threshold
+    MEMORY_EXACT_SEARCH_MAX: int = 5000  # Larger indexes shortlist candidates by signature first
+    MEMORY_CACHE_MAX_USERS: int = 1000
+    MEMORY_CACHE_TTL_SECONDS: int = 300
+    
+    # Help-craft response cache: near-duplicate intents with the same personality share a draft
+    HELP_CRAFT_CACHE_ENABLED: bool = True
+    HELP_CRAFT_CACHE_MAX_ENTRIES: int = 2000
+    HELP_CRAFT_CACHE_TTL_SECONDS: int = 86400
+    HELP_CRAFT_CACHE_MIN_SIMILARITY: Optional[float] = None  # Defaults to the embedder's duplicate threshold
+    
+    # Daily check-ins, generated ahead of each user's checkin_time
+    CHECKIN_DEFAULT_TIME: str = "09:00"  # UTC, for companions without a checkin_time
+    CHECKIN_PRECOMPUTE_LEAD_HOURS: int = 3
+    CHECKIN_PRECOMPUTE_BATCH_SIZE: int = 100
+    CHECKIN_PRECOMPUTE_CONCURRENCY: int = 4
+    CHECKIN_PRECOMPUTE_PER_MINUTE: int = 120  # Paces the job so it leaves LLM capacity for live requests
+    
+    # Emotion detection (local classifier; optionally ask the LLM when it's unsure)
+    EMOTION_LLM_ESCALATION: bool = False
+    EMOTION_CONFIDENCE_THRESHOLD: float = 0.5
     
     # AWS (optional)
     AWS_ACCESS_KEY_ID: str = ""
     AWS_SECRET_ACCESS_KEY: str = ""
     AWS_S3_BUCKET: str = ""
     AWS_REGION: str = "us-east-1"
+    AWS_S3_ENDPOINT_URL: str = ""  # For S3-compatible stores (MinIO, R2, ...)
+    
+    # Attachment storage
+    STORAGE_BACKEND: str = "local"  # "local" or "s3"
+    LOCAL_STORAGE_PATH: str = "./storage"
+    ATTACHMENT_URL_EXPIRE_SECONDS: int = 3600
+    MAX_UPLOAD_CHUNK_BYTES: int = 16 * 1024 * 1024
+    
+    # Image derivatives
+    MEDIA_WORKERS: int = 2
+    MEDIA_QUEUE_SIZE: int = 100
+    MEDIA_MAX_SOURCE_BYTES: int = 25 * 1024 * 1024
     
     # Stripe
     STRIPE_SECRET_KEY: str = "sk_test_"
@@ -1,5 +1,5 @@
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import List, Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from Crypto.Cipher import AES
@@ -8,11 +8,23 @@ from Crypto.Util.Padding import pad, unpad
 import base64
 from app.core.config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# New hashes use argon2id; existing bcrypt hashes still verify and are upgraded on login
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    argon2__type="ID",
+    argon2__memory_cost=settings.ARGON2_MEMORY_COST_KIB,
+    argon2__time_cost=settings.ARGON2_TIME_COST,
+    argon2__parallelism=settings.ARGON2_PARALLELISM
+)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify, returning a replacement hash when the stored one uses outdated settings"""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
@@ -33,6 +45,21 @@ def decode_access_token(token: str) -> Optional[dict]:
     except JWTError:
         return None
 
+def create_download_token(attachment_id: int, expires_in: int, variant: Optional[str] = None) -> str:
+    """Short-lived token that authorizes downloading one attachment (or one of its derivatives)"""
+    expire = datetime.utcnow() + timedelta(seconds=expires_in)
+    to_encode = {"sub": f"attachment:{attachment_id}", "typ": "download", "exp": expire}
+    if variant:
+        to_encode["var"] = variant
+    return jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+
+def decode_download_token(token: str) -> Optional[Tuple[int, Optional[str]]]:
+    """Returns (attachment_id, variant) for a valid download token"""
+    payload = decode_access_token(token)
+    if not payload or payload.get("typ") != "download":
+        return None
+    return int(payload["sub"].split(":", 1)[1]), payload.get("var")
+
 class MessageEncryption:
     @staticmethod
     def encrypt(plaintext: str, user_key: str) -> str:
@@ -43,6 +70,18 @@ class MessageEncryption:
         ct = base64.b64encode(ct_bytes).decode('utf-8')
         return f"{iv}:{ct}"
     
+    @staticmethod
+    def encrypt_many(plaintexts: List[str], user_key: str) -> List[str]:
+        key = base64.b64decode(user_key)
+        encrypted = []
+        for plaintext in plaintexts:
+            cipher = AES.new(key, AES.MODE_CBC)
+            ct_bytes = cipher.encrypt(pad(plaintext.encode('utf-8'), AES.block_size))
+            iv = base64.b64encode(cipher.iv).decode('utf-8')
+            ct = base64.b64encode(ct_bytes).decode('utf-8')
+            encrypted.append(f"{iv}:{ct}")
+        return encrypted
+    
     @staticmethod
     def decrypt(ciphertext: str, user_key: str) -> str:
         key = base64.b64decode(user_key)
@@ -1,18 +1,15 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
 from app.core.config import settings
-from app.core.database import engine, Base
+from app.core.database import async_engine, Base
 from app.services.scheduler import scheduler
-
-# Create tables
-Base.metadata.create_all(bind=engine)
-
-# Rate limiter
-limiter = Limiter(key_func=get_remote_address)
+from app.services.media_service import media_pipeline
+from app.services.password_service import password_hasher
+from app.services.llm_client import llm_client
+from app.services.llm_usage import llm_usage
+from app.services.response_cache import help_craft_cache
+from app.services.user_cache import user_cache
 
 app = FastAPI(
     title="Future You API",
@@ -22,10 +19,6 @@ app = FastAPI(
     redoc_url="/api/redoc" if settings.DEBUG else None,
 )
 
-# Rate limiting
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
-
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -48,14 +41,30 @@ async def add_security_headers(request: Request, call_next):
 
 @app.on_event("startup")
 async def startup_event():
-    """Start background scheduler on app startup"""
+    """Create tables and start background scheduler on app startup"""
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    
     scheduler.start()
     scheduler.add_daily_reminder_job()
+    scheduler.add_blob_gc_job()
+    scheduler.add_media_backfill_job()
+    scheduler.add_session_purge_job()
+    scheduler.add_checkin_precompute_job()
+    scheduler.add_llm_usage_flush_job()
+    media_pipeline.start()
+    user_cache.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    """Stop background scheduler on app shutdown"""
+    """Stop background scheduler and close database connections on app shutdown"""
     scheduler.shutdown()
+    await media_pipeline.shutdown()
+    await user_cache.shutdown()
+    password_hasher.shutdown()
+    await llm_client.close()
+    await scheduler.flush_llm_usage()
+    await async_engine.dispose()
 
 @app.get("/")
 async def root():
@@ -69,8 +78,18 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics")
+async def metrics():
+    """Worker-local runtime metrics (unauthenticated, so LLM spend is left out)"""
+    return {
+        "password_hashing": password_hasher.stats(),
+        "llm": llm_client.stats(),
+        "llm_usage": llm_usage.stats(include_cost=False),
+        "help_craft_cache": help_craft_cache.stats(include_cost=False)
+    }
+
 # Import and include routers
-from app.api import auth, messages, companion, payments, analytics, delivery
+from app.api import auth, messages, companion, payments, analytics, delivery, attachments
 
 app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
 app.include_router(messages.router, prefix="/api/messages", tags=["messages"])
@@ -78,3 +97,4 @@ app.include_router(companion.router, prefix="/api/companion", tags=["companion"]
 app.include_router(payments.router, prefix="/api/payments", tags=["payments"])
 app.include_router(analytics.router, prefix="/api/analytics", tags=["analytics"])
 app.include_router(delivery.router, prefix="/api/delivery", tags=["delivery"])
+app.include_router(attachments.router, prefix="/api/attachments", tags=["attachments"])
@@ -7,8 +7,8 @@ class UserSession(Base):
     __tablename__ = "user_sessions"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    token = Column(String, unique=True, index=True, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    token = Column(String, unique=True, index=True, nullable=False)  # SHA-256 of the refresh token
     device_info = Column(String, nullable=True)
     ip_address = Column(String, nullable=True)
     is_active = Column(Boolean, default=True)
@@ -0,0 +1,72 @@
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey, Enum, JSON, UniqueConstraint
+from datetime import datetime
+import enum
+from app.core.database import Base
+
+class UploadStatus(str, enum.Enum):
+    IN_PROGRESS = "in_progress"
+    COMPLETED = "completed"
+    ABORTED = "aborted"
+
+class AttachmentUpload(Base):
+    __tablename__ = "attachment_uploads"
+    
+    id = Column(String, primary_key=True)  # Random upload ID handed to the client
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    
+    # Target object
+    storage_key = Column(String, nullable=False)
+    filename = Column(String, nullable=True)
+    content_type = Column(String, nullable=False)
+    
+    # Progress
+    total_size = Column(BigInteger, nullable=False)
+    bytes_received = Column(BigInteger, default=0)
+    backend_state = Column(JSON, default=dict)  # e.g. S3 multipart upload ID and parts
+    status = Column(Enum(UploadStatus), default=UploadStatus.IN_PROGRESS)
+    
+    # Timestamps
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class Attachment(Base):
+    __tablename__ = "attachments"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    
+    # Stored object
+    storage_key = Column(String, nullable=False)
+    filename = Column(String, nullable=True)
+    content_type = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    
+    # Timestamps
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class Blob(Base):
+    __tablename__ = "blobs"
+    
+    sha256 = Column(String, primary_key=True)  # Content address
+    storage_key = Column(String, unique=True, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    ref_count = Column(Integer, default=0, nullable=False, index=True)  # Attachments pointing at this blob
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class BlobVariant(Base):
+    __tablename__ = "blob_variants"
+    __table_args__ = (UniqueConstraint("blob_sha256", "variant", name="uq_blob_variants_blob_variant"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    blob_sha256 = Column(String, ForeignKey("blobs.sha256"), nullable=False, index=True)
+    variant = Column(String, nullable=False)  # e.g. "thumb", "preview_jpeg"
+    
+    # Derived object
+    storage_key = Column(String, unique=True, nullable=False)
+    content_type = Column(String, nullable=False)
+    width = Column(Integer, nullable=False)
+    height = Column(Integer, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    
+    # Timestamps
+    created_at = Column(DateTime, default=datetime.utcnow)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Enum, JSON, Boolean
+from sqlalchemy import Column, Integer, String, Text, Date, DateTime, ForeignKey, Enum, JSON, Boolean, LargeBinary, Float, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
@@ -25,10 +25,13 @@ class AICompanion(Base):
     # Learning & Memory
     user_context = Column(JSON, default=dict)  # Learned patterns, preferences
     conversation_summary = Column(Text, nullable=True)  # Rolling summary of past conversations
+    summarized_through_id = Column(Integer, nullable=True)  # Last conversation folded into the summary
     
     # Engagement
     daily_checkin_enabled = Column(Boolean, default=False)
-    checkin_time = Column(String, nullable=True)  # "09:00" format
+    checkin_time = Column(String, nullable=True)  # "09:00" format (UTC)
+    checkin_message = Column(Text, nullable=True)  # Pre-generated check-in
+    checkin_for = Column(Date, nullable=True)  # Day checkin_message was generated for
     last_interaction = Column(DateTime, nullable=True)
     total_conversations = Column(Integer, default=0)
     
@@ -39,6 +42,10 @@ class AICompanion(Base):
     # Relationships
     user = relationship("User", backref="companion")
     conversations = relationship("CompanionConversation", back_populates="companion", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        Index("ix_ai_companions_checkin", "daily_checkin_enabled", "checkin_time"),
+    )
 
 class CompanionConversation(Base):
     __tablename__ = "companion_conversations"
@@ -60,3 +67,46 @@ class CompanionConversation(Base):
     
     # Relationships
     companion = relationship("AICompanion", back_populates="conversations")
+
+class CompanionMemory(Base):
+    __tablename__ = "companion_memories"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    
+    # What the memory was built from
+    source_type = Column(String, nullable=False)  # "conversation" or "message" (metadata only, never content)
+    source_id = Column(Integer, nullable=False)
+    content = Column(Text, nullable=False)  # Snippet shown to the companion when recalled
+    
+    # Embedding
+    embedder = Column(String, nullable=False)  # Name of the embedder, so vectors from another model are ignored
+    vector = Column(LargeBinary, nullable=False)  # float16, L2-normalized
+    
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index("ix_companion_memories_user_source", "user_id", "embedder", "source_type", "source_id", unique=True),
+    )
+
+class LLMUsage(Base):
+    """LLM calls made on a user's behalf, aggregated per day, call site, model and tier"""
+    __tablename__ = "llm_usage"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    day = Column(Date, nullable=False, index=True)
+    call_site = Column(String, nullable=False)  # "chat", "emotion", "daily_checkin", ...
+    model = Column(String, nullable=False)
+    tier = Column(String, nullable=False)  # Subscription tier at call time, or "background"
+    
+    calls = Column(Integer, default=0, nullable=False)
+    errors = Column(Integer, default=0, nullable=False)
+    prompt_tokens = Column(Integer, default=0, nullable=False)
+    completion_tokens = Column(Integer, default=0, nullable=False)
+    cost_usd = Column(Float, default=0.0, nullable=False)  # Estimated from list prices
+    latency_ms = Column(Float, default=0.0, nullable=False)  # Sum over calls; divide by calls for the mean
+    
+    __table_args__ = (
+        Index("ix_llm_usage_key", "user_id", "day", "call_site", "model", "tier", unique=True),
+    )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, Enum, JSON
+from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, Enum, JSON, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
@@ -65,3 +65,15 @@ class Message(Base):
     # Relationships
     user = relationship("User", back_populates="messages")
     reactions = relationship("MessageReaction", back_populates="message", cascade="all, delete-orphan")
+
+class MessageSearchToken(Base):
+    __tablename__ = "message_search_tokens"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    message_id = Column(Integer, ForeignKey("messages.id"), nullable=False, index=True)
+    token = Column(String, nullable=False)  # Keyed HMAC of a normalized word, never the word itself
+    
+    __table_args__ = (
+        Index("ix_message_search_tokens_user_token", "user_id", "token"),
+    )
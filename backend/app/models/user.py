@@ -30,6 +30,7 @@ class User(Base):
     encryption_key = Column(String, nullable=False)
     totp_secret = Column(String, nullable=True)
     is_2fa_enabled = Column(Boolean, default=False)
+    search_index_enabled = Column(Boolean, default=False)  # Opt-in blind index for message search
     
     # Timestamps
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -37,6 +38,14 @@ class User(Base):
     last_login = Column(DateTime, nullable=True)
     last_activity = Column(DateTime, nullable=True)
     
+    # Change counter bumped on every write to the user's data (used for ETags)
+    data_version = Column(Integer, default=0, nullable=False)
+    # When data_version was last bumped; indexed so max() is a single index lookup
+    data_changed_at = Column(DateTime, nullable=True, index=True)
+    
+    # Carried in access tokens; bumping it revokes every token issued before
+    token_version = Column(Integer, default=0, nullable=False)
+    
     # Relationships
     messages = relationship("Message", back_populates="user", cascade="all, delete-orphan")
     sessions = relationship("UserSession", back_populates="user", cascade="all, delete-orphan")
@@ -1,58 +1,58 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func, extract
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, extract, select
 from datetime import datetime, timedelta
 from typing import Dict, List
 from app.models.user import User, SubscriptionTier
 from app.models.message import Message, MessageStatus
-from app.models.companion import CompanionConversation
+from app.models.companion import CompanionConversation, LLMUsage
 
 class AnalyticsService:
     """Track and analyze platform metrics for business insights"""
     
     @staticmethod
-    def get_user_analytics(user_id: int, db: Session) -> Dict:
+    async def get_user_analytics(user_id: int, db: AsyncSession) -> Dict:
         """Get analytics for a specific user"""
         
-        user = db.query(User).filter(User.id == user_id).first()
+        user = await db.get(User, user_id)
         if not user:
             return {"error": "User not found"}
         
         # Message stats
-        total_messages = db.query(func.count(Message.id)).filter(
+        total_messages = await db.scalar(select(func.count(Message.id)).where(
             Message.user_id == user_id
-        ).scalar() or 0
+        )) or 0
         
-        scheduled_messages = db.query(func.count(Message.id)).filter(
+        scheduled_messages = await db.scalar(select(func.count(Message.id)).where(
             Message.user_id == user_id,
             Message.status == MessageStatus.SCHEDULED
-        ).scalar() or 0
+        )) or 0
         
-        delivered_messages = db.query(func.count(Message.id)).filter(
+        delivered_messages = await db.scalar(select(func.count(Message.id)).where(
             Message.user_id == user_id,
             Message.status == MessageStatus.DELIVERED
-        ).scalar() or 0
+        )) or 0
         
-        read_messages = db.query(func.count(Message.id)).filter(
+        read_messages = await db.scalar(select(func.count(Message.id)).where(
             Message.user_id == user_id,
             Message.status == MessageStatus.READ
-        ).scalar() or 0
+        )) or 0
         
         # Companion stats
-        total_conversations = db.query(func.count(CompanionConversation.id)).join(
+        total_conversations = await db.scalar(select(func.count(CompanionConversation.id)).join(
             CompanionConversation.companion
-        ).filter(
+        ).where(
             CompanionConversation.companion.has(user_id=user_id)
-        ).scalar() or 0
+        )) or 0
         
         # This month's messages
         current_month = datetime.utcnow().month
         current_year = datetime.utcnow().year
         
-        messages_this_month = db.query(func.count(Message.id)).filter(
+        messages_this_month = await db.scalar(select(func.count(Message.id)).where(
             Message.user_id == user_id,
             extract('month', Message.created_at) == current_month,
             extract('year', Message.created_at) == current_year
-        ).scalar() or 0
+        )) or 0
         
         # Account age
         account_age_days = (datetime.utcnow() - user.created_at).days
@@ -82,49 +82,49 @@ class AnalyticsService:
         }
     
     @staticmethod
-    def get_platform_analytics(db: Session) -> Dict:
+    async def get_platform_analytics(db: AsyncSession) -> Dict:
         """Get overall platform analytics (admin view)"""
         
         # User stats
-        total_users = db.query(func.count(User.id)).scalar() or 0
+        total_users = await db.scalar(select(func.count(User.id))) or 0
         
-        free_users = db.query(func.count(User.id)).filter(
+        free_users = await db.scalar(select(func.count(User.id)).where(
             User.subscription_tier == SubscriptionTier.FREE
-        ).scalar() or 0
+        )) or 0
         
-        premium_users = db.query(func.count(User.id)).filter(
+        premium_users = await db.scalar(select(func.count(User.id)).where(
             User.subscription_tier == SubscriptionTier.PREMIUM
-        ).scalar() or 0
+        )) or 0
         
-        lifetime_users = db.query(func.count(User.id)).filter(
+        lifetime_users = await db.scalar(select(func.count(User.id)).where(
             User.subscription_tier == SubscriptionTier.LIFETIME
-        ).scalar() or 0
+        )) or 0
         
         # Message stats
-        total_messages = db.query(func.count(Message.id)).scalar() or 0
+        total_messages = await db.scalar(select(func.count(Message.id))) or 0
         
-        scheduled_messages = db.query(func.count(Message.id)).filter(
+        scheduled_messages = await db.scalar(select(func.count(Message.id)).where(
             Message.status == MessageStatus.SCHEDULED
-        ).scalar() or 0
+        )) or 0
         
-        delivered_messages = db.query(func.count(Message.id)).filter(
+        delivered_messages = await db.scalar(select(func.count(Message.id)).where(
             Message.status == MessageStatus.DELIVERED
-        ).scalar() or 0
+        )) or 0
         
         # Revenue metrics
         from app.services.payment_service import PaymentService
-        mrr_data = PaymentService.calculate_mrr(db)
+        mrr_data = await PaymentService.calculate_mrr(db)
         
         # Growth metrics (last 30 days)
         thirty_days_ago = datetime.utcnow() - timedelta(days=30)
         
-        new_users_30d = db.query(func.count(User.id)).filter(
+        new_users_30d = await db.scalar(select(func.count(User.id)).where(
             User.created_at >= thirty_days_ago
-        ).scalar() or 0
+        )) or 0
         
-        new_messages_30d = db.query(func.count(Message.id)).filter(
+        new_messages_30d = await db.scalar(select(func.count(Message.id)).where(
             Message.created_at >= thirty_days_ago
-        ).scalar() or 0
+        )) or 0
         
         # Conversion rate
         conversion_rate = ((premium_users + lifetime_users) / total_users * 100) if total_users > 0 else 0
@@ -158,12 +158,12 @@ class AnalyticsService:
         }
     
     @staticmethod
-    def get_message_timeline(user_id: int, db: Session) -> List[Dict]:
+    async def get_message_timeline(user_id: int, db: AsyncSession) -> List[Dict]:
         """Get timeline of user's messages for visualization"""
         
-        messages = db.query(Message).filter(
+        messages = (await db.scalars(select(Message).where(
             Message.user_id == user_id
-        ).order_by(Message.created_at).all()
+        ).order_by(Message.created_at))).all()
         
         timeline = []
         for msg in messages:
@@ -181,7 +181,7 @@ class AnalyticsService:
         return timeline
     
     @staticmethod
-    def get_growth_chart_data(db: Session, days: int = 30) -> Dict:
+    async def get_growth_chart_data(db: AsyncSession, days: int = 30) -> Dict:
         """Get data for growth charts"""
         
         start_date = datetime.utcnow() - timedelta(days=days)
@@ -190,9 +190,9 @@ class AnalyticsService:
         daily_signups = []
         for i in range(days):
             date = start_date + timedelta(days=i)
-            count = db.query(func.count(User.id)).filter(
+            count = await db.scalar(select(func.count(User.id)).where(
                 func.date(User.created_at) == date.date()
-            ).scalar()
+            ))
             daily_signups.append({
                 "date": date.date().isoformat(),
                 "count": count
@@ -202,9 +202,9 @@ class AnalyticsService:
         daily_messages = []
         for i in range(days):
             date = start_date + timedelta(days=i)
-            count = db.query(func.count(Message.id)).filter(
+            count = await db.scalar(select(func.count(Message.id)).where(
                 func.date(Message.created_at) == date.date()
-            ).scalar()
+            ))
             daily_messages.append({
                 "date": date.date().isoformat(),
                 "count": count
@@ -242,23 +242,23 @@ class AnalyticsService:
         return min(int(total_score), 100)
     
     @staticmethod
-    def get_retention_metrics(db: Session) -> Dict:
+    async def get_retention_metrics(db: AsyncSession) -> Dict:
         """Calculate user retention metrics"""
         
         # Users who created messages in last 7 days
         seven_days_ago = datetime.utcnow() - timedelta(days=7)
-        active_7d = db.query(func.count(func.distinct(Message.user_id))).filter(
+        active_7d = await db.scalar(select(func.count(func.distinct(Message.user_id))).where(
             Message.created_at >= seven_days_ago
-        ).scalar()
+        ))
         
         # Users who created messages in last 30 days
         thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-        active_30d = db.query(func.count(func.distinct(Message.user_id))).filter(
+        active_30d = await db.scalar(select(func.count(func.distinct(Message.user_id))).where(
             Message.created_at >= thirty_days_ago
-        ).scalar()
+        ))
         
         # Total users
-        total_users = db.query(func.count(User.id)).scalar()
+        total_users = await db.scalar(select(func.count(User.id)))
         
         return {
             "active_7d": active_7d,
@@ -267,3 +267,59 @@ class AnalyticsService:
             "retention_7d": round((active_7d / total_users * 100), 2) if total_users > 0 else 0,
             "retention_30d": round((active_30d / total_users * 100), 2) if total_users > 0 else 0
         }
+    
+    @staticmethod
+    async def get_llm_usage(db: AsyncSession, days: int = 30, top_users: int = 20) -> Dict:
+        """LLM calls, tokens and estimated cost per call site, model and tier, plus the costliest users"""
+        
+        since = (datetime.utcnow() - timedelta(days=days - 1)).date()
+        totals = (
+            func.sum(LLMUsage.calls).label("calls"),
+            func.sum(LLMUsage.errors).label("errors"),
+            func.sum(LLMUsage.prompt_tokens).label("prompt_tokens"),
+            func.sum(LLMUsage.completion_tokens).label("completion_tokens"),
+            func.sum(LLMUsage.cost_usd).label("cost_usd"),
+            func.sum(LLMUsage.latency_ms).label("latency_ms")
+        )
+        
+        def summarize(row) -> Dict:
+            return {
+                "calls": row.calls,
+                "errors": row.errors,
+                "prompt_tokens": row.prompt_tokens,
+                "completion_tokens": row.completion_tokens,
+                "cost_usd": round(row.cost_usd, 4),
+                "avg_latency_ms": round(row.latency_ms / row.calls, 1) if row.calls else 0
+            }
+        
+        by_site = (await db.execute(
+            select(LLMUsage.call_site, LLMUsage.model, LLMUsage.tier, *totals)
+            .where(LLMUsage.day >= since)
+            .group_by(LLMUsage.call_site, LLMUsage.model, LLMUsage.tier)
+            .order_by(func.sum(LLMUsage.cost_usd).desc())
+        )).all()
+        
+        by_day = (await db.execute(
+            select(LLMUsage.day, *totals)
+            .where(LLMUsage.day >= since)
+            .group_by(LLMUsage.day)
+            .order_by(LLMUsage.day)
+        )).all()
+        
+        by_user = (await db.execute(
+            select(LLMUsage.user_id, *totals)
+            .where(LLMUsage.day >= since)
+            .group_by(LLMUsage.user_id)
+            .order_by(func.sum(LLMUsage.cost_usd).desc())
+            .limit(top_users)
+        )).all()
+        
+        return {
+            "since": since.isoformat(),
+            "by_call_site": [
+                {"call_site": row.call_site, "model": row.model, "tier": row.tier, **summarize(row)}
+                for row in by_site
+            ],
+            "daily": [{"date": row.day.isoformat(), **summarize(row)} for row in by_day],
+            "top_users": [{"user_id": row.user_id, **summarize(row)} for row in by_user]
+        }
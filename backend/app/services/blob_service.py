@@ -0,0 +1,119 @@
+from sqlalchemy import select, update, delete, exists
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+import hashlib
+import logging
+from app.models.attachment import Attachment, Blob, BlobVariant
+from app.services.storage_service import get_storage
+
+logger = logging.getLogger(__name__)
+
+# Unreferenced blobs removed per garbage collection batch
+GC_BATCH_SIZE = 100
+
+class BlobService:
+    """Content-addressed, reference-counted storage of attachment bytes"""
+    
+    @staticmethod
+    async def hash_object(storage_key: str, size: int) -> str:
+        """SHA-256 of a stored object, streamed so memory stays flat"""
+        digest = hashlib.sha256()
+        async for data in get_storage().read_range(storage_key, 0, size - 1):
+            digest.update(data)
+        return digest.hexdigest()
+    
+    @staticmethod
+    async def find_user_blob(user_id: int, sha256: str, db: AsyncSession) -> Optional[Blob]:
+        """A blob with this hash that the user already references, if any"""
+        return (await db.scalars(
+            select(Blob)
+            .join(Attachment, Attachment.storage_key == Blob.storage_key)
+            .where(Attachment.user_id == user_id, Blob.sha256 == sha256)
+            .limit(1)
+        )).first()
+    
+    @staticmethod
+    async def add_reference(sha256: str, db: AsyncSession) -> bool:
+        """Add one reference; False if the blob no longer exists (garbage collected meanwhile)"""
+        result = await db.execute(
+            update(Blob)
+            .where(Blob.sha256 == sha256)
+            .values(ref_count=Blob.ref_count + 1)
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount > 0
+    
+    @staticmethod
+    async def release(storage_key: str, db: AsyncSession):
+        """Drop one reference; the blob is reclaimed later by garbage collection"""
+        await db.execute(
+            update(Blob)
+            .where(Blob.storage_key == storage_key)
+            .values(ref_count=Blob.ref_count - 1)
+            .execution_options(synchronize_session=False)
+        )
+    
+    @staticmethod
+    async def ingest(storage_key: str, size: int, db: AsyncSession) -> Blob:
+        """Register a freshly uploaded object, collapsing it onto an existing blob with the same content.
+        
+        Adds one reference to the returned blob but does not commit, so the
+        caller commits it together with the row that holds the reference. If
+        the returned blob's storage_key differs from storage_key, the upload
+        was a duplicate and its object should be deleted after that commit.
+        """
+        
+        sha256 = await BlobService.hash_object(storage_key, size)
+        insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+        
+        for _ in range(3):
+            result = await db.execute(
+                insert(Blob)
+                .values(sha256=sha256, storage_key=storage_key, size=size, ref_count=1)
+                .on_conflict_do_nothing(index_elements=["sha256"])
+            )
+            # Same content already stored - reference it, unless garbage collection
+            # deleted it after the insert conflicted, in which case insert again
+            if result.rowcount or await BlobService.add_reference(sha256, db):
+                return (await db.scalars(
+                    select(Blob).where(Blob.sha256 == sha256).execution_options(populate_existing=True)
+                )).one()
+        
+        raise RuntimeError(f"Could not register blob {sha256}")
+    
+    @staticmethod
+    async def collect_garbage(db: AsyncSession, batch_size: int = GC_BATCH_SIZE) -> int:
+        """Delete one bounded batch of unreferenced blobs; returns how many were removed"""
+        
+        candidates = (await db.scalars(
+            select(Blob).where(Blob.ref_count <= 0).limit(batch_size)
+        )).all()
+        
+        removed = 0
+        for blob in candidates:
+            # Re-check in each DELETE so a blob re-referenced meanwhile survives
+            unreferenced = exists().where(Blob.sha256 == blob.sha256, Blob.ref_count <= 0)
+            variant_keys = (await db.scalars(
+                select(BlobVariant.storage_key).where(BlobVariant.blob_sha256 == blob.sha256)
+            )).all()
+            await db.execute(
+                delete(BlobVariant)
+                .where(BlobVariant.blob_sha256 == blob.sha256, unreferenced)
+                .execution_options(synchronize_session=False)
+            )
+            result = await db.execute(
+                delete(Blob)
+                .where(Blob.sha256 == blob.sha256, Blob.ref_count <= 0)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+            if result.rowcount:
+                try:
+                    for key in [blob.storage_key, *variant_keys]:
+                        await get_storage().delete(key)
+                    removed += 1
+                except Exception as e:
+                    logger.error(f"Failed to delete blob object {blob.storage_key}: {str(e)}")
+        
+        return removed
@@ -0,0 +1,118 @@
+from sqlalchemy import select, update, func, or_
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
+import asyncio
+import logging
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models.companion import AICompanion
+from app.services.companion_service import AICompanionService
+from app.services.llm_client import llm_client, LLMUnavailable
+from app.services.llm_usage import usage_user
+
+logger = logging.getLogger(__name__)
+
+class CheckinService:
+    """Generates daily check-ins ahead of each companion's checkin_time.
+    
+    The scheduler calls precompute() every hour; it picks up enabled companions
+    whose check-in falls within the lead window and doesn't have a message for
+    that day yet, and stores one on the companion row. GET /daily-checkin then
+    only has to read it.
+    """
+    
+    @staticmethod
+    def _due_windows(now: datetime, lead_hours: int) -> List[Tuple[date, str, str]]:
+        """(day, start, end) "HH:MM" ranges covering [now, now + lead), split at midnight"""
+        
+        end = now + timedelta(hours=lead_hours)
+        start_hhmm = now.strftime("%H:%M")
+        if end.date() == now.date():
+            return [(now.date(), start_hhmm, end.strftime("%H:%M"))]
+        return [(now.date(), start_hhmm, "24:00"), (end.date(), "00:00", end.strftime("%H:%M"))]
+    
+    @staticmethod
+    async def _due_batch(day: date, start: str, end: str, after_id: int, limit: int) -> List[AICompanion]:
+        checkin_time = func.coalesce(AICompanion.checkin_time, settings.CHECKIN_DEFAULT_TIME)
+        async with AsyncSessionLocal() as db:
+            return (await db.scalars(
+                select(AICompanion)
+                .where(
+                    AICompanion.daily_checkin_enabled == True,
+                    checkin_time >= start,
+                    checkin_time < end,
+                    or_(AICompanion.checkin_for.is_(None), AICompanion.checkin_for != day),
+                    AICompanion.id > after_id
+                )
+                .order_by(AICompanion.id)
+                .limit(limit)
+            )).all()
+    
+    @staticmethod
+    async def _generate(companion: AICompanion, semaphore: asyncio.Semaphore) -> Optional[str]:
+        # Runs in its own task (gather), so this only bills this companion's call
+        usage_user.set(companion.user_id)
+        async with semaphore:
+            try:
+                return await AICompanionService.generate_daily_checkin(
+                    personality=companion.personality,
+                    user_context=companion.user_context or {},
+                    fallback=False
+                )
+            except LLMUnavailable:
+                return None
+    
+    @staticmethod
+    async def precompute(now: Optional[datetime] = None) -> int:
+        """Generate and store check-ins due within the lead window; returns how many were stored.
+        
+        Batches run with bounded concurrency and are paced to
+        CHECKIN_PRECOMPUTE_PER_MINUTE. Failed generations are left empty, so the
+        next run (or the endpoint, on demand) tries again; canned fallbacks are
+        never stored.
+        """
+        
+        now = now or datetime.utcnow()
+        if not await llm_client.is_available():
+            logger.info("Skipping check-in precompute: LLM unavailable")
+            return 0
+        
+        batch_size = settings.CHECKIN_PRECOMPUTE_BATCH_SIZE
+        semaphore = asyncio.Semaphore(settings.CHECKIN_PRECOMPUTE_CONCURRENCY)
+        stored = 0
+        
+        for day, start, end in CheckinService._due_windows(now, settings.CHECKIN_PRECOMPUTE_LEAD_HOURS):
+            after_id = 0
+            while True:
+                started = asyncio.get_running_loop().time()
+                companions = await CheckinService._due_batch(day, start, end, after_id, batch_size)
+                if not companions:
+                    break
+                after_id = companions[-1].id
+                
+                # No session is held open while the completions run
+                messages = await asyncio.gather(*[
+                    CheckinService._generate(companion, semaphore) for companion in companions
+                ])
+                generated = [(companion.id, message) for companion, message in zip(companions, messages) if message]
+                if generated:
+                    async with AsyncSessionLocal() as db:
+                        for companion_id, message in generated:
+                            await db.execute(
+                                update(AICompanion)
+                                .where(AICompanion.id == companion_id)
+                                .values(checkin_message=message, checkin_for=day)
+                                .execution_options(synchronize_session=False)
+                            )
+                        await db.commit()
+                    stored += len(generated)
+                
+                if len(companions) < batch_size:
+                    break
+                # Pace the next batch so the job stays under its per-minute budget
+                min_seconds = len(companions) * 60 / settings.CHECKIN_PRECOMPUTE_PER_MINUTE
+                elapsed = asyncio.get_running_loop().time() - started
+                if elapsed < min_seconds:
+                    await asyncio.sleep(min_seconds - elapsed)
+        
+        return stored
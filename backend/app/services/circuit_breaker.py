@@ -0,0 +1,110 @@
+from collections import deque
+from typing import Deque, Dict, Tuple
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitBreaker:
+    """Stops calling a dependency that is failing or too slow.
+    
+    Outcomes of the last `window` calls are kept. Once at least `min_calls`
+    are in, the breaker opens if the share of failures reaches
+    `error_rate_threshold`, or the share of calls slower than `slow_call_seconds`
+    reaches `slow_rate_threshold`. While open, calls are refused without
+    touching the dependency; after `open_seconds` a single trial call is let
+    through (half-open), and its outcome closes or reopens the breaker.
+    Callers pass trial=True for the call admitted as that trial; other
+    outcomes reported while the breaker is not closed are ignored.
+    """
+    
+    def __init__(
+        self,
+        name: str,
+        window: int,
+        min_calls: int,
+        error_rate_threshold: float,
+        slow_call_seconds: float,
+        slow_rate_threshold: float,
+        open_seconds: float
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate_threshold = error_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate_threshold = slow_rate_threshold
+        self.open_seconds = open_seconds
+        self.outcomes: Deque[Tuple[bool, bool]] = deque(maxlen=window)  # (failed, slow)
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        
+        # Metrics
+        self.times_opened = 0
+        self.rejected = 0
+    
+    def allow(self) -> bool:
+        """Whether a call may go through now; in half-open, only one trial at a time"""
+        
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+    
+    def _open(self, reason: str):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.times_opened += 1
+        self.outcomes.clear()
+        logger.warning(f"Circuit {self.name} opened: {reason}")
+    
+    def record(self, failed: bool, latency_seconds: float, trial: bool = False):
+        slow = latency_seconds >= self.slow_call_seconds
+        
+        if trial:
+            if self.state == HALF_OPEN:
+                self.trial_in_flight = False
+                if failed or slow:
+                    self._open("trial call failed" if failed else f"trial call took {latency_seconds:.1f}s")
+                else:
+                    self.state = CLOSED
+                    logger.info(f"Circuit {self.name} closed")
+            return
+        if self.state != CLOSED:
+            # A call admitted before the breaker opened
+            return
+        
+        self.outcomes.append((failed, slow))
+        if len(self.outcomes) < self.min_calls:
+            return
+        error_rate = sum(1 for failed, _ in self.outcomes if failed) / len(self.outcomes)
+        slow_rate = sum(1 for _, slow in self.outcomes if slow) / len(self.outcomes)
+        if error_rate >= self.error_rate_threshold:
+            self._open(f"{error_rate:.0%} of recent calls failed")
+        elif slow_rate >= self.slow_rate_threshold:
+            self._open(f"{slow_rate:.0%} of recent calls took over {self.slow_call_seconds}s")
+    
+    def abandon(self, trial: bool = False):
+        """The call was cancelled before it finished; it says nothing about the dependency"""
+        if trial and self.state == HALF_OPEN:
+            self.trial_in_flight = False
+    
+    def stats(self) -> Dict:
+        calls = len(self.outcomes)
+        return {
+            "state": self.state,
+            "error_rate": round(sum(1 for failed, _ in self.outcomes if failed) / calls, 3) if calls else 0,
+            "slow_rate": round(sum(1 for _, slow in self.outcomes if slow) / calls, 3) if calls else 0,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+            "retry_in_seconds": max(0, round(self.opened_at + self.open_seconds - time.monotonic(), 1)) if self.state == OPEN else 0
+        }
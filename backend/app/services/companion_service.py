@@ -1,10 +1,28 @@
 from app.core.config import settings
 from app.models.companion import CompanionPersonality
-from typing import Dict, List
+from app.services.emotion_service import EmotionService
+from app.services.llm_client import llm_client, LLMOverloaded, LLMUnavailable, estimate_cost
+from app.services.prompt_builder import build_chat_messages, count_tokens
+from app.services.response_cache import help_craft_cache
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import json
 import random
 
-# Don't create client at import time
-client = None
+# Canned answers used when no LLM is configured or the provider is down
+MOCK_RESPONSES = [
+    "That's really interesting! Tell me more about what you're thinking.",
+    "I hear you. Writing to your future self is a powerful way to reflect on your journey.",
+    "What would you want your future self to remember about this moment?",
+    "That sounds meaningful. How do you think you'll feel when you receive this message?",
+    "I'm here to help you craft something special. What matters most to you right now?"
+]
+
+CHECKIN_FALLBACKS = [
+    "Good morning! What's one thing you're looking forward to today?",
+    "Checking in: how are you feeling right now, and what would make today a good day?",
+    "Take a moment for yourself today. What would you like your future self to know about this week?"
+]
 
 PERSONALITY_PROMPTS = {
     CompanionPersonality.MOTIVATIONAL_COACH: """You are an energetic, motivational coach who helps users push through challenges and celebrate wins. 
@@ -30,52 +48,15 @@ PERSONALITY_PROMPTS = {
 
 class AICompanionService:
     @staticmethod
-    def _get_client():
-        """Get OpenAI client or None if unavailable"""
-        global client
-        if client is None:
-            try:
-                from openai import OpenAI
-                if settings.OPENAI_API_KEY and settings.OPENAI_API_KEY.startswith('sk-proj-') and len(settings.OPENAI_API_KEY) > 20:
-                    # Try to create client, but don't fail if key is invalid
-                    try:
-                        client = OpenAI(api_key=settings.OPENAI_API_KEY)
-                        # Test the key with a simple call
-                        client.models.list()
-                        return client
-                    except:
-                        return None
-            except:
-                pass
-        return client
-    
-    @staticmethod
-    async def generate_response(
+    def _build_messages(
         user_message: str,
         personality: CompanionPersonality,
         conversation_history: List[Dict],
         user_context: Dict,
-        custom_instructions: str = None
-    ) -> Dict:
-        """Generate AI companion response based on personality and context"""
-        
-        # Get client or use mock
-        ai_client = AICompanionService._get_client()
-        
-        if not ai_client:
-            mock_responses = [
-                "That's really interesting! Tell me more about what you're thinking.",
-                "I hear you. Writing to your future self is a powerful way to reflect on your journey.",
-                "What would you want your future self to remember about this moment?",
-                "That sounds meaningful. How do you think you'll feel when you receive this message?",
-                "I'm here to help you craft something special. What matters most to you right now?"
-            ]
-            return {
-                "response": random.choice(mock_responses),
-                "detected_emotion": "reflective",
-                "suggestions": ["💡 Create a message about this moment", "🎯 Let AI choose the perfect timing"]
-            }
-        
+        custom_instructions: str = None,
+        conversation_summary: str = None,
+        memories: List[str] = None
+    ) -> List[Dict]:
         system_prompt = f"""{PERSONALITY_PROMPTS[personality]}
 
 You are "Future Buddy", an AI companion in the "Future You" app - a platform where users write messages to their future selves.
@@ -88,57 +69,122 @@ Your role:
 - Suggest optimal timing for message delivery
 - Detect emotional state and respond appropriately
 
-User Context: {user_context}
-
 {f'Additional Instructions: {custom_instructions}' if custom_instructions else ''}
 
 Keep responses conversational, warm, and under 150 words unless the user needs more depth.
 Always prioritize the user's emotional wellbeing and privacy."""
-
-        messages = [{"role": "system", "content": system_prompt}]
         
-        for msg in conversation_history[-10:]:
-            messages.append({"role": "user", "content": msg["user_message"]})
-            messages.append({"role": "assistant", "content": msg["companion_response"]})
+        # Summary, context and recent turns share a fixed budget so prompts stay flat as history grows
+        return build_chat_messages(
+            system_prompt,
+            user_message,
+            conversation_history,
+            settings.COMPANION_PROMPT_TOKEN_BUDGET,
+            summary=conversation_summary,
+            user_context=user_context,
+            memories=memories,
+            summary_max_tokens=settings.COMPANION_SUMMARY_MAX_TOKENS,
+            context_max_tokens=settings.COMPANION_CONTEXT_MAX_TOKENS,
+            memory_max_tokens=settings.COMPANION_MEMORY_MAX_TOKENS
+        )
+    
+    @staticmethod
+    async def generate_response(
+        user_message: str,
+        personality: CompanionPersonality,
+        conversation_history: List[Dict],
+        user_context: Dict,
+        custom_instructions: str = None,
+        conversation_summary: str = None,
+        memories: List[str] = None
+    ) -> Dict:
+        """Generate AI companion response based on personality and context"""
         
-        messages.append({"role": "user", "content": user_message})
+        if not await llm_client.is_available():
+            return {
+                "response": random.choice(MOCK_RESPONSES),
+                "detected_emotion": await AICompanionService._detect_emotion(user_message),
+                "suggestions": ["💡 Create a message about this moment", "🎯 Let AI choose the perfect timing"]
+            }
         
-        response = ai_client.chat.completions.create(
-            model="gpt-4-turbo-preview",
-            messages=messages,
-            temperature=0.8,
-            max_tokens=300
+        messages = AICompanionService._build_messages(
+            user_message, personality, conversation_history, user_context, custom_instructions, conversation_summary, memories
         )
         
-        companion_response = response.choices[0].message.content
-        emotion = await AICompanionService._detect_emotion(user_message)
+        # Emotion detection only needs the user's message, so it runs alongside the reply
+        emotion_task = asyncio.create_task(AICompanionService._detect_emotion(user_message))
+        try:
+            companion_response = await llm_client.chat(
+                messages,
+                model="gpt-4-turbo-preview",
+                timeout=settings.COMPANION_CHAT_TIMEOUT_SECONDS,
+                fallback_model=settings.COMPANION_FALLBACK_MODEL,
+                hedge_after=settings.COMPANION_HEDGE_AFTER_SECONDS,
+                site="chat",
+                temperature=0.8,
+                max_tokens=300
+            )
+        except LLMOverloaded:
+            # Shed by the scheduler: the endpoint answers 429 rather than a canned reply
+            emotion_task.cancel()
+            raise
+        except LLMUnavailable:
+            companion_response = random.choice(MOCK_RESPONSES)
         
         return {
             "response": companion_response,
-            "detected_emotion": emotion,
+            "detected_emotion": await emotion_task,
             "suggestions": await AICompanionService._generate_suggestions(user_message, user_context)
         }
     
+    @staticmethod
+    async def stream_response(
+        user_message: str,
+        personality: CompanionPersonality,
+        conversation_history: List[Dict],
+        user_context: Dict,
+        custom_instructions: str = None,
+        conversation_summary: str = None,
+        memories: List[str] = None
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """Streaming variant of generate_response.
+        
+        Yields ("token", text) as the reply arrives, then ("emotion", str) and
+        ("suggestions", list), which are computed while the reply streams.
+        """
+        
+        messages = AICompanionService._build_messages(
+            user_message, personality, conversation_history, user_context, custom_instructions, conversation_summary, memories
+        )
+        emotion_task = asyncio.create_task(AICompanionService._detect_emotion(user_message))
+        suggestions_task = asyncio.create_task(AICompanionService._generate_suggestions(user_message, user_context))
+        
+        try:
+            try:
+                async for token in llm_client.stream(
+                    messages,
+                    model="gpt-4-turbo-preview",
+                    timeout=settings.COMPANION_CHAT_TIMEOUT_SECONDS,
+                    fallback_model=settings.COMPANION_FALLBACK_MODEL,
+                    site="chat_stream",
+                    temperature=0.8,
+                    max_tokens=300
+                ):
+                    yield "token", token
+            except LLMUnavailable:
+                yield "token", random.choice(MOCK_RESPONSES)
+            
+            yield "emotion", await emotion_task
+            yield "suggestions", await suggestions_task
+        finally:
+            # The client may disconnect mid-stream
+            emotion_task.cancel()
+            suggestions_task.cancel()
+    
     @staticmethod
     async def _detect_emotion(text: str) -> str:
         """Detect emotional tone from user message"""
-        ai_client = AICompanionService._get_client()
-        if not ai_client:
-            return "reflective"
-        
-        response = ai_client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{
-                "role": "system",
-                "content": "Analyze the emotional tone. Respond with ONE word: happy, sad, anxious, excited, reflective, frustrated, hopeful, or neutral."
-            }, {
-                "role": "user",
-                "content": text
-            }],
-            temperature=0.3,
-            max_tokens=10
-        )
-        return response.choices[0].message.content.strip().lower()
+        return await EmotionService.detect(text)
     
     @staticmethod
     async def _generate_suggestions(user_message: str, user_context: Dict) -> List[str]:
@@ -160,51 +206,110 @@ Always prioritize the user's emotional wellbeing and privacy."""
         return suggestions[:3]  # Max 3 suggestions
     
     @staticmethod
-    async def generate_daily_checkin(personality: CompanionPersonality, user_context: Dict) -> str:
-        """Generate personalized daily check-in message"""
+    async def generate_daily_checkin(
+        personality: CompanionPersonality,
+        user_context: Dict,
+        fallback: bool = True
+    ) -> str:
+        """Generate personalized daily check-in message.
+        
+        With fallback=False, LLMUnavailable is raised instead of returning a
+        canned message, so callers that store the result can skip it.
+        LLMOverloaded is always raised.
+        """
         system_prompt = f"""{PERSONALITY_PROMPTS[personality]}
 
 Generate a brief, warm daily check-in message (2-3 sentences) for the user.
 Make it personal based on their context: {user_context}
 Ask an engaging question or offer a thoughtful prompt for the day."""
-
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "system", "content": system_prompt}],
-            temperature=0.9,
-            max_tokens=100
-        )
         
-        return response.choices[0].message.content
+        try:
+            return await llm_client.chat(
+                [{"role": "system", "content": system_prompt}],
+                model="gpt-3.5-turbo",
+                site="daily_checkin",
+                temperature=0.9,
+                max_tokens=100
+            )
+        except LLMUnavailable as e:
+            if not fallback or isinstance(e, LLMOverloaded):
+                raise
+            return random.choice(CHECKIN_FALLBACKS)
     
     @staticmethod
-    async def help_craft_message(
-        user_intent: str,
-        personality: CompanionPersonality,
-        user_context: Dict
-    ) -> Dict:
-        """Help user craft a message to their future self"""
+    async def _craft_draft(user_intent: str, personality: CompanionPersonality) -> Dict:
+        """Generic draft for an intent; shared between users through the response cache"""
         system_prompt = f"""{PERSONALITY_PROMPTS[personality]}
 
 The user wants to create a message to their future self. Help them craft something meaningful.
 
 User's intent: {user_intent}
-User context: {user_context}
 
 Provide:
 1. A draft message they can use or modify
 2. Suggested delivery timing
 3. Why this message matters
 
-Format as JSON with keys: draft_message, suggested_timing, reasoning"""
+Don't invent names or personal details beyond the intent; wherever you would use the user's name, write {{name}}.
 
-        response = client.chat.completions.create(
-            model="gpt-4-turbo-preview",
-            messages=[{"role": "system", "content": system_prompt}],
+Format as JSON with keys: draft_message, suggested_timing, reasoning"""
+        
+        model = "gpt-4-turbo-preview"
+        content = await llm_client.chat(
+            [{"role": "system", "content": system_prompt}],
+            model=model,
+            site="help_craft",
             temperature=0.7,
             max_tokens=400,
             response_format={"type": "json_object"}
         )
+        help_craft_cache.record_spend(estimate_cost(model, count_tokens(system_prompt), count_tokens(content)))
+        result = json.loads(content)
+        if not isinstance(result, dict):
+            raise ValueError("Draft is not a JSON object")
+        return result
+    
+    @staticmethod
+    def _personalize(result: Dict, user_name: Optional[str]) -> Dict:
+        first_name = user_name.split()[0] if user_name and user_name.strip() else "friend"
+        return {
+            key: value.replace("{name}", first_name) if isinstance(value, str) else value
+            for key, value in result.items()
+        }
+    
+    @staticmethod
+    async def help_craft_message(
+        user_intent: str,
+        personality: CompanionPersonality,
+        user_name: Optional[str] = None
+    ) -> Dict:
+        """Help user craft a message to their future self.
+        
+        Drafts are cached per personality and intent, so near-duplicate intents
+        reuse one completion; the user's name is filled in afterwards. When the
+        LLM is unavailable, a loosely related cached draft is served if there
+        is one, then a canned draft.
+        """
+        
+        async def create() -> Dict:
+            return await AICompanionService._craft_draft(user_intent, personality)
+        
+        try:
+            if settings.HELP_CRAFT_CACHE_ENABLED:
+                result = await help_craft_cache.get_or_create(personality.value, user_intent, create)
+            else:
+                result = await create()
+        except LLMOverloaded:
+            raise
+        except (LLMUnavailable, ValueError):
+            # Degraded: a looser match from the cache beats a generic draft
+            cached = await help_craft_cache.similar(personality.value, user_intent) if settings.HELP_CRAFT_CACHE_ENABLED else None
+            if cached is not None:
+                return AICompanionService._personalize(cached, user_name)
+            return {
+                "draft_message": f"Dear future me, right now I'm thinking about this: {user_intent}. I hope you remember why it mattered.",
+                "suggested_timing": "6 months from now",
+                "reasoning": "Enough time to look back and see how things have changed."
+            }
         
-        import json
-        return json.loads(response.choices[0].message.content)
+        return AICompanionService._personalize(result, user_name)
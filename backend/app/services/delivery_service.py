@@ -1,43 +1,44 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, select, update
 from datetime import datetime, timedelta
-from typing import Dict, List
+from typing import Dict, List, Optional
 from app.models.message import Message, MessageStatus
 from app.models.user import User
+from app.services.version_service import VersionService
 
 class DeliveryService:
     """Track and manage message delivery performance"""
     
     @staticmethod
-    def get_delivery_stats(db: Session) -> Dict:
+    async def get_delivery_stats(db: AsyncSession) -> Dict:
         """Get overall delivery statistics"""
         
         # Total messages by status
-        total_scheduled = db.query(func.count(Message.id)).filter(
+        total_scheduled = await db.scalar(select(func.count(Message.id)).where(
             Message.status == MessageStatus.SCHEDULED
-        ).scalar() or 0
+        )) or 0
         
-        total_delivered = db.query(func.count(Message.id)).filter(
+        total_delivered = await db.scalar(select(func.count(Message.id)).where(
             Message.status == MessageStatus.DELIVERED
-        ).scalar() or 0
+        )) or 0
         
-        total_read = db.query(func.count(Message.id)).filter(
+        total_read = await db.scalar(select(func.count(Message.id)).where(
             Message.status == MessageStatus.READ
-        ).scalar() or 0
+        )) or 0
         
         # Messages ready for delivery (scheduled_for <= now)
-        ready_for_delivery = db.query(func.count(Message.id)).filter(
+        ready_for_delivery = await db.scalar(select(func.count(Message.id)).where(
             Message.status == MessageStatus.SCHEDULED,
             Message.scheduled_for <= datetime.utcnow()
-        ).scalar() or 0
+        )) or 0
         
         # Upcoming deliveries (next 7 days)
         seven_days_from_now = datetime.utcnow() + timedelta(days=7)
-        upcoming_deliveries = db.query(func.count(Message.id)).filter(
+        upcoming_deliveries = await db.scalar(select(func.count(Message.id)).where(
             Message.status == MessageStatus.SCHEDULED,
             Message.scheduled_for <= seven_days_from_now,
             Message.scheduled_for > datetime.utcnow()
-        ).scalar() or 0
+        )) or 0
         
         # Delivery rate (delivered / total)
         total_messages = total_scheduled + total_delivered + total_read
@@ -58,20 +59,20 @@ class DeliveryService:
         }
     
     @staticmethod
-    def get_upcoming_deliveries(db: Session, days: int = 7) -> List[Dict]:
+    async def get_upcoming_deliveries(db: AsyncSession, days: int = 7) -> List[Dict]:
         """Get messages scheduled for delivery in the next N days"""
         
         end_date = datetime.utcnow() + timedelta(days=days)
         
-        messages = db.query(Message).filter(
+        messages = (await db.scalars(select(Message).where(
             Message.status == MessageStatus.SCHEDULED,
             Message.scheduled_for <= end_date,
             Message.scheduled_for > datetime.utcnow()
-        ).order_by(Message.scheduled_for).all()
+        ).order_by(Message.scheduled_for))).all()
         
         result = []
         for msg in messages:
-            user = db.query(User).filter(User.id == msg.user_id).first()
+            user = await db.get(User, msg.user_id)
             days_until = (msg.scheduled_for - datetime.utcnow()).days
             
             result.append({
@@ -87,17 +88,17 @@ class DeliveryService:
         return result
     
     @staticmethod
-    def get_overdue_deliveries(db: Session) -> List[Dict]:
+    async def get_overdue_deliveries(db: AsyncSession) -> List[Dict]:
         """Get messages that should have been delivered but weren't"""
         
-        messages = db.query(Message).filter(
+        messages = (await db.scalars(select(Message).where(
             Message.status == MessageStatus.SCHEDULED,
             Message.scheduled_for <= datetime.utcnow()
-        ).order_by(Message.scheduled_for).all()
+        ).order_by(Message.scheduled_for))).all()
         
         result = []
         for msg in messages:
-            user = db.query(User).filter(User.id == msg.user_id).first()
+            user = await db.get(User, msg.user_id)
             days_overdue = (datetime.utcnow() - msg.scheduled_for).days
             
             result.append({
@@ -111,7 +112,7 @@ class DeliveryService:
         return result
     
     @staticmethod
-    def get_delivery_timeline(db: Session, days: int = 30) -> Dict:
+    async def get_delivery_timeline(db: AsyncSession, days: int = 30) -> Dict:
         """Get delivery timeline for charts"""
         
         start_date = datetime.utcnow() - timedelta(days=days)
@@ -120,10 +121,10 @@ class DeliveryService:
         daily_deliveries = []
         for i in range(days):
             date = start_date + timedelta(days=i)
-            count = db.query(func.count(Message.id)).filter(
+            count = await db.scalar(select(func.count(Message.id)).where(
                 func.date(Message.delivered_at) == date.date(),
                 Message.status.in_([MessageStatus.DELIVERED, MessageStatus.READ])
-            ).scalar() or 0
+            )) or 0
             
             daily_deliveries.append({
                 "date": date.date().isoformat(),
@@ -134,10 +135,10 @@ class DeliveryService:
         daily_reads = []
         for i in range(days):
             date = start_date + timedelta(days=i)
-            count = db.query(func.count(Message.id)).filter(
+            count = await db.scalar(select(func.count(Message.id)).where(
                 func.date(Message.read_at) == date.date(),
                 Message.status == MessageStatus.READ
-            ).scalar() or 0
+            )) or 0
             
             daily_reads.append({
                 "date": date.date().isoformat(),
@@ -150,34 +151,34 @@ class DeliveryService:
         }
     
     @staticmethod
-    def get_user_delivery_stats(user_id: int, db: Session) -> Dict:
+    async def get_user_delivery_stats(user_id: int, db: AsyncSession) -> Dict:
         """Get delivery stats for a specific user"""
         
-        total_messages = db.query(func.count(Message.id)).filter(
+        total_messages = await db.scalar(select(func.count(Message.id)).where(
             Message.user_id == user_id
-        ).scalar() or 0
+        )) or 0
         
-        scheduled = db.query(func.count(Message.id)).filter(
+        scheduled = await db.scalar(select(func.count(Message.id)).where(
             Message.user_id == user_id,
             Message.status == MessageStatus.SCHEDULED
-        ).scalar() or 0
+        )) or 0
         
-        delivered = db.query(func.count(Message.id)).filter(
+        delivered = await db.scalar(select(func.count(Message.id)).where(
             Message.user_id == user_id,
             Message.status == MessageStatus.DELIVERED
-        ).scalar() or 0
+        )) or 0
         
-        read = db.query(func.count(Message.id)).filter(
+        read = await db.scalar(select(func.count(Message.id)).where(
             Message.user_id == user_id,
             Message.status == MessageStatus.READ
-        ).scalar() or 0
+        )) or 0
         
         # Next delivery
-        next_message = db.query(Message).filter(
+        next_message = (await db.scalars(select(Message).where(
             Message.user_id == user_id,
             Message.status == MessageStatus.SCHEDULED,
             Message.scheduled_for > datetime.utcnow()
-        ).order_by(Message.scheduled_for).first()
+        ).order_by(Message.scheduled_for).limit(1))).first()
         
         next_delivery = None
         if next_message:
@@ -190,10 +191,10 @@ class DeliveryService:
             }
         
         # Unread messages
-        unread_count = db.query(func.count(Message.id)).filter(
+        unread_count = await db.scalar(select(func.count(Message.id)).where(
             Message.user_id == user_id,
             Message.status == MessageStatus.DELIVERED
-        ).scalar() or 0
+        )) or 0
         
         return {
             "total_messages": total_messages,
@@ -206,33 +207,48 @@ class DeliveryService:
         }
     
     @staticmethod
-    def mark_as_read(message_id: int, user_id: int, db: Session) -> bool:
+    async def mark_as_read(message_id: int, user_id: int, db: AsyncSession) -> bool:
         """Mark a message as read"""
         
-        message = db.query(Message).filter(
-            Message.id == message_id,
+        return await DeliveryService.mark_many_as_read(user_id, db, message_ids=[message_id]) > 0
+    
+    @staticmethod
+    async def mark_many_as_read(
+        user_id: int,
+        db: AsyncSession,
+        message_ids: Optional[List[int]] = None
+    ) -> int:
+        """Mark delivered messages as read in one statement (all delivered if no IDs given)"""
+        
+        conditions = [
             Message.user_id == user_id,
             Message.status == MessageStatus.DELIVERED
-        ).first()
-        
-        if not message:
-            return False
-        
-        message.status = MessageStatus.READ
-        message.read_at = datetime.utcnow()
-        db.commit()
-        
-        return True
+        ]
+        if message_ids is not None:
+            conditions.append(Message.id.in_(message_ids))
+        
+        result = await db.execute(
+            update(Message)
+            .where(*conditions)
+            .values(status=MessageStatus.READ, read_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        
+        if result.rowcount:
+            await VersionService.bump(db, user_id)
+        await db.commit()
+        
+        return result.rowcount
     
     @staticmethod
-    def get_delivery_performance(db: Session) -> Dict:
+    async def get_delivery_performance(db: AsyncSession) -> Dict:
         """Get delivery performance metrics"""
         
         # Average time from creation to delivery
-        delivered_messages = db.query(Message).filter(
+        delivered_messages = (await db.scalars(select(Message).where(
             Message.status.in_([MessageStatus.DELIVERED, MessageStatus.READ]),
             Message.delivered_at.isnot(None)
-        ).all()
+        ))).all()
         
         if delivered_messages:
             total_wait_time = sum(
@@ -244,11 +260,11 @@ class DeliveryService:
             avg_wait_days = 0
         
         # Average time from delivery to read
-        read_messages = db.query(Message).filter(
+        read_messages = (await db.scalars(select(Message).where(
             Message.status == MessageStatus.READ,
             Message.read_at.isnot(None),
             Message.delivered_at.isnot(None)
-        ).all()
+        ))).all()
         
         if read_messages:
             total_read_time = sum(
@@ -0,0 +1,188 @@
+from sqlalchemy import select, update, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, List, Tuple
+import math
+import re
+from app.core.config import settings
+from app.models.companion import CompanionConversation
+from app.services.llm_client import llm_client, LLMUnavailable
+
+# Labels stored in CompanionConversation.detected_emotion
+EMOTIONS = ["happy", "sad", "anxious", "excited", "reflective", "frustrated", "hopeful", "neutral"]
+
+# Term -> weight per emotion. Bigrams are matched before their unigrams, and a
+# matched bigram consumes both tokens.
+EMOTION_LEXICON: Dict[str, Dict[str, float]] = {
+    "happy": {
+        "happy": 2.0, "glad": 2.0, "joy": 2.0, "joyful": 2.0, "great": 1.0, "good": 0.6, "wonderful": 1.5,
+        "grateful": 1.5, "thankful": 1.5, "content": 1.0, "smile": 1.0, "smiling": 1.0, "love": 1.0,
+        "loved": 1.0, "enjoy": 1.0, "enjoyed": 1.0, "fun": 1.0, "proud": 1.5, "amazing": 1.2, "awesome": 1.2,
+        "delighted": 2.0, "cheerful": 2.0, "blessed": 1.2, "celebrate": 1.2, "celebrated": 1.2,
+        "achieved": 1.5, "accomplished": 1.5,
+        "feel good": 2.0, "best day": 2.0, "so good": 1.5, "went well": 1.5
+    },
+    "sad": {
+        "sad": 2.0, "unhappy": 2.0, "depressed": 2.5, "down": 1.0, "lonely": 2.0, "alone": 1.2, "cry": 2.0,
+        "crying": 2.0, "cried": 2.0, "miss": 1.2, "missing": 1.0, "lost": 1.0, "loss": 1.5, "grief": 2.5,
+        "grieving": 2.5, "heartbroken": 2.5, "hurt": 1.5, "hurts": 1.5, "empty": 1.2, "hopeless": 2.0,
+        "sorry": 0.8, "died": 2.0, "passed away": 2.5, "broke up": 2.0, "let down": 1.5, "feel down": 2.0
+    },
+    "anxious": {
+        "anxious": 2.5, "anxiety": 2.5, "worried": 2.0, "worry": 2.0, "worrying": 2.0, "nervous": 2.0,
+        "scared": 2.0, "afraid": 2.0, "fear": 1.5, "panic": 2.5, "stressed": 2.0, "stress": 1.5,
+        "overwhelmed": 2.0, "uncertain": 1.2, "unsure": 1.0, "tense": 1.5, "dread": 2.0, "uneasy": 1.5,
+        "what if": 1.5, "freaking out": 2.5, "can't sleep": 1.5, "not sure": 1.0
+    },
+    "excited": {
+        "excited": 2.5, "exciting": 2.0, "thrilled": 2.5, "pumped": 2.0, "stoked": 2.0, "eager": 1.5,
+        "finally": 1.0, "wow": 1.2, "yay": 2.0, "woohoo": 2.0, "incredible": 1.2, "launch": 0.8,
+        "new": 0.4, "adventure": 1.2, "can't wait": 2.5, "so excited": 3.0, "big news": 2.0
+    },
+    "reflective": {
+        "reflect": 2.0, "reflecting": 2.0, "thinking": 1.0, "thought": 0.8, "thoughts": 0.8, "wonder": 1.2,
+        "wondering": 1.2, "remember": 1.2, "remembering": 1.2, "looking back": 2.0, "realize": 1.2,
+        "realized": 1.2, "lesson": 1.2, "lessons": 1.2, "learned": 1.0, "journey": 1.0, "perspective": 1.2,
+        "meaning": 1.2, "purpose": 1.0, "past": 0.8, "years ago": 1.5, "future self": 1.0, "grown": 1.0,
+        "growth": 1.0, "nostalgic": 2.0, "memories": 1.2, "why": 0.4
+    },
+    "frustrated": {
+        "frustrated": 2.5, "frustrating": 2.5, "annoyed": 2.0, "annoying": 2.0, "angry": 2.5, "mad": 2.0,
+        "furious": 3.0, "irritated": 2.0, "stuck": 1.5, "unfair": 1.5, "hate": 2.0, "ugh": 2.0,
+        "tired of": 2.0, "fed up": 2.5, "sick of": 2.5, "give up": 1.5, "failed": 1.2, "again": 0.4,
+        "useless": 1.5, "pointless": 1.5, "keeps": 0.4, "struggling": 1.5, "struggle": 1.2, "difficult": 1.0,
+        "hard": 0.6
+    },
+    "hopeful": {
+        "hope": 2.0, "hopeful": 2.5, "hoping": 2.0, "optimistic": 2.5, "someday": 1.2, "soon": 0.6,
+        "believe": 1.2, "wish": 1.0, "dream": 1.2, "dreams": 1.2, "goal": 1.0, "goals": 1.0, "plan": 0.6,
+        "better": 1.0, "improve": 1.0, "improving": 1.2, "getting better": 2.0, "looking forward": 2.0,
+        "fresh start": 2.0, "next year": 1.0, "one day": 1.2, "will be": 0.6
+    },
+    "neutral": {
+        "okay": 1.0, "ok": 1.0, "fine": 1.0, "normal": 1.0, "usual": 1.0, "nothing": 0.6, "whatever": 0.8,
+        "alright": 1.0, "so so": 1.5
+    }
+}
+
+NEGATIONS = {"not", "no", "never", "don't", "dont", "isn't", "isnt", "wasn't", "wasnt", "can't", "cant", "won't", "hardly"}
+
+# A negated term counts (at half weight) toward this emotion instead
+NEGATION_TARGETS = {
+    "happy": "sad", "excited": "neutral", "hopeful": "anxious", "sad": "neutral",
+    "anxious": "neutral", "frustrated": "neutral", "reflective": "neutral", "neutral": "neutral"
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z']+")
+
+class EmotionClassifier:
+    """Lexicon classifier over unigrams and bigrams with simple negation handling.
+    
+    Confidence is the softmax probability of the winning label, so it is low when
+    a message has no emotional terms or mixes several emotions evenly.
+    """
+    
+    def __init__(self, lexicon: Dict[str, Dict[str, float]]):
+        self.unigrams: Dict[str, List[Tuple[str, float]]] = {}
+        self.bigrams: Dict[str, List[Tuple[str, float]]] = {}
+        for emotion, terms in lexicon.items():
+            for term, weight in terms.items():
+                table = self.bigrams if " " in term else self.unigrams
+                table.setdefault(term, []).append((emotion, weight))
+    
+    def _scores(self, text: str) -> Dict[str, float]:
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        scores = dict.fromkeys(EMOTIONS, 0.0)
+        
+        i = 0
+        while i < len(tokens):
+            negated = i > 0 and tokens[i - 1] in NEGATIONS
+            matches = None
+            if i + 1 < len(tokens):
+                matches = self.bigrams.get(f"{tokens[i]} {tokens[i + 1]}")
+            step = 2 if matches else 1
+            matches = matches or self.unigrams.get(tokens[i], [])
+            
+            for emotion, weight in matches:
+                if negated:
+                    scores[NEGATION_TARGETS[emotion]] += weight / 2
+                else:
+                    scores[emotion] += weight
+            i += step
+        
+        return scores
+    
+    def classify(self, text: str) -> Tuple[str, float]:
+        """Return (emotion, confidence in [0, 1])"""
+        scores = self._scores(text or "")
+        best = max(scores, key=scores.get)
+        if scores[best] <= 0:
+            return "neutral", 0.0
+        
+        total = sum(math.exp(score) for score in scores.values())
+        return best, math.exp(scores[best]) / total
+    
+    def classify_batch(self, texts: List[str]) -> List[Tuple[str, float]]:
+        return [self.classify(text) for text in texts]
+
+# Global classifier instance
+emotion_classifier = EmotionClassifier(EMOTION_LEXICON)
+
+class EmotionService:
+    @staticmethod
+    async def detect(text: str) -> str:
+        """Classify locally; ask the LLM only when the local label is uncertain (if enabled)"""
+        
+        emotion, confidence = emotion_classifier.classify(text)
+        if not settings.EMOTION_LLM_ESCALATION or confidence >= settings.EMOTION_CONFIDENCE_THRESHOLD:
+            return emotion
+        
+        try:
+            answer = await llm_client.chat(
+                [{
+                    "role": "system",
+                    "content": "Analyze the emotional tone. Respond with ONE word: happy, sad, anxious, excited, reflective, frustrated, hopeful, or neutral."
+                }, {
+                    "role": "user",
+                    "content": text
+                }],
+                model="gpt-3.5-turbo",
+                site="emotion",
+                temperature=0.3,
+                max_tokens=10,
+                timeout=5
+            )
+        except LLMUnavailable:
+            return emotion
+        
+        answer = answer.strip().strip(".!").lower()
+        return answer if answer in EMOTIONS else emotion
+    
+    @staticmethod
+    async def backfill(db: AsyncSession, batch_size: int = 500, after_id: int = 0, relabel: bool = False) -> Tuple[int, int]:
+        """Label one batch of conversations with the local classifier.
+        
+        Only rows with a missing or non-standard label are touched unless relabel
+        is set. Returns (rows updated, last id seen); pass the id back as after_id
+        for the next batch, and stop when it comes back unchanged.
+        """
+        
+        statement = select(CompanionConversation.id, CompanionConversation.user_message).where(
+            CompanionConversation.id > after_id
+        )
+        if not relabel:
+            statement = statement.where(or_(
+                CompanionConversation.detected_emotion.is_(None),
+                CompanionConversation.detected_emotion.not_in(EMOTIONS)
+            ))
+        rows = (await db.execute(statement.order_by(CompanionConversation.id).limit(batch_size))).all()
+        if not rows:
+            return 0, after_id
+        
+        labels = emotion_classifier.classify_batch([row.user_message for row in rows])
+        await db.execute(
+            update(CompanionConversation),
+            [{"id": row.id, "detected_emotion": emotion} for row, (emotion, _) in zip(rows, labels)]
+        )
+        await db.commit()
+        
+        return len(rows), rows[-1].id
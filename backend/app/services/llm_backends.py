@@ -0,0 +1,314 @@
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional
+import asyncio
+import hashlib
+import json
+import math
+import random
+from app.core.config import settings
+
+class LLMBackendError(Exception):
+    """A backend call failed (bad request, server error, ...); other calls may still succeed"""
+
+class LLMTimeout(LLMBackendError):
+    """The call didn't finish within its timeout"""
+
+class LLMOutage(LLMBackendError):
+    """The provider is unreachable or rejected our credentials; every call would fail"""
+
+class Completion(NamedTuple):
+    content: str
+    prompt_tokens: Optional[int] = None  # As reported by the provider; None if it didn't say
+    completion_tokens: Optional[int] = None
+
+class LLMBackend:
+    """A chat completion and embedding provider.
+    
+    Implementations raise the LLMBackendError family instead of SDK exceptions,
+    so LLMClientManager can apply the same health, timeout and metrics handling
+    to any provider.
+    """
+    
+    name: str
+    
+    def is_configured(self) -> bool:
+        return True
+    
+    async def health_check(self):
+        """Raise LLMBackendError if the provider can't serve calls"""
+    
+    async def complete(self, messages: List[Dict], model: str, timeout: float, **kwargs) -> Completion:
+        raise NotImplementedError
+    
+    def stream(self, messages: List[Dict], model: str, timeout: float, **kwargs) -> AsyncIterator[str]:
+        """Yield content deltas; errors before the first delta mean nothing was generated"""
+        raise NotImplementedError
+    
+    async def embed(self, texts: List[str], model: str, timeout: float) -> List[List[float]]:
+        raise NotImplementedError
+    
+    async def close(self):
+        pass
+
+class OpenAIBackend(LLMBackend):
+    """AsyncOpenAI over one pooled HTTP client"""
+    
+    name = "openai"
+    
+    def __init__(self, api_key: str, timeout_seconds: float):
+        self.api_key = api_key
+        self.timeout_seconds = timeout_seconds
+        self._client = None
+        self._http_client = None
+    
+    def is_configured(self) -> bool:
+        return bool(self.api_key) and self.api_key.startswith('sk-proj-') and len(self.api_key) > 20
+    
+    def _get_client(self):
+        if self._client is None:
+            import httpx
+            from openai import AsyncOpenAI
+            self._http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=settings.LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.LLM_MAX_CONNECTIONS
+                ),
+                timeout=httpx.Timeout(self.timeout_seconds, connect=settings.LLM_CONNECT_TIMEOUT_SECONDS)
+            )
+            self._client = AsyncOpenAI(
+                api_key=self.api_key,
+                http_client=self._http_client,
+                max_retries=settings.LLM_MAX_RETRIES
+            )
+        return self._client
+    
+    @staticmethod
+    def _translate(error: Exception) -> LLMBackendError:
+        import httpx
+        from openai import APIConnectionError, APITimeoutError, AuthenticationError, PermissionDeniedError
+        
+        if isinstance(error, (APITimeoutError, httpx.TimeoutException)):
+            # A slow completion isn't an outage; only this call gives up
+            return LLMTimeout(type(error).__name__)
+        if isinstance(error, (AuthenticationError, PermissionDeniedError, APIConnectionError)):
+            return LLMOutage(type(error).__name__)
+        return LLMBackendError(f"{type(error).__name__}: {str(error)}")
+    
+    async def health_check(self):
+        import httpx
+        from openai import APIError
+        
+        try:
+            await self._get_client().models.list(timeout=settings.LLM_CONNECT_TIMEOUT_SECONDS)
+        except (APIError, httpx.HTTPError) as e:
+            raise self._translate(e) from e
+    
+    async def complete(self, messages: List[Dict], model: str, timeout: float, **kwargs) -> Completion:
+        import httpx
+        from openai import APIError
+        
+        try:
+            response = await self._get_client().chat.completions.create(
+                model=model,
+                messages=messages,
+                timeout=timeout,
+                **kwargs
+            )
+        except (APIError, httpx.HTTPError) as e:
+            raise self._translate(e) from e
+        usage = response.usage
+        return Completion(
+            response.choices[0].message.content,
+            usage.prompt_tokens if usage else None,
+            usage.completion_tokens if usage else None
+        )
+    
+    async def stream(self, messages: List[Dict], model: str, timeout: float, **kwargs) -> AsyncIterator[str]:
+        import httpx
+        from openai import APIError
+        
+        try:
+            response = await self._get_client().chat.completions.create(
+                model=model,
+                messages=messages,
+                timeout=timeout,
+                stream=True,
+                **kwargs
+            )
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except (APIError, httpx.HTTPError) as e:
+            raise self._translate(e) from e
+    
+    async def embed(self, texts: List[str], model: str, timeout: float) -> List[List[float]]:
+        import httpx
+        from openai import APIError
+        
+        try:
+            response = await self._get_client().embeddings.create(model=model, input=texts, timeout=timeout)
+        except (APIError, httpx.HTTPError) as e:
+            raise self._translate(e) from e
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+    
+    async def close(self):
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._client = None
+            self._http_client = None
+
+class LatencyModel:
+    """Samples latencies (seconds) from a distribution fitted to a median and a p99"""
+    
+    DISTRIBUTIONS = ("fixed", "uniform", "lognormal")
+    
+    def __init__(self, distribution: str, p50_ms: float, p99_ms: float, rng: random.Random):
+        if distribution not in self.DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution {distribution!r}; expected one of {self.DISTRIBUTIONS}")
+        self.distribution = distribution
+        self.p50 = p50_ms / 1000
+        self.p99 = max(p99_ms, p50_ms) / 1000
+        self.rng = rng
+    
+    def sample(self) -> float:
+        if self.distribution == "fixed":
+            return self.p50
+        if self.distribution == "uniform":
+            return self.rng.uniform(max(0.0, 2 * self.p50 - self.p99), self.p99)
+        # Lognormal: heavy right tail, like real provider latency; 2.326 is the z-score of p99
+        sigma = math.log(self.p99 / self.p50) / 2.326 if self.p50 > 0 else 0
+        return self.p50 * math.exp(self.rng.gauss(0, sigma))
+
+FAKE_SENTENCES = [
+    "That sounds like a meaningful moment to capture.",
+    "What would you want your future self to remember about today?",
+    "It takes courage to reflect on this so honestly.",
+    "Small steps like this add up over time.",
+    "How do you imagine you'll feel reading this a year from now?",
+    "I'm glad you shared that with me.",
+    "Let's turn this into a message your future self will treasure.",
+    "You've grown more than you probably realize."
+]
+
+class FakeBackend(LLMBackend):
+    """Deterministic local stand-in for the provider, for load tests and offline development.
+    
+    Replies are derived from a hash of the prompt, so the same prompt always
+    gets the same answer. Time to first token follows the configured latency
+    distribution, and the rest of the reply arrives at tokens_per_second. Errors,
+    timeouts and a full outage can be injected at configurable rates. Every
+    random draw comes from one seeded generator.
+    """
+    
+    name = "fake"
+    
+    def __init__(
+        self,
+        latency: LatencyModel,
+        tokens_per_second: float,
+        error_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        outage: bool = False,
+        rng: Optional[random.Random] = None
+    ):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.outage = outage
+        self.rng = rng or random.Random(0)
+    
+    @staticmethod
+    def _prompt_hash(messages: List[Dict]) -> int:
+        prompt = "\n".join(str(message.get("content", "")) for message in messages)
+        return int.from_bytes(hashlib.blake2b(prompt.encode("utf-8"), digest_size=8).digest(), "little")
+    
+    def _reply(self, messages: List[Dict], max_tokens: Optional[int], response_format: Optional[Dict]) -> str:
+        seed = self._prompt_hash(messages)
+        if response_format and response_format.get("type") == "json_object":
+            return json.dumps({
+                "draft_message": f"Dear future me, {FAKE_SENTENCES[seed % len(FAKE_SENTENCES)]}",
+                "suggested_timing": ["1 month", "6 months", "1 year"][seed % 3],
+                "reasoning": FAKE_SENTENCES[(seed >> 8) % len(FAKE_SENTENCES)]
+            })
+        if max_tokens is not None and max_tokens <= 10:
+            # Classification-style prompts ask for a single word
+            return ["neutral", "reflective", "hopeful", "happy"][seed % 4]
+        
+        # About 4 tokens per 3 words; fill most of the token allowance
+        words_allowed = int((max_tokens or 150) * 0.75 * 0.8)
+        picker = random.Random(seed)
+        sentences = []
+        words = 0
+        while words < words_allowed:
+            sentence = picker.choice(FAKE_SENTENCES)
+            words += len(sentence.split())
+            sentences.append(sentence)
+        return " ".join(sentences)
+    
+    async def _inject_failure(self, timeout: float):
+        if self.outage:
+            await asyncio.sleep(min(self.latency.p50, timeout))
+            raise LLMOutage("injected outage")
+        roll = self.rng.random()
+        if roll < self.timeout_rate:
+            await asyncio.sleep(timeout)
+            raise LLMTimeout("injected timeout")
+        if roll < self.timeout_rate + self.error_rate:
+            await asyncio.sleep(min(self.latency.sample(), timeout))
+            raise LLMBackendError("injected server error")
+    
+    async def health_check(self):
+        if self.outage:
+            raise LLMOutage("injected outage")
+    
+    async def complete(self, messages: List[Dict], model: str, timeout: float, **kwargs) -> Completion:
+        await self._inject_failure(timeout)
+        reply = self._reply(messages, kwargs.get("max_tokens"), kwargs.get("response_format"))
+        delay = self.latency.sample() + len(reply.split()) * 4 / 3 / self.tokens_per_second
+        if delay > timeout:
+            await asyncio.sleep(timeout)
+            raise LLMTimeout("completion exceeded timeout")
+        await asyncio.sleep(delay)
+        return Completion(reply)
+    
+    async def stream(self, messages: List[Dict], model: str, timeout: float, **kwargs) -> AsyncIterator[str]:
+        await self._inject_failure(timeout)
+        reply = self._reply(messages, kwargs.get("max_tokens"), kwargs.get("response_format"))
+        first_token = self.latency.sample()
+        if first_token > timeout:
+            await asyncio.sleep(timeout)
+            raise LLMTimeout("no first token within timeout")
+        await asyncio.sleep(first_token)
+        for i, word in enumerate(reply.split(" ")):
+            if i:
+                await asyncio.sleep(4 / 3 / self.tokens_per_second)
+            yield word if i == 0 else " " + word
+    
+    async def embed(self, texts: List[str], model: str, timeout: float) -> List[List[float]]:
+        await self._inject_failure(timeout)
+        await asyncio.sleep(min(self.latency.sample() / 10, timeout))
+        vectors = []
+        for text in texts:
+            rng = random.Random(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest())
+            vectors.append([rng.gauss(0, 1) for _ in range(settings.MEMORY_OPENAI_DIM)])
+        return vectors
+
+def create_backend(name: str) -> LLMBackend:
+    if name == "fake":
+        rng = random.Random(settings.FAKE_LLM_SEED)
+        return FakeBackend(
+            LatencyModel(
+                settings.FAKE_LLM_LATENCY_DISTRIBUTION,
+                settings.FAKE_LLM_LATENCY_P50_MS,
+                settings.FAKE_LLM_LATENCY_P99_MS,
+                rng
+            ),
+            settings.FAKE_LLM_TOKENS_PER_SECOND,
+            error_rate=settings.FAKE_LLM_ERROR_RATE,
+            timeout_rate=settings.FAKE_LLM_TIMEOUT_RATE,
+            outage=settings.FAKE_LLM_OUTAGE,
+            rng=rng
+        )
+    if name == "openai":
+        return OpenAIBackend(settings.OPENAI_API_KEY, settings.LLM_TIMEOUT_SECONDS)
+    raise ValueError(f"Unknown LLM backend {name!r}")
@@ -0,0 +1,401 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+import asyncio
+import logging
+import time
+from app.core.config import settings
+from app.services.circuit_breaker import CircuitBreaker, HALF_OPEN
+from app.services.llm_backends import LLMBackend, LLMBackendError, LLMOutage, LLMTimeout, create_backend
+from app.services.llm_scheduler import FairShareScheduler, LLMShed
+from app.services.llm_usage import llm_usage
+from app.services.prompt_builder import MESSAGE_OVERHEAD_TOKENS, count_tokens
+
+logger = logging.getLogger(__name__)
+
+# List prices in USD per 1K (prompt, completion) tokens, for spend estimates
+MODEL_PRICES_PER_1K_TOKENS = {
+    "gpt-4-turbo-preview": (0.01, 0.03),
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "text-embedding-3-small": (0.00002, 0.0)
+}
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Estimated USD cost of a call; 0 for models without a listed price"""
+    prompt_price, completion_price = MODEL_PRICES_PER_1K_TOKENS.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+class LLMUnavailable(Exception):
+    """Raised when a completion can't be served; callers fall back to a canned answer"""
+
+class LLMCircuitOpen(LLMUnavailable):
+    """The model's circuit breaker is open; the call was refused without reaching the provider"""
+
+class LLMOverloaded(LLMUnavailable):
+    """The scheduler shed the call; user-facing endpoints answer 429 instead of falling back"""
+    
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+class LLMClientManager:
+    """Front door for every companion LLM call, whatever the backend (LLM_BACKEND).
+    
+    Each call carries its own timeout, and a fair-share scheduler (see
+    llm_scheduler) decides which calls get one of the max_concurrency slots.
+    Provider health is cached: after an outage (bad key, unreachable provider)
+    calls fail fast until the backoff expires, instead of probing the API on
+    every request. Per-model circuit breakers stop calls to a model that is
+    failing or too slow, and chat/stream can fall back to (or race) a cheaper
+    model. Every call, failed or not, is recorded in llm_usage under the
+    call site that made it.
+    """
+    
+    def __init__(self, max_concurrency: int, timeout_seconds: float):
+        self.max_concurrency = max_concurrency
+        self.timeout_seconds = timeout_seconds
+        self.scheduler = FairShareScheduler(max_concurrency)
+        self._backend: Optional[LLMBackend] = None
+        
+        # Health state
+        self.healthy: Optional[bool] = None  # None until the first probe
+        self.retry_at = 0.0  # monotonic time after which an unhealthy provider is probed again
+        self.backoff_seconds = settings.LLM_HEALTH_BACKOFF_SECONDS
+        self.last_error: Optional[str] = None
+        self._probe_lock = asyncio.Lock()
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        
+        # Metrics
+        self.completed = 0
+        self.failed = 0
+        self.fast_failed = 0
+        self.fallbacks = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.streams = 0
+        self.total_ttft_seconds = 0.0
+    
+    @property
+    def backend(self) -> LLMBackend:
+        if self._backend is None:
+            self._backend = create_backend(settings.LLM_BACKEND)
+        return self._backend
+    
+    def is_configured(self) -> bool:
+        return self.backend.is_configured()
+    
+    def _mark_healthy(self):
+        if self.healthy is False:
+            logger.info("LLM provider recovered")
+        self.healthy = True
+        self.backoff_seconds = settings.LLM_HEALTH_BACKOFF_SECONDS
+        self.last_error = None
+    
+    def _mark_unhealthy(self, error: Exception):
+        self.healthy = False
+        self.retry_at = time.monotonic() + self.backoff_seconds
+        self.last_error = type(error).__name__
+        logger.warning(f"LLM provider unavailable for {self.backoff_seconds}s: {str(error)}")
+        self.backoff_seconds = min(self.backoff_seconds * 2, settings.LLM_HEALTH_BACKOFF_MAX_SECONDS)
+    
+    async def _probe(self):
+        async with self._probe_lock:
+            # Another request may have probed while this one waited
+            if self.healthy or (self.healthy is False and time.monotonic() < self.retry_at):
+                return
+            try:
+                await self.backend.health_check()
+                self._mark_healthy()
+            except LLMBackendError as e:
+                self._mark_unhealthy(e)
+    
+    async def is_available(self) -> bool:
+        if not self.is_configured():
+            return False
+        if self.healthy is None or (self.healthy is False and time.monotonic() >= self.retry_at):
+            await self._probe()
+        return bool(self.healthy)
+    
+    def breaker(self, model: str) -> CircuitBreaker:
+        if model not in self.breakers:
+            self.breakers[model] = CircuitBreaker(
+                model,
+                window=settings.LLM_BREAKER_WINDOW,
+                min_calls=settings.LLM_BREAKER_MIN_CALLS,
+                error_rate_threshold=settings.LLM_BREAKER_ERROR_RATE,
+                slow_call_seconds=settings.LLM_BREAKER_SLOW_CALL_SECONDS,
+                slow_rate_threshold=settings.LLM_BREAKER_SLOW_RATE,
+                open_seconds=settings.LLM_BREAKER_OPEN_SECONDS
+            )
+        return self.breakers[model]
+    
+    @staticmethod
+    def _record_usage(site: str, model: str, call: Dict, elapsed: float, error: Optional[str] = None):
+        prompt_tokens = call["prompt_tokens"]
+        completion_tokens = call["completion_tokens"]
+        llm_usage.record(
+            site,
+            model,
+            elapsed,
+            prompt_tokens,
+            completion_tokens,
+            estimate_cost(model, prompt_tokens, completion_tokens),
+            error
+        )
+    
+    @asynccontextmanager
+    async def _slot(self, model: str, site: str, deadline: float):
+        """Admission, scheduler slot, circuit breaker, error mapping and usage recording shared by every call.
+        
+        deadline (monotonic) bounds the whole call, time spent waiting for a
+        slot included. Yields a dict holding "timeout", what is left of it for
+        the provider call, which the call may update: "latency" (seconds
+        judged by the breaker; defaults to the whole call), "failed", and the
+        token counts to record.
+        """
+        
+        call = {"timeout": 0.0, "latency": None, "failed": False, "prompt_tokens": 0, "completion_tokens": 0}
+        if not await self.is_available():
+            self.fast_failed += 1
+            self._record_usage(site, model, call, 0.0, "unavailable")
+            raise LLMUnavailable(self.last_error or "not configured")
+        
+        breaker = self.breaker(model)
+        if not breaker.allow():
+            self.fast_failed += 1
+            self._record_usage(site, model, call, 0.0, "circuit_open")
+            raise LLMCircuitOpen(model)
+        # While half-open, only this call's outcome decides the breaker
+        trial = breaker.state == HALF_OPEN
+        
+        started = time.perf_counter()
+        try:
+            async with self.scheduler.slot(deadline):
+                started = time.perf_counter()
+                call["timeout"] = deadline - time.monotonic()
+                yield call
+        except LLMShed as e:
+            breaker.abandon(trial)
+            self._record_usage(site, model, call, 0.0, "shed")
+            raise LLMOverloaded(e.reason, e.retry_after) from e
+        except LLMTimeout as e:
+            self.failed += 1
+            breaker.record(True, time.perf_counter() - started, trial)
+            self._record_usage(site, model, call, time.perf_counter() - started, "timeout")
+            logger.warning(f"LLM call to {model} timed out")
+            raise LLMUnavailable(type(e).__name__) from e
+        except LLMOutage as e:
+            # Bad key or unreachable provider: fail fast until the backoff expires
+            self.failed += 1
+            breaker.record(True, time.perf_counter() - started, trial)
+            self._record_usage(site, model, call, time.perf_counter() - started, "outage")
+            self._mark_unhealthy(e)
+            raise LLMUnavailable(type(e).__name__) from e
+        except LLMBackendError as e:
+            self.failed += 1
+            breaker.record(True, time.perf_counter() - started, trial)
+            self._record_usage(site, model, call, time.perf_counter() - started, "error")
+            logger.warning(f"LLM call to {model} failed: {str(e)}")
+            raise LLMUnavailable(type(e).__name__) from e
+        except BaseException:
+            # Cancelled (e.g. the losing side of a hedge) or the consumer went away;
+            # it only tells the breaker something if it was already slow
+            elapsed = time.perf_counter() - started
+            latency = call["latency"] if call["latency"] is not None else elapsed
+            if latency >= breaker.slow_call_seconds:
+                breaker.record(False, latency, trial)
+            else:
+                breaker.abandon(trial)
+            self._record_usage(site, model, call, elapsed, "cancelled")
+            raise
+        else:
+            elapsed = time.perf_counter() - started
+            breaker.record(call["failed"], call["latency"] if call["latency"] is not None else elapsed, trial)
+            self._record_usage(site, model, call, elapsed, "stream_broken" if call["failed"] else None)
+    
+    @staticmethod
+    def _prompt_tokens(messages: List[Dict]) -> int:
+        """Estimated prompt size, for calls the provider doesn't report usage for"""
+        return sum(count_tokens(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS for message in messages)
+    
+    async def _chat(self, messages: List[Dict], model: str, deadline: float, site: str, **kwargs) -> str:
+        async with self._slot(model, site, deadline) as call:
+            completion = await self.backend.complete(messages, model, call["timeout"], **kwargs)
+            call["prompt_tokens"] = completion.prompt_tokens if completion.prompt_tokens is not None else self._prompt_tokens(messages)
+            call["completion_tokens"] = (
+                completion.completion_tokens if completion.completion_tokens is not None else count_tokens(completion.content)
+            )
+        
+        self.completed += 1
+        return completion.content
+    
+    async def chat(
+        self,
+        messages: List[Dict],
+        model: str,
+        timeout: Optional[float] = None,
+        fallback_model: Optional[str] = None,
+        hedge_after: Optional[float] = None,
+        site: str = "other",
+        **kwargs
+    ) -> str:
+        """Run a chat completion and return the message content; raises LLMUnavailable on any failure.
+        
+        With fallback_model, a failed (or circuit-broken) primary is retried on
+        the fallback within what is left of the timeout; with hedge_after too,
+        a primary still running after that many seconds is raced against the
+        fallback and the first success wins. LLMOverloaded is never retried.
+        The timeout starts now, so time spent queued for a slot counts
+        against it. site names the caller in usage metrics (e.g. "chat",
+        "emotion").
+        """
+        
+        deadline = time.monotonic() + (timeout or self.timeout_seconds)
+        if fallback_model is None:
+            return await self._chat(messages, model, deadline, site, **kwargs)
+        
+        primary = asyncio.create_task(self._chat(messages, model, deadline, site, **kwargs))
+        try:
+            await asyncio.wait([primary], timeout=hedge_after)
+            if primary.done():
+                try:
+                    return primary.result()
+                except LLMOverloaded:
+                    raise
+                except LLMUnavailable as e:
+                    logger.info(f"Falling back from {model} to {fallback_model}: {str(e)}")
+                self.fallbacks += 1
+                return await self._chat(messages, fallback_model, max(deadline, time.monotonic() + 1.0), site, **kwargs)
+            
+            # The primary is slow: race the cheaper model against it
+            self.hedges += 1
+            secondary = asyncio.create_task(
+                self._chat(messages, fallback_model, max(deadline, time.monotonic() + 1.0), site, **kwargs)
+            )
+            try:
+                winner = await self._first_success([primary, secondary])
+            finally:
+                secondary.cancel()
+            if winner is secondary:
+                self.hedge_wins += 1
+            return winner.result()
+        finally:
+            primary.cancel()
+    
+    @staticmethod
+    async def _first_success(tasks: List[asyncio.Task]) -> asyncio.Task:
+        """The first task to finish without an exception; raises the last error if all fail"""
+        
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task
+                error = task.exception()
+        raise error
+    
+    async def embed(
+        self,
+        texts: List[str],
+        model: str,
+        timeout: Optional[float] = None,
+        site: str = "embedding"
+    ) -> List[List[float]]:
+        """Embed a batch of texts; raises LLMUnavailable on any failure"""
+        
+        async with self._slot(model, site, time.monotonic() + (timeout or self.timeout_seconds)) as call:
+            vectors = await self.backend.embed(texts, model, call["timeout"])
+            call["prompt_tokens"] = sum(count_tokens(text) for text in texts)
+        
+        self.completed += 1
+        return vectors
+    
+    async def _stream(self, messages: List[Dict], model: str, deadline: float, site: str, **kwargs) -> AsyncIterator[str]:
+        async with self._slot(model, site, deadline) as call:
+            started = time.perf_counter()
+            first_token = True
+            # Streamed responses carry no usage; both sides are estimated
+            call["prompt_tokens"] = self._prompt_tokens(messages)
+            deltas = []
+            try:
+                async for delta in self.backend.stream(messages, model, call["timeout"], **kwargs):
+                    if first_token:
+                        first_token = False
+                        # The breaker judges streams by time to first token
+                        call["latency"] = time.perf_counter() - started
+                        self.streams += 1
+                        self.total_ttft_seconds += call["latency"]
+                    deltas.append(delta)
+                    yield delta
+            except LLMBackendError as e:
+                if first_token:
+                    raise
+                self.failed += 1
+                call["failed"] = True
+                logger.warning(f"LLM stream from {model} broke off: {str(e)}")
+                return
+            finally:
+                # Also counts what was sent before a break-off or disconnect
+                call["completion_tokens"] = count_tokens("".join(deltas))
+        
+        self.completed += 1
+    
+    async def stream(
+        self,
+        messages: List[Dict],
+        model: str,
+        timeout: Optional[float] = None,
+        fallback_model: Optional[str] = None,
+        site: str = "other",
+        **kwargs
+    ) -> AsyncIterator[str]:
+        """Stream a chat completion as content deltas.
+        
+        LLMUnavailable is raised before the first delta if the call can't start
+        (after trying fallback_model, if given); a failure mid-stream just ends
+        the stream early. The timeout starts now, queueing for a slot included.
+        """
+        
+        deadline = time.monotonic() + (timeout or self.timeout_seconds)
+        try:
+            async for delta in self._stream(messages, model, deadline, site, **kwargs):
+                yield delta
+            return
+        except LLMOverloaded:
+            raise
+        except LLMUnavailable as e:
+            if fallback_model is None:
+                raise
+            logger.info(f"Falling back from {model} to {fallback_model}: {str(e)}")
+        
+        self.fallbacks += 1
+        async for delta in self._stream(messages, fallback_model, max(deadline, time.monotonic() + 1.0), site, **kwargs):
+            yield delta
+    
+    def stats(self) -> Dict:
+        return {
+            "backend": settings.LLM_BACKEND,
+            "configured": self.is_configured(),
+            "healthy": self.healthy,
+            "last_error": self.last_error,
+            "retry_in_seconds": max(0, round(self.retry_at - time.monotonic(), 1)) if self.healthy is False else 0,
+            "completed": self.completed,
+            "failed": self.failed,
+            "fast_failed": self.fast_failed,
+            "fallbacks": self.fallbacks,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "streams": self.streams,
+            "avg_ttft_ms": round(self.total_ttft_seconds / self.streams * 1000, 2) if self.streams else 0,
+            "scheduler": self.scheduler.stats(),
+            "breakers": {model: breaker.stats() for model, breaker in self.breakers.items()}
+        }
+    
+    async def close(self):
+        if self._backend is not None:
+            await self._backend.close()
+            self._backend = None
+
+# Global client instance
+llm_client = LLMClientManager(settings.LLM_MAX_CONCURRENCY, settings.LLM_TIMEOUT_SECONDS)
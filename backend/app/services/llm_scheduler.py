@@ -0,0 +1,319 @@
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Optional, Tuple
+import asyncio
+import logging
+import math
+import time
+import uuid
+from app.core.config import settings
+from app.models.user import SubscriptionTier
+
+logger = logging.getLogger(__name__)
+
+# Who the current LLM calls are made for: (user id, tier), or None for background work
+llm_caller: ContextVar[Optional[Tuple[int, SubscriptionTier]]] = ContextVar("llm_caller", default=None)
+
+PAID = "paid"
+FREE = "free"
+BACKGROUND = "background"
+
+PAID_TIERS = {SubscriptionTier.PREMIUM, SubscriptionTier.LIFETIME, SubscriptionTier.ULTRA}
+
+# Slot leases across workers: drop expired leases, then take one if both the
+# global and the caller's set have room. Returns 1 if granted.
+GLOBAL_SLOT_SCRIPT = """
+local now = tonumber(ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[3]) or redis.call('ZCARD', KEYS[2]) >= tonumber(ARGV[4]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[5])
+redis.call('ZADD', KEYS[2], ARGV[2], ARGV[5])
+redis.call('EXPIRE', KEYS[2], math.ceil(tonumber(ARGV[2]) - now))
+return 1
+"""
+
+def bind_caller(user_id: int, tier: SubscriptionTier):
+    """Attribute LLM calls made from here on (in this request) to the user"""
+    llm_caller.set((user_id, tier))
+
+class LLMShed(Exception):
+    """The scheduler refused a call rather than let it queue past its wait budget"""
+    
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class Waiter:
+    __slots__ = ("user", "future")
+    
+    def __init__(self, user, future: asyncio.Future):
+        self.user = user
+        self.future = future
+
+class FairShareScheduler:
+    """Admission control for LLM calls: a global slot limit shared fairly between users.
+    
+    Each user may hold a few slots at once (more for paid tiers). When slots run
+    out, calls wait in per-user queues that are served round-robin, so one busy
+    user can't starve the rest; paid users are picked LLM_PAID_WEIGHT times as often
+    as free ones, and background work (no caller) only runs when no user is
+    waiting. A call that would wait longer than LLM_MAX_QUEUE_WAIT_SECONDS, or whose user
+    already has too many queued, is shed at once with LLMShed instead of timing
+    out later. With LLM_SCHEDULER_REDIS, slots are also leased from Redis so the
+    global and per-user limits hold across workers.
+    """
+    
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.in_flight = 0
+        self.user_in_flight: Dict = {}
+        self.queues: Dict[str, "OrderedDict[object, Deque[Waiter]]"] = {
+            PAID: OrderedDict(), FREE: OrderedDict(), BACKGROUND: OrderedDict()
+        }
+        self.passes = {PAID: 0.0, FREE: 0.0}  # Stride scheduling between the two user classes
+        self.avg_service_seconds = 1.0  # Moving average of how long a call holds its slot
+        self._redis = None
+        self._script = None
+        
+        # Metrics
+        self.admitted = 0
+        self.queued = 0
+        self.shed: Dict[str, int] = {}
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.peak_in_flight = 0
+    
+    def _cap(self, priority: str) -> int:
+        """Slots one user (or all background work together) may hold at once"""
+        if priority == PAID:
+            return settings.LLM_PAID_USER_MAX_CONCURRENCY
+        if priority == FREE:
+            return settings.LLM_USER_MAX_CONCURRENCY
+        return max(1, self.capacity // 4)
+    
+    def _classify(self, caller: Optional[Tuple[int, SubscriptionTier]]) -> Tuple[str, object, int]:
+        """(priority class, queue key, slot cap) for a caller"""
+        if caller is None:
+            return BACKGROUND, BACKGROUND, self._cap(BACKGROUND)
+        user_id, tier = caller
+        priority = PAID if tier in PAID_TIERS else FREE
+        return priority, user_id, self._cap(priority)
+    
+    def _redis_client(self):
+        if self._redis is None and settings.LLM_SCHEDULER_REDIS:
+            import redis.asyncio
+            self._redis = redis.asyncio.from_url(settings.REDIS_URL)
+            self._script = self._redis.register_script(GLOBAL_SLOT_SCRIPT)
+        return self._redis
+    
+    @property
+    def waiting(self) -> int:
+        return sum(len(waiters) for queue in self.queues.values() for waiters in queue.values())
+    
+    def _waiting_ahead(self, priority: str) -> int:
+        """Roughly how many queued calls will be served before a new one of this class"""
+        if priority == BACKGROUND:
+            return self.waiting
+        return sum(len(waiters) for cls in (PAID, FREE) for waiters in self.queues[cls].values())
+    
+    def _retry_after(self) -> int:
+        return max(1, math.ceil(self.avg_service_seconds))
+    
+    def _shed(self, reason: str) -> LLMShed:
+        self.shed[reason] = self.shed.get(reason, 0) + 1
+        return LLMShed(reason, self._retry_after())
+    
+    def _grant(self, user):
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        self.user_in_flight[user] = self.user_in_flight.get(user, 0) + 1
+    
+    def _eligible(self, priority: str):
+        """First user in round-robin order with a waiter and a free personal slot"""
+        cap = self._cap(priority)
+        for user, waiters in self.queues[priority].items():
+            if waiters and self.user_in_flight.get(user, 0) < cap:
+                return user
+        return None
+    
+    def _dispatch(self):
+        """Hand free slots to waiters: user classes by stride, users round-robin"""
+        
+        while self.in_flight < self.capacity:
+            candidates = {cls: self._eligible(cls) for cls in (PAID, FREE)}
+            candidates = {cls: user for cls, user in candidates.items() if user is not None}
+            if candidates:
+                priority = min(candidates, key=lambda cls: self.passes[cls])
+                user = candidates[priority]
+                weight = settings.LLM_PAID_WEIGHT if priority == PAID else 1
+                self.passes[priority] += 1 / weight
+                # An idle class doesn't bank credit while it has nothing queued
+                for cls in (PAID, FREE):
+                    if cls not in candidates:
+                        self.passes[cls] = max(self.passes[cls], self.passes[priority] - 1)
+            else:
+                user = self._eligible(BACKGROUND)
+                if user is None:
+                    return
+                priority = BACKGROUND
+            
+            queue = self.queues[priority]
+            waiter = queue[user].popleft()
+            if queue[user]:
+                queue.move_to_end(user)
+            else:
+                del queue[user]
+            if waiter.future.done():
+                continue
+            self._grant(user)
+            waiter.future.set_result(True)
+    
+    def _remove(self, priority: str, waiter: Waiter):
+        waiters = self.queues[priority].get(waiter.user)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del self.queues[priority][waiter.user]
+    
+    async def _acquire_local(self, priority: str, user, cap: int, deadline: float):
+        started = time.monotonic()
+        queue = self.queues[priority]
+        
+        if self.in_flight < self.capacity and self.user_in_flight.get(user, 0) < cap and user not in queue and (
+            priority != BACKGROUND or not self._waiting_ahead(PAID)
+        ):
+            self._grant(user)
+            self.admitted += 1
+            return
+        
+        if len(queue.get(user, ())) >= settings.LLM_USER_MAX_QUEUED:
+            raise self._shed("user_queue_full")
+        expected_wait = (self._waiting_ahead(priority) + 1) / self.capacity * self.avg_service_seconds
+        if expected_wait > deadline - started:
+            raise self._shed("overloaded")
+        
+        waiter = Waiter(user, asyncio.get_running_loop().create_future())
+        queue.setdefault(user, deque()).append(waiter)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            self._remove(priority, waiter)
+            if not waiter.future.done():
+                waiter.future.cancel()
+                raise self._shed("queue_timeout")
+        except asyncio.CancelledError:
+            self._remove(priority, waiter)
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as the caller went away
+                self._release_local(user, 0.0)
+            else:
+                waiter.future.cancel()
+            raise
+        
+        waited = time.monotonic() - started
+        self.admitted += 1
+        self.total_wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+    
+    def _release_local(self, user, held_seconds: Optional[float]):
+        self.in_flight -= 1
+        remaining = self.user_in_flight.get(user, 1) - 1
+        if remaining:
+            self.user_in_flight[user] = remaining
+        else:
+            self.user_in_flight.pop(user, None)
+        if held_seconds:
+            self.avg_service_seconds = 0.9 * self.avg_service_seconds + 0.1 * held_seconds
+        self._dispatch()
+    
+    async def _acquire_global(self, user, cap: int, deadline: float) -> Optional[Tuple[str, str]]:
+        """Lease a cross-worker slot, polling until the deadline; None without Redis"""
+        
+        client = self._redis_client()
+        if client is None:
+            return None
+        
+        lease = uuid.uuid4().hex
+        user_key = f"llm:slots:{user}"
+        while True:
+            now = time.time()
+            try:
+                granted = await self._script(
+                    keys=["llm:slots", user_key],
+                    args=[now, now + settings.LLM_TIMEOUT_SECONDS * 2, settings.LLM_GLOBAL_MAX_CONCURRENCY, cap, lease]
+                )
+            except Exception as e:
+                logger.warning(f"LLM scheduler Redis call failed, limiting locally: {str(e)}")
+                return None
+            if granted:
+                return user_key, lease
+            if time.monotonic() >= deadline:
+                raise self._shed("global_limit")
+            await asyncio.sleep(0.05)
+    
+    async def _release_global(self, lease: Tuple[str, str]):
+        user_key, lease_id = lease
+        try:
+            await self._redis.zrem("llm:slots", lease_id)
+            await self._redis.zrem(user_key, lease_id)
+        except Exception as e:
+            logger.warning(f"LLM scheduler Redis release failed (lease expires on its own): {str(e)}")
+    
+    @asynccontextmanager
+    async def slot(self, deadline: Optional[float] = None):
+        """Hold one LLM slot for the current caller; raises LLMShed if the call is refused.
+        
+        deadline (monotonic) is when the whole call must be done by; waiting
+        for a slot never runs past it.
+        """
+        
+        priority, user, cap = self._classify(llm_caller.get())
+        queue_deadline = time.monotonic() + settings.LLM_MAX_QUEUE_WAIT_SECONDS
+        if deadline is not None:
+            queue_deadline = min(queue_deadline, deadline)
+        await self._acquire_local(priority, user, cap, queue_deadline)
+        
+        held = time.monotonic()
+        lease = None
+        try:
+            lease = await self._acquire_global(user, cap, queue_deadline)
+            if deadline is not None and time.monotonic() >= deadline:
+                raise self._shed("deadline")
+            held = time.monotonic()
+            yield
+        finally:
+            if lease is not None:
+                await self._release_global(lease)
+            self._release_local(user, time.monotonic() - held)
+    
+    def check(self, caller: Tuple[int, SubscriptionTier]):
+        """Raise LLMShed now if a call for this caller would be shed, e.g. before starting a stream"""
+        
+        priority, user, cap = self._classify(caller)
+        if self.in_flight < self.capacity and self.user_in_flight.get(user, 0) < cap:
+            return
+        if len(self.queues[priority].get(user, ())) >= settings.LLM_USER_MAX_QUEUED:
+            raise self._shed("user_queue_full")
+        if (self._waiting_ahead(priority) + 1) / self.capacity * self.avg_service_seconds > settings.LLM_MAX_QUEUE_WAIT_SECONDS:
+            raise self._shed("overloaded")
+    
+    def stats(self) -> Dict:
+        return {
+            "capacity": self.capacity,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "active_users": len(self.user_in_flight),
+            "waiting": {cls: sum(len(waiters) for waiters in queue.values()) for cls, queue in self.queues.items()},
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "shed": dict(self.shed),
+            "avg_wait_ms": round(self.total_wait_seconds / self.queued * 1000, 2) if self.queued else 0,
+            "max_wait_ms": round(self.max_wait_seconds * 1000, 2),
+            "avg_service_ms": round(self.avg_service_seconds * 1000, 2)
+        }
@@ -0,0 +1,196 @@
+from contextvars import ContextVar
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+import bisect
+from sqlalchemy.dialects import postgresql, sqlite
+from app.core.database import AsyncSessionLocal
+from app.models.companion import LLMUsage
+from app.services.llm_scheduler import llm_caller
+
+# Upper bounds (ms) of the latency histogram buckets; slower calls land in a final overflow bucket
+LATENCY_BUCKETS_MS = (100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+# User a call is billed to when no request caller is bound (e.g. the check-in precompute job)
+usage_user: ContextVar[Optional[int]] = ContextVar("usage_user", default=None)
+
+# (call site, model, tier)
+StatsKey = Tuple[str, str, str]
+
+# (user_id, day, call site, model, tier)
+UsageKey = Tuple[int, date, str, str, str]
+
+class CallStats:
+    __slots__ = ("calls", "errors", "prompt_tokens", "completion_tokens", "cost_usd", "latency_seconds", "buckets")
+    
+    def __init__(self):
+        self.calls = 0
+        self.errors: Dict[str, int] = {}
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = 0.0
+        self.latency_seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    
+    def percentile_ms(self, pct: float) -> Optional[int]:
+        """Upper bound of the bucket holding the pct-th percentile; None if it overflowed"""
+        rank = pct / 100 * self.calls
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+    
+    def stats(self, include_cost: bool = True) -> Dict:
+        return {
+            "calls": self.calls,
+            "errors": dict(self.errors),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            **({"cost_usd": round(self.cost_usd, 4)} if include_cost else {}),
+            "avg_latency_ms": round(self.latency_seconds / self.calls * 1000, 1) if self.calls else 0,
+            "p50_ms": self.percentile_ms(50),
+            "p95_ms": self.percentile_ms(95),
+            "p99_ms": self.percentile_ms(99),
+            "latency_histogram": {
+                **{f"le_{bound}ms": count for bound, count in zip(LATENCY_BUCKETS_MS, self.buckets)},
+                "overflow": self.buckets[-1]
+            }
+        }
+
+class LLMUsageRecorder:
+    """Tokens, latency, errors and estimated cost of every LLM call.
+    
+    LLMClientManager records each call with the call site that made it; the
+    subscription tier and user come from the scheduler's caller context (or
+    usage_user for background work billed to a user). Worker-local totals per
+    (call site, model, tier) are served by /metrics. Per-user totals are
+    buffered and flush() adds them to the daily llm_usage table, which the
+    scheduler runs every minute.
+    """
+    
+    def __init__(self):
+        self.totals: Dict[StatsKey, CallStats] = {}
+        self.pending: Dict[UsageKey, List[float]] = {}  # [calls, errors, prompt, completion, cost, latency_ms]
+        
+        # Metrics
+        self.flushed_rows = 0
+        self.flush_failures = 0
+    
+    def record(
+        self,
+        site: str,
+        model: str,
+        latency_seconds: float,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        cost_usd: float = 0.0,
+        error: Optional[str] = None
+    ):
+        caller = llm_caller.get()
+        tier = caller[1].value if caller else "background"
+        
+        stats = self.totals.get((site, model, tier))
+        if stats is None:
+            stats = self.totals[(site, model, tier)] = CallStats()
+        stats.calls += 1
+        if error:
+            stats.errors[error] = stats.errors.get(error, 0) + 1
+        stats.prompt_tokens += prompt_tokens
+        stats.completion_tokens += completion_tokens
+        stats.cost_usd += cost_usd
+        stats.latency_seconds += latency_seconds
+        stats.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, latency_seconds * 1000)] += 1
+        
+        user_id = caller[0] if caller else usage_user.get()
+        if user_id is None:
+            return
+        key = (user_id, datetime.utcnow().date(), site, model, tier)
+        row = self.pending.get(key)
+        if row is None:
+            row = self.pending[key] = [0, 0, 0, 0, 0.0, 0.0]
+        row[0] += 1
+        row[1] += 1 if error else 0
+        row[2] += prompt_tokens
+        row[3] += completion_tokens
+        row[4] += cost_usd
+        row[5] += latency_seconds * 1000
+    
+    def _requeue(self, rows: Dict[UsageKey, List[float]]):
+        for key, row in rows.items():
+            current = self.pending.setdefault(key, [0, 0, 0, 0, 0.0, 0.0])
+            for i, value in enumerate(row):
+                current[i] += value
+    
+    async def flush(self) -> int:
+        """Add buffered per-user totals to llm_usage; returns the number of rows written.
+        
+        Rows are upserted, so several workers can flush into the same day. On
+        failure the totals go back into the buffer for the next flush.
+        """
+        
+        if not self.pending:
+            return 0
+        rows, self.pending = self.pending, {}
+        
+        try:
+            async with AsyncSessionLocal() as db:
+                dialect = db.bind.dialect.name
+                insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+                for (user_id, day, site, model, tier), (calls, errors, prompt_tokens, completion_tokens, cost_usd, latency_ms) in rows.items():
+                    statement = insert(LLMUsage).values(
+                        user_id=user_id,
+                        day=day,
+                        call_site=site,
+                        model=model,
+                        tier=tier,
+                        calls=calls,
+                        errors=errors,
+                        prompt_tokens=prompt_tokens,
+                        completion_tokens=completion_tokens,
+                        cost_usd=cost_usd,
+                        latency_ms=latency_ms
+                    )
+                    await db.execute(statement.on_conflict_do_update(
+                        index_elements=["user_id", "day", "call_site", "model", "tier"],
+                        set_={
+                            column: getattr(LLMUsage, column) + getattr(statement.excluded, column)
+                            for column in ("calls", "errors", "prompt_tokens", "completion_tokens", "cost_usd", "latency_ms")
+                        }
+                    ))
+                await db.commit()
+        except Exception:
+            self.flush_failures += 1
+            self._requeue(rows)
+            raise
+        
+        self.flushed_rows += len(rows)
+        return len(rows)
+    
+    def stats(self, include_cost: bool = True) -> Dict:
+        """Worker-local totals; spend is left out unless include_cost (admin callers only)"""
+        by_site: Dict[str, CallStats] = {}
+        for (site, _, _), stats in self.totals.items():
+            total = by_site.setdefault(site, CallStats())
+            total.calls += stats.calls
+            for error, count in stats.errors.items():
+                total.errors[error] = total.errors.get(error, 0) + count
+            total.prompt_tokens += stats.prompt_tokens
+            total.completion_tokens += stats.completion_tokens
+            total.cost_usd += stats.cost_usd
+            total.latency_seconds += stats.latency_seconds
+            total.buckets = [a + b for a, b in zip(total.buckets, stats.buckets)]
+        
+        return {
+            "by_call_site": {site: stats.stats(include_cost) for site, stats in sorted(by_site.items())},
+            "calls": [
+                {"call_site": site, "model": model, "tier": tier, **stats.stats(include_cost)}
+                for (site, model, tier), stats in sorted(self.totals.items())
+            ],
+            "pending_rows": len(self.pending),
+            "flushed_rows": self.flushed_rows,
+            "flush_failures": self.flush_failures
+        }
+
+# Global recorder instance
+llm_usage = LLMUsageRecorder()
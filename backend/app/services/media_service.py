@@ -0,0 +1,203 @@
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import select, exists
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional, Set, Tuple
+import asyncio
+import io
+import logging
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models.attachment import Attachment, Blob, BlobVariant
+from app.services.storage_service import get_storage
+
+logger = logging.getLogger(__name__)
+
+# Content types Pillow can decode into derivatives
+IMAGE_CONTENT_TYPES = ["image/jpeg", "image/png", "image/gif", "image/webp", "image/bmp", "image/tiff"]
+
+# Variant name -> (longest edge in pixels, output format)
+VARIANTS = {
+    "thumb": (320, "WEBP"),
+    "thumb_jpeg": (320, "JPEG"),
+    "preview": (1280, "WEBP"),
+    "preview_jpeg": (1280, "JPEG"),
+}
+
+VARIANT_CONTENT_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg"}
+
+def render_variants(data: bytes) -> List[Tuple[str, bytes, str, int, int]]:
+    """Decode an image and encode every variant as (name, bytes, content_type, width, height).
+    
+    Runs in a worker process, so it only takes and returns plain values.
+    """
+    from PIL import Image, ImageOps
+    
+    with Image.open(io.BytesIO(data)) as source:
+        # Animated images keep their first frame
+        image = ImageOps.exif_transpose(source)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        
+        rendered = []
+        for name, (edge, image_format) in VARIANTS.items():
+            variant = image.copy()
+            variant.thumbnail((edge, edge), Image.LANCZOS)
+            
+            output = io.BytesIO()
+            if image_format == "JPEG":
+                if variant.mode == "RGBA":
+                    # JPEG has no alpha; flatten onto white
+                    background = Image.new("RGB", variant.size, (255, 255, 255))
+                    background.paste(variant, mask=variant.split()[3])
+                    variant = background
+                variant.save(output, "JPEG", quality=82, optimize=True, progressive=True)
+            else:
+                variant.save(output, "WEBP", quality=80, method=4)
+            
+            rendered.append((
+                name,
+                output.getvalue(),
+                VARIANT_CONTENT_TYPES[image_format],
+                variant.width,
+                variant.height
+            ))
+        
+        return rendered
+
+class MediaService:
+    """Lookups for image blobs and their derivatives"""
+    
+    @staticmethod
+    def is_image(content_type: str) -> bool:
+        return content_type.lower() in IMAGE_CONTENT_TYPES
+    
+    @staticmethod
+    async def get_variant(storage_key: str, variant: str, db: AsyncSession) -> Optional[BlobVariant]:
+        """The named derivative of the blob stored at storage_key, if it has been generated"""
+        return (await db.scalars(
+            select(BlobVariant)
+            .join(Blob, Blob.sha256 == BlobVariant.blob_sha256)
+            .where(Blob.storage_key == storage_key, BlobVariant.variant == variant)
+        )).first()
+    
+    @staticmethod
+    async def list_variants(storage_key: str, db: AsyncSession) -> List[str]:
+        return (await db.scalars(
+            select(BlobVariant.variant)
+            .join(Blob, Blob.sha256 == BlobVariant.blob_sha256)
+            .where(Blob.storage_key == storage_key)
+            .order_by(BlobVariant.variant)
+        )).all()
+    
+    @staticmethod
+    async def blobs_missing_variants(db: AsyncSession, limit: int) -> List[str]:
+        """Hashes of referenced image blobs that have no derivatives yet"""
+        return (await db.scalars(
+            select(Blob.sha256)
+            .join(Attachment, Attachment.storage_key == Blob.storage_key)
+            .where(
+                Attachment.content_type.in_(IMAGE_CONTENT_TYPES),
+                Blob.ref_count > 0,
+                Blob.size <= settings.MEDIA_MAX_SOURCE_BYTES,
+                ~exists().where(BlobVariant.blob_sha256 == Blob.sha256)
+            )
+            .distinct()
+            .limit(limit)
+        )).all()
+
+class MediaPipeline:
+    """Generates image derivatives in a process pool, fed by a bounded queue"""
+    
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue: Optional[asyncio.Queue] = None
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.tasks: List[asyncio.Task] = []
+        self.pending: Set[str] = set()
+        self.failed: Set[str] = set()  # Undecodable blobs, skipped until restart
+    
+    def start(self):
+        if self.tasks:
+            return
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Media pipeline started with {self.workers} workers")
+    
+    async def shutdown(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+    
+    def enqueue(self, sha256: str) -> bool:
+        """Queue a blob for derivatives; False when full or not running (the backfill job retries later)"""
+        
+        if not self.tasks or sha256 in self.pending or sha256 in self.failed:
+            return False
+        
+        try:
+            self.queue.put_nowait(sha256)
+        except asyncio.QueueFull:
+            return False
+        
+        self.pending.add(sha256)
+        return True
+    
+    async def _worker(self):
+        while True:
+            sha256 = await self.queue.get()
+            try:
+                await self._process(sha256)
+            except Exception as e:
+                self.failed.add(sha256)
+                logger.warning(f"Failed to generate derivatives for blob {sha256}: {str(e)}")
+            finally:
+                self.pending.discard(sha256)
+                self.queue.task_done()
+    
+    async def _process(self, sha256: str):
+        async with AsyncSessionLocal() as db:
+            blob = await db.get(Blob, sha256)
+            if not blob or blob.size > settings.MEDIA_MAX_SOURCE_BYTES:
+                return
+            
+            if await db.scalar(select(exists().where(BlobVariant.blob_sha256 == sha256))):
+                return
+            
+            storage = get_storage()
+            data = bytearray()
+            async for chunk in storage.read_range(blob.storage_key, 0, blob.size - 1):
+                data.extend(chunk)
+            
+            # Decoding and encoding are CPU-bound; keep them off the event loop
+            variants = await asyncio.get_running_loop().run_in_executor(
+                self.executor, render_variants, bytes(data)
+            )
+            
+            for name, payload, content_type, width, height in variants:
+                storage_key = f"derivatives/{sha256}/{name}"
+                await storage.put(storage_key, payload, content_type)
+                db.add(BlobVariant(
+                    blob_sha256=sha256,
+                    variant=name,
+                    storage_key=storage_key,
+                    content_type=content_type,
+                    width=width,
+                    height=height,
+                    size=len(payload)
+                ))
+            
+            try:
+                await db.commit()
+            except IntegrityError:
+                # Generated concurrently elsewhere; the stored objects are identical
+                await db.rollback()
+
+# Global pipeline instance
+media_pipeline = MediaPipeline(settings.MEDIA_WORKERS, settings.MEDIA_QUEUE_SIZE)
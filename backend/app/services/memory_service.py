@@ -0,0 +1,382 @@
+from collections import Counter, OrderedDict
+from sqlalchemy import select, delete, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Iterable, List, Optional, Set, Tuple
+import hashlib
+import logging
+import math
+import re
+import threading
+import time
+import numpy as np
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models.companion import CompanionConversation, CompanionMemory
+from app.models.message import Message, MessageStatus
+from app.services.llm_client import llm_client, LLMUnavailable
+from app.services.prompt_builder import truncate_to_tokens
+
+logger = logging.getLogger(__name__)
+
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "i", "if", "in", "is", "it", "me", "my",
+    "of", "on", "or", "so", "that", "the", "this", "to", "was", "we", "with", "you", "your", "i'm", "im"
+}
+
+# Rows embedded per catch-up pass, so a long backlog is spread over several requests
+MEMORY_SYNC_BATCH_SIZE = 200
+
+# Texts sent per embedding API call
+EMBED_BATCH_SIZE = 100
+
+# Longest snippet stored per memory
+MEMORY_SNIPPET_TOKENS = 80
+
+# Memory key: (source type, source id)
+MemoryKey = Tuple[str, int]
+
+class Embedder:
+    """Turns texts into L2-normalized float32 vectors of a fixed dimension"""
+    
+    name: str
+    dim: int
+    min_similarity: float  # Below this a match is noise rather than a related memory
+    duplicate_similarity: float  # Above this two short texts ask for the same thing
+    
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+    
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+class HashingEmbedder(Embedder):
+    """Deterministic, offline embedder: signed feature hashing of words and word pairs.
+    
+    Captures lexical overlap only, but needs no model or network, and gives the
+    same vectors in every process, which keeps tests and local runs reproducible.
+    """
+    
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+        self.min_similarity = 0.05
+        self.duplicate_similarity = 0.75
+    
+    def _features(self, text: str) -> Tuple[Counter, Counter]:
+        words = [word for word in WORD_PATTERN.findall(text.lower()) if word not in STOP_WORDS]
+        return Counter(words), Counter(f"{a} {b}" for a, b in zip(words, words[1:]))
+    
+    def embed_one(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        unigrams, bigrams = self._features(text)
+        for features, weight in ((unigrams, 1.0), (bigrams, 0.5)):
+            for feature, count in features.items():
+                digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+                sign = 1.0 if digest >> 63 else -1.0
+                vector[digest % self.dim] += sign * weight * (1 + math.log(count))
+        return vector
+    
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return self._normalize(np.stack([self.embed_one(text) for text in texts]))
+
+class OpenAIEmbedder(Embedder):
+    """Embeddings from the OpenAI API, through the shared LLM client"""
+    
+    def __init__(self, model: str, dim: int):
+        self.model = model
+        self.dim = dim
+        self.name = f"openai-{model}"
+        self.min_similarity = 0.3
+        self.duplicate_similarity = 0.85
+    
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = []
+        for start in range(0, len(texts), EMBED_BATCH_SIZE):
+            vectors.extend(await llm_client.embed(texts[start:start + EMBED_BATCH_SIZE], model=self.model))
+        if not vectors:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return self._normalize(np.asarray(vectors, dtype=np.float32))
+
+def get_embedder() -> Embedder:
+    if settings.MEMORY_EMBEDDER == "openai":
+        return OpenAIEmbedder(settings.MEMORY_OPENAI_MODEL, settings.MEMORY_OPENAI_DIM)
+    return HashingEmbedder(settings.MEMORY_HASHING_DIM)
+
+class VectorIndex:
+    """One user's memories as a float16 matrix with parallel key and snippet lists.
+    
+    Search is exact (one matrix-vector product) for small indexes. Larger ones
+    use random-hyperplane signatures to shortlist candidates by Hamming distance
+    and rerank only those exactly.
+    """
+    
+    def __init__(self, dim: int, signature_bits: int = 64, seed: int = 0):
+        self.dim = dim
+        self.vectors = np.zeros((0, dim), dtype=np.float16)
+        self.keys: List[MemoryKey] = []
+        self.texts: List[str] = []
+        self.planes = np.random.default_rng(seed).standard_normal((dim, signature_bits)).astype(np.float32)
+        self.signatures = np.zeros((0, signature_bits // 8), dtype=np.uint8)
+    
+    def __len__(self) -> int:
+        return len(self.keys)
+    
+    def _sign(self, vectors: np.ndarray) -> np.ndarray:
+        return np.packbits(vectors.astype(np.float32) @ self.planes > 0, axis=1)
+    
+    def add(self, keys: List[MemoryKey], texts: List[str], vectors: np.ndarray):
+        if not keys:
+            return
+        self.vectors = np.concatenate([self.vectors, vectors.astype(np.float16)])
+        self.signatures = np.concatenate([self.signatures, self._sign(vectors)])
+        self.keys.extend(keys)
+        self.texts.extend(texts)
+    
+    def max_source_id(self, source_type: str) -> int:
+        return max((source_id for kind, source_id in self.keys if kind == source_type), default=0)
+    
+    def search(
+        self,
+        query: np.ndarray,
+        k: int,
+        exclude: Optional[Set[MemoryKey]] = None,
+        approximate: Optional[bool] = None,
+        candidates: int = 256
+    ) -> List[Tuple[float, MemoryKey, str]]:
+        """Top-k (similarity, key, snippet) by cosine similarity"""
+        
+        if not self.keys or k <= 0:
+            return []
+        if approximate is None:
+            approximate = len(self.keys) > settings.MEMORY_EXACT_SEARCH_MAX
+        
+        rows = np.arange(len(self.keys))
+        if approximate and len(rows) > candidates:
+            # Hamming distance between signatures approximates angular distance
+            distances = np.unpackbits(self.signatures ^ self._sign(query[None, :]), axis=1).sum(axis=1)
+            rows = np.argpartition(distances, candidates)[:candidates]
+        
+        scores = self.vectors[rows].astype(np.float32) @ query.astype(np.float32)
+        order = np.argsort(-scores)
+        
+        results = []
+        for i in order:
+            key = self.keys[rows[i]]
+            if exclude and key in exclude:
+                continue
+            results.append((float(scores[i]), key, self.texts[rows[i]]))
+            if len(results) == k:
+                break
+        return results
+
+class VectorMemory:
+    """Per-user vector memory over companion conversations and message metadata.
+    
+    Embeddings are persisted in companion_memories; each worker keeps recently
+    used users' indexes in a bounded LRU and catches them up with new rows on
+    recall. Only message metadata (category, tags, dates, status) is indexed,
+    never the encrypted message content.
+    """
+    
+    def __init__(self, max_users: int, ttl_seconds: int):
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self.indexes: "OrderedDict[int, Tuple[float, VectorIndex]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self._embedder: Optional[Embedder] = None
+    
+    @property
+    def embedder(self) -> Embedder:
+        if self._embedder is None:
+            self._embedder = get_embedder()
+        return self._embedder
+    
+    @staticmethod
+    def conversation_snippet(conversation: CompanionConversation) -> str:
+        when = conversation.created_at.strftime("%Y-%m-%d") if conversation.created_at else "earlier"
+        return truncate_to_tokens(
+            f"[{when}] User: {conversation.user_message} | You: {conversation.companion_response}",
+            MEMORY_SNIPPET_TOKENS
+        )
+    
+    @staticmethod
+    def message_snippet(message: Message) -> str:
+        parts = [f"[{message.created_at:%Y-%m-%d}] The user wrote a {message.message_type.value} message to their future self"]
+        if message.category:
+            parts.append(f"about {message.category}")
+        if message.tags:
+            parts.append(f"tagged {', '.join(str(tag) for tag in message.tags)}")
+        if message.scheduled_for:
+            parts.append(f"to be delivered {message.scheduled_for:%Y-%m-%d}")
+        parts.append(f"({message.status.value})")
+        return " ".join(parts)
+    
+    async def _load(self, user_id: int, db: AsyncSession) -> VectorIndex:
+        index = VectorIndex(self.embedder.dim)
+        rows = (await db.execute(
+            select(CompanionMemory.source_type, CompanionMemory.source_id, CompanionMemory.content, CompanionMemory.vector)
+            .where(CompanionMemory.user_id == user_id, CompanionMemory.embedder == self.embedder.name)
+            .order_by(CompanionMemory.id)
+        )).all()
+        if rows:
+            index.add(
+                [(row.source_type, row.source_id) for row in rows],
+                [row.content for row in rows],
+                np.stack([np.frombuffer(row.vector, dtype=np.float16) for row in rows])
+            )
+        return index
+    
+    async def _get_index(self, user_id: int, db: AsyncSession) -> VectorIndex:
+        now = time.monotonic()
+        with self.lock:
+            entry = self.indexes.get(user_id)
+            if entry and entry[0] > now:
+                self.indexes.move_to_end(user_id)
+                return entry[1]
+        
+        index = await self._load(user_id, db)
+        with self.lock:
+            self.indexes[user_id] = (now + self.ttl_seconds, index)
+            self.indexes.move_to_end(user_id)
+            while len(self.indexes) > self.max_users:
+                self.indexes.popitem(last=False)
+        return index
+    
+    async def _store(self, user_id: int, index: VectorIndex, source_type: str, items: List[Tuple[int, str, str]]):
+        """Embed and persist (source_id, snippet, text to embed) items, then add them to the index.
+        
+        Writes go through their own session: if another request stored the
+        same rows first, only this session rolls back, and the caller's loaded
+        objects stay usable.
+        """
+        if not items:
+            return
+        vectors = await self.embedder.embed([text for _, _, text in items])
+        async with AsyncSessionLocal() as db:
+            await db.execute(insert(CompanionMemory), [
+                {
+                    "user_id": user_id,
+                    "source_type": source_type,
+                    "source_id": source_id,
+                    "content": text,
+                    "embedder": self.embedder.name,
+                    "vector": vector.astype(np.float16).tobytes()
+                }
+                for (source_id, text, _), vector in zip(items, vectors)
+            ])
+            await db.commit()
+        index.add([(source_type, source_id) for source_id, _, _ in items], [text for _, text, _ in items], vectors)
+    
+    async def sync(self, user_id: int, companion_id: int, db: AsyncSession) -> VectorIndex:
+        """Embed conversations and messages added since the index was last caught up"""
+        
+        index = await self._get_index(user_id, db)
+        
+        conversations = (await db.scalars(
+            select(CompanionConversation)
+            .where(
+                CompanionConversation.companion_id == companion_id,
+                CompanionConversation.id > index.max_source_id("conversation")
+            )
+            .order_by(CompanionConversation.id)
+            .limit(MEMORY_SYNC_BATCH_SIZE)
+        )).all()
+        messages = (await db.scalars(
+            select(Message)
+            .where(Message.user_id == user_id, Message.id > index.max_source_id("message"))
+            .order_by(Message.id)
+            .limit(MEMORY_SYNC_BATCH_SIZE)
+        )).all()
+        
+        try:
+            await self._store(user_id, index, "conversation", [
+                (
+                    conversation.id,
+                    self.conversation_snippet(conversation),
+                    f"{conversation.user_message} {conversation.companion_response}"
+                )
+                for conversation in conversations
+            ])
+            await self._store(user_id, index, "message", [
+                (message.id, self.message_snippet(message), f"{message.category or ''} {' '.join(str(tag) for tag in message.tags or [])}")
+                for message in messages
+            ])
+        except LLMUnavailable:
+            # Nothing was stored; the next recall retries
+            pass
+        except IntegrityError as e:
+            # Another request indexed the same rows first; reload from the table next time
+            self.evict(user_id)
+            logger.warning(f"Memory sync for user {user_id} failed: {str(e)}")
+        
+        return index
+    
+    async def recall(
+        self,
+        user_id: int,
+        companion_id: int,
+        query: str,
+        db: AsyncSession,
+        exclude: Iterable[MemoryKey] = (),
+        k: Optional[int] = None
+    ) -> List[str]:
+        """Snippets of the k past memories most similar to the query"""
+        
+        index = await self.sync(user_id, companion_id, db)
+        if not len(index):
+            return []
+        
+        try:
+            query_vector = (await self.embedder.embed([query]))[0]
+        except LLMUnavailable:
+            return []
+        
+        k = k or settings.MEMORY_TOP_K
+        min_similarity = settings.MEMORY_MIN_SIMILARITY if settings.MEMORY_MIN_SIMILARITY is not None else self.embedder.min_similarity
+        results = [
+            (key, text) for score, key, text in index.search(query_vector, k * 2, exclude=set(exclude))
+            if score >= min_similarity
+        ]
+        
+        # Another worker's cached index may still hold messages deleted or archived since
+        # it was loaded; only eviction on this worker is immediate, so check the table
+        message_ids = [source_id for (kind, source_id), _ in results if kind == "message"]
+        if message_ids:
+            live = set((await db.scalars(
+                select(Message.id).where(
+                    Message.id.in_(message_ids),
+                    Message.user_id == user_id,
+                    Message.status != MessageStatus.ARCHIVED
+                )
+            )).all())
+            results = [(key, text) for key, text in results if key[0] != "message" or key[1] in live]
+        
+        return [text for _, text in results[:k]]
+    
+    def evict(self, *user_ids: int):
+        with self.lock:
+            for user_id in user_ids:
+                self.indexes.pop(user_id, None)
+    
+    async def remove_messages(self, user_id: int, message_ids, db: AsyncSession):
+        """Forget memories of deleted messages (a list or a subquery), in the caller's transaction"""
+        await db.execute(
+            delete(CompanionMemory)
+            .where(
+                CompanionMemory.user_id == user_id,
+                CompanionMemory.source_type == "message",
+                CompanionMemory.source_id.in_(message_ids)
+            )
+            .execution_options(synchronize_session=False)
+        )
+        self.evict(user_id)
+
+# Global memory instance
+vector_memory = VectorMemory(settings.MEMORY_CACHE_MAX_USERS, settings.MEMORY_CACHE_TTL_SECONDS)
@@ -0,0 +1,79 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+import asyncio
+import time
+from app.core.config import settings
+from app.core.security import get_password_hash, verify_and_update_password
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing queue is full"""
+
+class PasswordHasher:
+    """Runs password hashing in a dedicated, bounded thread pool so it never blocks the event loop.
+    
+    argon2 and bcrypt release the GIL while hashing, so threads give real parallelism
+    without the pickling overhead of a process pool.
+    """
+    
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        
+        # Metrics
+        self.in_flight = 0  # Submitted and not finished (running + waiting)
+        self.peak_in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait_seconds = 0.0
+        self.total_hash_seconds = 0.0
+    
+    async def _run(self, func, *args):
+        # Shed load instead of letting an unbounded backlog build up behind the pool
+        if self.in_flight >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise PasswordHasherBusy()
+        
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        submitted = time.perf_counter()
+        
+        def timed():
+            started = time.perf_counter()
+            return started, func(*args)
+        
+        try:
+            started, result = await asyncio.get_running_loop().run_in_executor(self.executor, timed)
+            finished = time.perf_counter()
+            self.total_wait_seconds += started - submitted
+            self.total_hash_seconds += finished - started
+            self.completed += 1
+            return result
+        finally:
+            self.in_flight -= 1
+    
+    async def hash(self, password: str) -> str:
+        return await self._run(get_password_hash, password)
+    
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """Verify a password; also returns a new hash if the stored one should be upgraded"""
+        return await self._run(verify_and_update_password, password, hashed_password)
+    
+    def stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "in_flight": self.in_flight,
+            "queue_depth": max(self.in_flight - self.workers, 0),
+            "peak_in_flight": self.peak_in_flight,
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.total_wait_seconds / self.completed * 1000, 2) if self.completed else 0,
+            "avg_hash_ms": round(self.total_hash_seconds / self.completed * 1000, 2) if self.completed else 0
+        }
+    
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+# Global hasher instance
+password_hasher = PasswordHasher(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_MAX_QUEUE)
@@ -195,7 +195,7 @@ class PaymentService:
         }
     
     @staticmethod
-    def check_message_limit(user, db) -> Dict:
+    async def check_message_limit(user, db) -> Dict:
         """Check if user can create more messages based on their tier"""
         
         tier = user.subscription_tier
@@ -207,16 +207,16 @@ class PaymentService:
         
         # Count messages created this month
         from app.models.message import Message
-        from sqlalchemy import func, extract
+        from sqlalchemy import func, extract, select
         
         current_month = datetime.utcnow().month
         current_year = datetime.utcnow().year
         
-        message_count = db.query(func.count(Message.id)).filter(
+        message_count = await db.scalar(select(func.count(Message.id)).where(
             Message.user_id == user.id,
             extract('month', Message.created_at) == current_month,
             extract('year', Message.created_at) == current_year
-        ).scalar()
+        ))
         
         limit = pricing["message_limit"]
         remaining = limit - message_count
@@ -253,21 +253,21 @@ class PaymentService:
         }
     
     @staticmethod
-    def calculate_mrr(db) -> Dict:
+    async def calculate_mrr(db) -> Dict:
         """Calculate Monthly Recurring Revenue"""
         
         from app.models.user import User
-        from sqlalchemy import func
+        from sqlalchemy import func, select
         
         # Count active premium subscribers (all premium users for now)
-        premium_count = db.query(func.count(User.id)).filter(
+        premium_count = await db.scalar(select(func.count(User.id)).where(
             User.subscription_tier == SubscriptionTier.PREMIUM
-        ).scalar() or 0
+        )) or 0
         
         # Lifetime is one-time, but we can amortize over 12 months for MRR calculation
-        lifetime_count = db.query(func.count(User.id)).filter(
+        lifetime_count = await db.scalar(select(func.count(User.id)).where(
             User.subscription_tier == SubscriptionTier.LIFETIME
-        ).scalar() or 0
+        )) or 0
         
         premium_mrr = premium_count * PRICING[SubscriptionTier.PREMIUM]["price"]
         lifetime_mrr = lifetime_count * (PRICING[SubscriptionTier.LIFETIME]["price"] / 12)
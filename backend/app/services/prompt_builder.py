@@ -0,0 +1,123 @@
+from typing import Dict, List, Optional
+import json
+
+# Rough characters per token for English text, used when tiktoken isn't installed
+CHARS_PER_TOKEN = 4
+
+# Per-message framing overhead of the chat format
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoding = None
+
+def count_tokens(text: str) -> int:
+    """Token count of text (exact with tiktoken installed, otherwise a character estimate)"""
+    global _encoding
+    if not text:
+        return 0
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except ImportError:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def truncate_to_tokens(text: str, max_tokens: int, keep_end: bool = False) -> str:
+    """Cut text down to about max_tokens, at a word boundary"""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    
+    words = text.split()
+    if keep_end:
+        words.reverse()
+    kept = []
+    used = 0
+    for word in words:
+        used += count_tokens(word + " ")
+        if used > max_tokens:
+            break
+        kept.append(word)
+    if keep_end:
+        kept.reverse()
+        return "…" + " ".join(kept)
+    return " ".join(kept) + "…"
+
+def render_context(user_context: Dict, max_tokens: int) -> str:
+    """Render learned user context as "key: value" lines, dropping whatever doesn't fit"""
+    lines = []
+    used = 0
+    for key, value in (user_context or {}).items():
+        if value in (None, "", [], {}):
+            continue
+        text = value if isinstance(value, str) else json.dumps(value, default=str)
+        line = f"- {key}: {truncate_to_tokens(text, max(max_tokens // 4, 16))}"
+        cost = count_tokens(line) + 1
+        if used + cost > max_tokens:
+            break
+        lines.append(line)
+        used += cost
+    return "\n".join(lines)
+
+def build_chat_messages(
+    system_prompt: str,
+    user_message: str,
+    conversation_history: List[Dict],
+    budget: int,
+    summary: Optional[str] = None,
+    user_context: Optional[Dict] = None,
+    memories: Optional[List[str]] = None,
+    summary_max_tokens: int = 300,
+    context_max_tokens: int = 200,
+    memory_max_tokens: int = 250
+) -> List[Dict]:
+    """Assemble chat messages that fit a fixed input-token budget.
+    
+    The system prompt and the new user message always go in. The remaining
+    budget goes first to the user context, conversation summary and recalled
+    memories (each up to its own cap, memories in order of relevance), and then
+    to recent turns, newest first, until it runs out.
+    """
+    
+    sections = [system_prompt]
+    remaining = budget - count_tokens(system_prompt) - count_tokens(user_message) - 2 * MESSAGE_OVERHEAD_TOKENS
+    
+    context = render_context(user_context, min(context_max_tokens, remaining))
+    if context:
+        sections.append(f"What you know about the user:\n{context}")
+        remaining -= count_tokens(context) + 8
+    
+    if summary and remaining > 0:
+        # Keep the end of the summary: it's the most recent part
+        summary = truncate_to_tokens(summary, min(summary_max_tokens, remaining), keep_end=True)
+        sections.append(f"Summary of your earlier conversations:\n{summary}")
+        remaining -= count_tokens(summary) + 8
+    
+    recalled = []
+    memory_budget = min(memory_max_tokens, remaining)
+    for memory in memories or []:
+        cost = count_tokens(memory) + 2
+        if cost > memory_budget:
+            break
+        recalled.append(f"- {memory}")
+        memory_budget -= cost
+    if recalled:
+        sections.append("Relevant moments from your past conversations:\n" + "\n".join(recalled))
+        remaining -= sum(count_tokens(line) + 1 for line in recalled) + 10
+    
+    turns = []
+    for turn in reversed(conversation_history):
+        pair = [
+            {"role": "user", "content": turn["user_message"]},
+            {"role": "assistant", "content": turn["companion_response"]}
+        ]
+        cost = sum(count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in pair)
+        if cost > remaining:
+            break
+        turns[:0] = pair
+        remaining -= cost
+    
+    return [{"role": "system", "content": "\n\n".join(sections)}] + turns + [{"role": "user", "content": user_message}]
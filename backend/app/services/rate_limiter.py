@@ -0,0 +1,139 @@
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import logging
+import math
+import threading
+import time
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+WINDOW_SECONDS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+# Sliding-window counter: weight the previous window by how much of it still overlaps,
+# then grant up to `requested` of whatever remains. Returns the number granted.
+SLIDING_WINDOW_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+local limit = tonumber(ARGV[1])
+local overlap = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local available = math.floor(limit - (previous * overlap + current))
+if available <= 0 then
+    return 0
+end
+local granted = math.min(available, requested)
+redis.call('INCRBY', KEYS[1], granted)
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[4]))
+return granted
+"""
+
+def parse_limit(limit: str) -> Tuple[int, int]:
+    """Parse "20/minute" into (20, 60)"""
+    count, _, period = limit.partition("/")
+    return int(count), WINDOW_SECONDS[period.strip().rstrip("s")]
+
+class RateLimiter:
+    """Sliding-window rate limiter shared through Redis, with a local pre-check.
+    
+    Each worker leases a slice of the remaining allowance from Redis and spends it
+    locally, so most requests never leave the process; once a key is exhausted, it
+    is rejected locally until the window moves on. Without Redis (or if it fails)
+    the same algorithm runs on in-process counters.
+    """
+    
+    def __init__(self, lease_fraction: float, max_keys: int):
+        self.lease_fraction = lease_fraction
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        self.leases: Dict[str, Tuple[int, int]] = {}  # key -> (window index, tokens left)
+        self.blocked: Dict[str, float] = {}  # key -> denied until (epoch seconds)
+        # key -> (window index, current, previous, useless after (epoch seconds)), least recently used first
+        self.counters: "OrderedDict[str, Tuple[int, int, int, float]]" = OrderedDict()
+        self._redis = None
+        self._script = None
+    
+    def _redis_client(self):
+        if self._redis is None and settings.RATE_LIMIT_REDIS:
+            import redis.asyncio
+            self._redis = redis.asyncio.from_url(settings.REDIS_URL)
+            self._script = self._redis.register_script(SLIDING_WINDOW_SCRIPT)
+        return self._redis
+    
+    def _prune(self, now: float):
+        """Drop state for keys that have gone quiet (called with the lock held).
+        
+        Counters whose windows have both passed go first; if that is not
+        enough, the least recently used ones are evicted until the cap holds.
+        """
+        self.blocked = {key: until for key, until in self.blocked.items() if until > now}
+        self.leases = {key: lease for key, lease in self.leases.items() if lease[1] > 0}
+        self.counters = OrderedDict(
+            (key, counter) for key, counter in self.counters.items() if counter[3] > now
+        )
+        while self.counters and len(self.leases) + len(self.blocked) + len(self.counters) > self.max_keys:
+            self.counters.popitem(last=False)
+    
+    def _lease_size(self, limit: int) -> int:
+        return max(1, int(limit * self.lease_fraction))
+    
+    def _acquire_local(self, key: str, limit: int, window: int, window_index: int, overlap: float, requested: int) -> int:
+        with self.lock:
+            index, current, previous, _ = self.counters.get(key, (window_index, 0, 0, 0))
+            if index != window_index:
+                previous = current if index == window_index - 1 else 0
+                current = 0
+            available = math.floor(limit - (previous * overlap + current))
+            granted = max(0, min(available, requested))
+            # Once the next window has also passed, this count no longer weighs on anything
+            self.counters[key] = (window_index, current + granted, previous, (window_index + 2) * window)
+            self.counters.move_to_end(key)
+            return granted
+    
+    async def _acquire(self, key: str, limit: int, window: int, window_index: int, overlap: float, requested: int) -> int:
+        client = self._redis_client()
+        if client is not None:
+            try:
+                return int(await self._script(
+                    keys=[f"{key}:{window_index}", f"{key}:{window_index - 1}"],
+                    args=[limit, overlap, requested, window * 2]
+                ))
+            except Exception as e:
+                logger.warning(f"Rate limiter Redis call failed, counting locally: {str(e)}")
+        return self._acquire_local(key, limit, window, window_index, overlap, requested)
+    
+    async def hit(self, key: str, limit: int, window: int) -> Optional[int]:
+        """Consume one request; returns None if allowed, else seconds until retry"""
+        
+        now = time.time()
+        window_index = int(now // window)
+        elapsed = now - window_index * window
+        retry_after = max(1, math.ceil(window - elapsed))
+        
+        with self.lock:
+            if len(self.leases) + len(self.blocked) + len(self.counters) > self.max_keys:
+                self._prune(now)
+            
+            # Local pre-check: known-exhausted keys and leased allowance need no Redis round trip
+            if self.blocked.get(key, 0) > now:
+                return max(1, math.ceil(self.blocked[key] - now))
+            
+            index, tokens = self.leases.get(key, (window_index, 0))
+            if index == window_index and tokens > 0:
+                self.leases[key] = (index, tokens - 1)
+                return None
+        
+        granted = await self._acquire(key, limit, window, window_index, 1 - elapsed / window, self._lease_size(limit))
+        
+        with self.lock:
+            if granted <= 0:
+                self.blocked[key] = now + retry_after
+                self.leases.pop(key, None)
+                return retry_after
+            
+            self.blocked.pop(key, None)
+            self.leases[key] = (window_index, granted - 1)
+            return None
+
+# Global limiter instance
+rate_limiter = RateLimiter(settings.RATE_LIMIT_LEASE_FRACTION, settings.RATE_LIMIT_MAX_KEYS)
@@ -0,0 +1,246 @@
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, FrozenSet, List, Optional, Tuple
+import asyncio
+import copy
+import logging
+import re
+import time
+import numpy as np
+from app.core.config import settings
+from app.services.llm_client import LLMUnavailable
+from app.services.memory_service import Embedder, get_embedder
+
+logger = logging.getLogger(__name__)
+
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+# (personality, normalized intent)
+CacheKey = Tuple[str, str]
+
+class CacheEntry:
+    __slots__ = ("key", "specifics", "vector", "response", "expires_at", "hits")
+    
+    def __init__(self, key: CacheKey, specifics: FrozenSet[str], vector: np.ndarray, response: Dict, expires_at: float):
+        self.key = key
+        self.specifics = specifics
+        self.vector = vector
+        self.response = response
+        self.expires_at = expires_at
+        self.hits = 0
+
+class SemanticResponseCache:
+    """LLM responses shared between near-duplicate requests.
+    
+    Entries are keyed by personality and normalized intent. A lookup first
+    tries the exact key, then the most similar cached intent of the same
+    personality above the similarity threshold. Intents naming different
+    people, places or numbers never share an entry, so one user's specifics
+    can't end up in another user's draft. Entries expire after a TTL and the
+    least recently used are evicted past max_entries. Concurrent misses for the
+    same key share one LLM call.
+    """
+    
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries: "OrderedDict[CacheKey, CacheEntry]" = OrderedDict()
+        self.matrices: Dict[str, Tuple[np.ndarray, List[CacheKey]]] = {}  # Per personality, rebuilt after changes
+        self.pending: Dict[CacheKey, asyncio.Future] = {}
+        self._embedder: Optional[Embedder] = None
+        
+        # Metrics
+        self.lookups = 0
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.coalesced = 0
+        self.degraded_hits = 0  # Served by similar() while the LLM was unavailable
+        self.evictions = 0
+        self.llm_calls = 0
+        self.llm_spend_usd = 0.0
+    
+    @property
+    def embedder(self) -> Embedder:
+        if self._embedder is None:
+            self._embedder = get_embedder()
+        return self._embedder
+    
+    @property
+    def min_similarity(self) -> float:
+        if settings.HELP_CRAFT_CACHE_MIN_SIMILARITY is not None:
+            return settings.HELP_CRAFT_CACHE_MIN_SIMILARITY
+        return self.embedder.duplicate_similarity
+    
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(WORD_PATTERN.findall(text.lower()))
+    
+    @staticmethod
+    def specifics(text: str) -> FrozenSet[str]:
+        """Words that make an intent personal: capitalized mid-sentence words and numbers"""
+        words = WORD_PATTERN.findall(text)
+        return frozenset(
+            word.lower() for i, word in enumerate(words)
+            if any(char.isdigit() for char in word) or (i > 0 and word[0].isupper() and word != "I")
+        )
+    
+    def _touch(self, entry: CacheEntry) -> Dict:
+        entry.hits += 1
+        self.entries.move_to_end(entry.key)
+        return copy.deepcopy(entry.response)
+    
+    def _remove(self, key: CacheKey):
+        self.entries.pop(key, None)
+        self.matrices.pop(key[0], None)
+    
+    def _matrix(self, personality: str) -> Tuple[np.ndarray, List[CacheKey]]:
+        if personality not in self.matrices:
+            keys = [key for key in self.entries if key[0] == personality]
+            vectors = [self.entries[key].vector for key in keys]
+            matrix = np.stack(vectors) if vectors else np.zeros((0, self.embedder.dim), dtype=np.float32)
+            self.matrices[personality] = (matrix, keys)
+        return self.matrices[personality]
+    
+    def _nearest(
+        self,
+        personality: str,
+        vector: np.ndarray,
+        specifics: FrozenSet[str],
+        min_similarity: float,
+        include_expired: bool = False
+    ) -> Optional[CacheEntry]:
+        matrix, keys = self._matrix(personality)
+        if not keys:
+            return None
+        scores = matrix @ vector
+        now = time.monotonic()
+        for i in np.argsort(-scores):
+            if scores[i] < min_similarity:
+                return None
+            entry = self.entries.get(keys[i])
+            if entry is None or (entry.expires_at <= now and not include_expired):
+                continue
+            if entry.specifics == specifics:
+                return entry
+        return None
+    
+    def _store(self, key: CacheKey, specifics: FrozenSet[str], vector: np.ndarray, response: Dict):
+        self._remove(key)
+        self.entries[key] = CacheEntry(key, specifics, vector, copy.deepcopy(response), time.monotonic() + self.ttl_seconds)
+        while len(self.entries) > self.max_entries:
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+            self.evictions += 1
+    
+    def record_spend(self, cost_usd: float):
+        """Count an LLM call made on a miss and its estimated cost"""
+        self.llm_calls += 1
+        self.llm_spend_usd += cost_usd
+    
+    async def get_or_create(
+        self,
+        personality: str,
+        text: str,
+        create: Callable[[], Awaitable[Dict]]
+    ) -> Dict:
+        """Cached response for (personality, text), or create() one and cache it.
+        
+        Exceptions from create() propagate and nothing is cached. The returned
+        dict is a copy, so callers may personalize it in place.
+        """
+        
+        self.lookups += 1
+        key = (personality, self.normalize(text))
+        
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry.expires_at > time.monotonic():
+                self.exact_hits += 1
+                return self._touch(entry)
+            self._remove(key)
+        
+        pending = self.pending.get(key)
+        if pending is not None:
+            # Share the in-flight call; if it fails, make our own
+            await asyncio.wait([pending])
+            if not pending.cancelled() and pending.exception() is None:
+                self.coalesced += 1
+                return copy.deepcopy(pending.result())
+            return await create()
+        
+        future = asyncio.get_running_loop().create_future()
+        self.pending[key] = future
+        try:
+            response = await self._lookup_or_create(key, text, create)
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                future.exception()  # Retrieved, even if nobody was waiting
+            raise
+        finally:
+            self.pending.pop(key, None)
+        
+        future.set_result(response)
+        return copy.deepcopy(response)
+    
+    async def _lookup_or_create(self, key: CacheKey, text: str, create: Callable[[], Awaitable[Dict]]) -> Dict:
+        specifics = self.specifics(text)
+        try:
+            vector = (await self.embedder.embed([key[1]]))[0]
+        except LLMUnavailable:
+            # Without a vector nothing can be matched or stored
+            return await create()
+        
+        entry = self._nearest(key[0], vector, specifics, self.min_similarity)
+        if entry is not None:
+            self.semantic_hits += 1
+            return self._touch(entry)
+        
+        response = await create()
+        self._store(key, specifics, vector, response)
+        return response
+    
+    async def similar(self, personality: str, text: str) -> Optional[Dict]:
+        """Closest cached response at the looser related-text threshold, even if expired.
+        
+        For when the LLM can't be reached: a related draft beats a generic one.
+        """
+        
+        try:
+            vector = (await self.embedder.embed([self.normalize(text)]))[0]
+        except LLMUnavailable:
+            return None
+        entry = self._nearest(personality, vector, self.specifics(text), self.embedder.min_similarity, include_expired=True)
+        if entry is None:
+            return None
+        self.degraded_hits += 1
+        return copy.deepcopy(entry.response)
+    
+    def clear(self):
+        self.entries.clear()
+        self.matrices.clear()
+    
+    def stats(self, include_cost: bool = True) -> Dict:
+        """Cache counters; spend and savings are left out unless include_cost (admin callers only)"""
+        hits = self.exact_hits + self.semantic_hits + self.coalesced
+        avg_cost = self.llm_spend_usd / self.llm_calls if self.llm_calls else 0.0
+        stats = {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "lookups": self.lookups,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "coalesced": self.coalesced,
+            "hit_rate": round(hits / self.lookups, 3) if self.lookups else 0,
+            "degraded_hits": self.degraded_hits,
+            "evictions": self.evictions,
+            "llm_calls": self.llm_calls
+        }
+        if include_cost:
+            stats["llm_spend_usd"] = round(self.llm_spend_usd, 4)
+            stats["estimated_savings_usd"] = round(hits * avg_cost, 4)
+        return stats
+
+# Global cache instance for help-craft-message drafts
+help_craft_cache = SemanticResponseCache(settings.HELP_CRAFT_CACHE_MAX_ENTRIES, settings.HELP_CRAFT_CACHE_TTL_SECONDS)
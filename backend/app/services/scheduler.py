@@ -1,11 +1,17 @@
-from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from datetime import datetime
 from sqlalchemy.orm import Session
-from app.core.database import SessionLocal
+from app.core.database import SessionLocal, AsyncSessionLocal
 from app.models.message import Message, MessageStatus
 from app.models.user import User
 from app.core.security import MessageEncryption
 from app.services.email_service import EmailService
+from app.services.version_service import VersionService
+from app.services.blob_service import BlobService, GC_BATCH_SIZE
+from app.services.media_service import MediaService, media_pipeline
+from app.services.session_service import SessionService, SESSION_PURGE_BATCH_SIZE
+from app.services.checkin_service import CheckinService
+from app.services.llm_usage import llm_usage
 import logging
 
 logger = logging.getLogger(__name__)
@@ -14,7 +20,8 @@ class MessageDeliveryScheduler:
     """Background scheduler for automatic message delivery"""
     
     def __init__(self):
-        self.scheduler = BackgroundScheduler()
+        # Runs on the app's event loop; plain functions still execute in worker threads
+        self.scheduler = AsyncIOScheduler()
         self.scheduler.add_job(
             func=self.check_and_deliver_messages,
             trigger="interval",
@@ -79,16 +86,17 @@ class MessageDeliveryScheduler:
                     # Update message status
                     message.status = MessageStatus.DELIVERED
                     message.delivered_at = datetime.utcnow()
+                    VersionService.bump_sync(db, user.id)
                     
                     db.commit()
                     
                     logger.info(f"Delivered message {message.id} to user {user.email}")
-                    
+                
                 except Exception as e:
                     logger.error(f"Failed to deliver message {message.id}: {str(e)}")
                     db.rollback()
                     continue
-            
+        
         except Exception as e:
             logger.error(f"Error in message delivery job: {str(e)}")
         finally:
@@ -126,6 +134,73 @@ class MessageDeliveryScheduler:
         finally:
             db.close()
     
+    @staticmethod
+    async def collect_blob_garbage():
+        """Reclaim unreferenced attachment blobs, one bounded batch per transaction"""
+        
+        total = 0
+        try:
+            async with AsyncSessionLocal() as db:
+                while True:
+                    removed = await BlobService.collect_garbage(db, GC_BATCH_SIZE)
+                    total += removed
+                    if removed < GC_BATCH_SIZE:
+                        break
+            if total:
+                logger.info(f"Garbage collected {total} unreferenced blobs")
+        except Exception as e:
+            logger.error(f"Error in blob garbage collection job: {str(e)}")
+    
+    @staticmethod
+    async def backfill_media_derivatives():
+        """Queue image blobs still missing derivatives (e.g. dropped while the queue was full)"""
+        
+        try:
+            async with AsyncSessionLocal() as db:
+                hashes = await MediaService.blobs_missing_variants(db, limit=media_pipeline.queue_size)
+            queued = sum(1 for sha256 in hashes if media_pipeline.enqueue(sha256))
+            if queued:
+                logger.info(f"Queued {queued} blobs for media derivatives")
+        except Exception as e:
+            logger.error(f"Error in media derivative backfill job: {str(e)}")
+    
+    @staticmethod
+    async def purge_stale_sessions():
+        """Delete rotated, revoked and expired refresh sessions in bounded batches"""
+        
+        total = 0
+        try:
+            async with AsyncSessionLocal() as db:
+                while True:
+                    removed = await SessionService.purge_stale(db, SESSION_PURGE_BATCH_SIZE)
+                    total += removed
+                    if removed < SESSION_PURGE_BATCH_SIZE:
+                        break
+            if total:
+                logger.info(f"Purged {total} stale sessions")
+        except Exception as e:
+            logger.error(f"Error in session purge job: {str(e)}")
+    
+    @staticmethod
+    async def precompute_checkins():
+        """Generate companion check-ins that are due within the lead window"""
+        
+        try:
+            stored = await CheckinService.precompute()
+            if stored:
+                logger.info(f"Pre-generated {stored} daily check-ins")
+        except Exception as e:
+            logger.error(f"Error in check-in precompute job: {str(e)}")
+    
+    @staticmethod
+    async def flush_llm_usage():
+        """Add buffered per-user LLM usage to the llm_usage table"""
+        
+        try:
+            await llm_usage.flush()
+        except Exception as e:
+            logger.error(f"Error in LLM usage flush job: {str(e)}")
+    
     def add_daily_reminder_job(self):
         """Add job to send daily reminders at 9 AM"""
         self.scheduler.add_job(
@@ -137,6 +212,62 @@ class MessageDeliveryScheduler:
             name="Send daily reminders",
             replace_existing=True
         )
+    
+    def add_blob_gc_job(self):
+        """Add job to garbage collect unreferenced blobs every 10 minutes"""
+        self.scheduler.add_job(
+            func=self.collect_blob_garbage,
+            trigger="interval",
+            minutes=10,
+            id="blob_gc_job",
+            name="Garbage collect unreferenced blobs",
+            replace_existing=True
+        )
+    
+    def add_media_backfill_job(self):
+        """Add job to queue missing image derivatives every 5 minutes"""
+        self.scheduler.add_job(
+            func=self.backfill_media_derivatives,
+            trigger="interval",
+            minutes=5,
+            id="media_backfill_job",
+            name="Backfill image derivatives",
+            replace_existing=True
+        )
+    
+    def add_session_purge_job(self):
+        """Add job to purge dead refresh sessions every hour"""
+        self.scheduler.add_job(
+            func=self.purge_stale_sessions,
+            trigger="interval",
+            hours=1,
+            id="session_purge_job",
+            name="Purge stale sessions",
+            replace_existing=True
+        )
+    
+    def add_checkin_precompute_job(self):
+        """Add job to pre-generate upcoming daily check-ins every hour"""
+        self.scheduler.add_job(
+            func=self.precompute_checkins,
+            trigger="interval",
+            hours=1,
+            id="checkin_precompute_job",
+            name="Pre-generate daily check-ins",
+            replace_existing=True,
+            next_run_time=datetime.now()
+        )
+    
+    def add_llm_usage_flush_job(self):
+        """Add job to flush per-user LLM usage every minute"""
+        self.scheduler.add_job(
+            func=self.flush_llm_usage,
+            trigger="interval",
+            minutes=1,
+            id="llm_usage_flush_job",
+            name="Flush LLM usage",
+            replace_existing=True
+        )
 
 # Global scheduler instance
 scheduler = MessageDeliveryScheduler()
@@ -0,0 +1,159 @@
+from sqlalchemy import select, delete, insert, func, exists
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Iterable, List, Set, Tuple
+import base64
+import hashlib
+import hmac
+import re
+from app.core.security import MessageEncryption
+from app.models.message import Message, MessageSearchToken
+from app.models.user import User
+
+# Words shorter than this are not indexed or searched
+MIN_TOKEN_LENGTH = 2
+
+# Messages decrypted per chunk while backfilling an index
+BACKFILL_CHUNK_SIZE = 500
+
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+class SearchService:
+    """Encrypted message search through a per-user blind index of keyed-HMAC word tokens"""
+    
+    @staticmethod
+    def tokenize(text: str) -> Set[str]:
+        """Split text into the set of normalized words that get indexed"""
+        return {
+            word for word in WORD_PATTERN.findall(text.lower())
+            if len(word) >= MIN_TOKEN_LENGTH
+        }
+    
+    @staticmethod
+    def _index_key(encryption_key: str) -> bytes:
+        """Derive the user's index key from their message key, so tokens differ per user"""
+        return hmac.new(base64.b64decode(encryption_key), b"future-you-search-index", hashlib.sha256).digest()
+    
+    @staticmethod
+    def blind_tokens(text: str, encryption_key: str) -> List[str]:
+        """Keyed-HMAC tokens for every word in the text"""
+        key = SearchService._index_key(encryption_key)
+        return [
+            hmac.new(key, word.encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+            for word in SearchService.tokenize(text)
+        ]
+    
+    @staticmethod
+    async def index_messages(
+        user_id: int,
+        encryption_key: str,
+        messages: Iterable[Tuple[int, str]],
+        db: AsyncSession
+    ):
+        """Add postings for (message_id, plaintext) pairs in the caller's transaction"""
+        
+        rows = [
+            {"user_id": user_id, "message_id": message_id, "token": token}
+            for message_id, content in messages
+            for token in SearchService.blind_tokens(content, encryption_key)
+        ]
+        if rows:
+            await db.execute(insert(MessageSearchToken), rows)
+    
+    @staticmethod
+    async def is_enabled(user_id: int, db: AsyncSession) -> bool:
+        """Whether the user is opted in, as of the caller's transaction.
+        
+        Writers check this rather than the cached principal, which another
+        worker's enable/disable may not have reached yet. Call it after
+        VersionService.bump: the bump locks the users row, so enable and
+        disable can't commit in between.
+        """
+        return bool(await db.scalar(select(User.search_index_enabled).where(User.id == user_id)))
+    
+    @staticmethod
+    async def remove_messages(message_ids, db: AsyncSession):
+        """Drop postings for the given message IDs (a list or a subquery)"""
+        await db.execute(
+            delete(MessageSearchToken)
+            .where(MessageSearchToken.message_id.in_(message_ids))
+            .execution_options(synchronize_session=False)
+        )
+    
+    @staticmethod
+    async def enable(user, db: AsyncSession) -> int:
+        """Opt the user in and backfill the index from their existing messages.
+        
+        The opt-in is committed first, so messages written from then on index
+        themselves; the backfill covers everything committed before it and
+        skips messages that already have postings, which also makes a retry
+        after a failed backfill pick up where it stopped.
+        """
+        
+        user.search_index_enabled = True
+        await db.commit()
+        
+        indexed = 0
+        messages = await db.stream(
+            select(Message.id, Message.encrypted_content)
+            .where(
+                Message.user_id == user.id,
+                ~exists().where(MessageSearchToken.message_id == Message.id)
+            )
+            .execution_options(yield_per=BACKFILL_CHUNK_SIZE)
+        )
+        async for partition in messages.partitions():
+            await SearchService.index_messages(
+                user.id,
+                user.encryption_key,
+                [
+                    (message_id, MessageEncryption.decrypt(encrypted_content, user.encryption_key))
+                    for message_id, encrypted_content in partition
+                ],
+                db
+            )
+            indexed += len(partition)
+        
+        await db.commit()
+        
+        return indexed
+    
+    @staticmethod
+    async def disable(user, db: AsyncSession):
+        """Opt the user out and drop all their postings"""
+        
+        # Flag first: once it holds the users row, writers that saw the old flag have committed
+        user.search_index_enabled = False
+        await db.flush()
+        await db.execute(
+            delete(MessageSearchToken)
+            .where(MessageSearchToken.user_id == user.id)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+    
+    @staticmethod
+    async def search(user, query: str, db: AsyncSession, limit: int = 20) -> List[Message]:
+        """Find the user's messages containing every word of the query"""
+        
+        tokens = set(SearchService.blind_tokens(query, user.encryption_key))
+        if not tokens:
+            return []
+        
+        # Resolve hits from the index only; nothing is decrypted until we know the matches
+        matching_ids = (
+            select(MessageSearchToken.message_id)
+            .where(
+                MessageSearchToken.user_id == user.id,
+                MessageSearchToken.token.in_(tokens)
+            )
+            .group_by(MessageSearchToken.message_id)
+            .having(func.count(func.distinct(MessageSearchToken.token)) == len(tokens))
+            .order_by(MessageSearchToken.message_id.desc())
+            .limit(limit)
+        )
+        
+        return (await db.scalars(
+            select(Message)
+            .where(Message.id.in_(matching_ids), Message.user_id == user.id)
+            .order_by(Message.id.desc())
+        )).all()
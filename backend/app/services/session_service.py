@@ -0,0 +1,249 @@
+from sqlalchemy import select, update, delete, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import json
+import logging
+import secrets
+from app.core.config import settings
+from app.models import UserSession
+
+logger = logging.getLogger(__name__)
+
+# Dead sessions deleted per cleanup batch
+SESSION_PURGE_BATCH_SIZE = 1000
+
+class SessionService:
+    """Rotating refresh tokens backed by the user_sessions table.
+    
+    Only a SHA-256 of each token is stored. Every refresh consumes the
+    presented token and issues a new one; presenting an already-used token
+    is treated as theft and revokes all of the user's sessions.
+    """
+    
+    _redis = None
+    
+    @staticmethod
+    def hash_token(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+    
+    @staticmethod
+    def _cache_key(token_hash: str) -> str:
+        return f"auth:session:{token_hash}"
+    
+    @classmethod
+    def _redis_client(cls):
+        if cls._redis is None and settings.AUTH_CACHE_REDIS:
+            import redis.asyncio
+            cls._redis = redis.asyncio.from_url(settings.REDIS_URL)
+        return cls._redis
+    
+    @staticmethod
+    async def _cache_get(token_hash: str) -> Optional[Dict]:
+        client = SessionService._redis_client()
+        if client is None:
+            return None
+        try:
+            data = await client.get(SessionService._cache_key(token_hash))
+        except Exception as e:
+            logger.warning(f"Session cache Redis read failed: {str(e)}")
+            return None
+        return json.loads(data) if data else None
+    
+    @staticmethod
+    async def _cache_set(token_hash: str, session: UserSession):
+        client = SessionService._redis_client()
+        if client is None:
+            return
+        ttl = int((session.expires_at - datetime.utcnow()).total_seconds())
+        try:
+            await client.set(
+                SessionService._cache_key(token_hash),
+                json.dumps({
+                    "id": session.id,
+                    "user_id": session.user_id,
+                    "device_info": session.device_info,
+                    "expires_at": session.expires_at.isoformat()
+                }),
+                ex=max(ttl, 1)
+            )
+        except Exception as e:
+            logger.warning(f"Session cache Redis write failed: {str(e)}")
+    
+    @staticmethod
+    async def _cache_delete(*token_hashes: str):
+        client = SessionService._redis_client()
+        if client is None or not token_hashes:
+            return
+        try:
+            await client.delete(*[SessionService._cache_key(token_hash) for token_hash in token_hashes])
+        except Exception as e:
+            logger.warning(f"Session cache Redis delete failed: {str(e)}")
+    
+    @staticmethod
+    async def issue(
+        user_id: int,
+        db: AsyncSession,
+        device_info: Optional[str] = None,
+        ip_address: Optional[str] = None
+    ) -> str:
+        """Create a session and return its refresh token (committed)"""
+        
+        token = secrets.token_urlsafe(32)
+        token_hash = SessionService.hash_token(token)
+        session = UserSession(
+            user_id=user_id,
+            token=token_hash,
+            device_info=device_info,
+            ip_address=ip_address,
+            is_active=True,
+            expires_at=datetime.utcnow() + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
+        )
+        db.add(session)
+        await db.commit()
+        await SessionService._cache_set(token_hash, session)
+        
+        return token
+    
+    @staticmethod
+    async def rotate(
+        token: str,
+        db: AsyncSession,
+        ip_address: Optional[str] = None
+    ) -> Optional[Tuple[int, str]]:
+        """Consume a refresh token; returns (user_id, new refresh token), or None if it isn't valid"""
+        
+        token_hash = SessionService.hash_token(token)
+        
+        cached = await SessionService._cache_get(token_hash)
+        if cached:
+            session_id, user_id = cached["id"], cached["user_id"]
+            expires_at = datetime.fromisoformat(cached["expires_at"])
+            device_info = cached["device_info"]
+        else:
+            # Indexed lookup on user_sessions.token
+            session = (await db.scalars(
+                select(UserSession).where(UserSession.token == token_hash)
+            )).first()
+            if session is None:
+                return None
+            if not session.is_active:
+                await SessionService._handle_reuse(session.user_id, db)
+                return None
+            session_id, user_id, expires_at = session.id, session.user_id, session.expires_at
+            device_info = session.device_info
+        
+        if expires_at <= datetime.utcnow():
+            return None
+        
+        # Conditional update so two concurrent refreshes can't both succeed
+        result = await db.execute(
+            update(UserSession)
+            .where(UserSession.id == session_id, UserSession.is_active == True)
+            .values(is_active=False)
+            .execution_options(synchronize_session=False)
+        )
+        await SessionService._cache_delete(token_hash)
+        if not result.rowcount:
+            await db.rollback()
+            await SessionService._handle_reuse(user_id, db)
+            return None
+        
+        new_token = await SessionService.issue(user_id, db, device_info=device_info, ip_address=ip_address)
+        
+        return user_id, new_token
+    
+    @staticmethod
+    async def _handle_reuse(user_id: int, db: AsyncSession):
+        logger.warning(f"Refresh token reuse detected for user {user_id}; revoking all sessions")
+        await SessionService.revoke_all(user_id, db)
+    
+    @staticmethod
+    async def revoke(token: str, db: AsyncSession, user_id: Optional[int] = None) -> bool:
+        """Revoke the session for a refresh token (optionally only if it belongs to user_id)"""
+        
+        token_hash = SessionService.hash_token(token)
+        statement = update(UserSession).where(UserSession.token == token_hash, UserSession.is_active == True)
+        if user_id is not None:
+            statement = statement.where(UserSession.user_id == user_id)
+        
+        result = await db.execute(statement.values(is_active=False).execution_options(synchronize_session=False))
+        await db.commit()
+        await SessionService._cache_delete(token_hash)
+        
+        return bool(result.rowcount)
+    
+    @staticmethod
+    async def revoke_by_id(session_id: int, user_id: int, db: AsyncSession) -> bool:
+        session = (await db.scalars(select(UserSession).where(
+            UserSession.id == session_id,
+            UserSession.user_id == user_id,
+            UserSession.is_active == True
+        ))).first()
+        if session is None:
+            return False
+        
+        session.is_active = False
+        await db.commit()
+        await SessionService._cache_delete(session.token)
+        
+        return True
+    
+    @staticmethod
+    async def revoke_all(user_id: int, db: AsyncSession) -> int:
+        """Revoke every active session of a user (committed)"""
+        
+        token_hashes = (await db.scalars(select(UserSession.token).where(
+            UserSession.user_id == user_id,
+            UserSession.is_active == True
+        ))).all()
+        
+        await db.execute(
+            update(UserSession)
+            .where(UserSession.user_id == user_id, UserSession.is_active == True)
+            .values(is_active=False)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        await SessionService._cache_delete(*token_hashes)
+        
+        return len(token_hashes)
+    
+    @staticmethod
+    async def list_active(user_id: int, db: AsyncSession) -> List[UserSession]:
+        return (await db.scalars(
+            select(UserSession)
+            .where(
+                UserSession.user_id == user_id,
+                UserSession.is_active == True,
+                UserSession.expires_at > datetime.utcnow()
+            )
+            .order_by(UserSession.created_at.desc())
+        )).all()
+    
+    @staticmethod
+    async def purge_stale(db: AsyncSession, batch_size: int = SESSION_PURGE_BATCH_SIZE) -> int:
+        """Delete one batch of expired sessions and old revoked/rotated ones; returns how many were removed"""
+        
+        now = datetime.utcnow()
+        stale_ids = (await db.scalars(
+            select(UserSession.id)
+            .where(or_(
+                UserSession.expires_at <= now,
+                # Rotated tokens are kept a while so their reuse is still detected
+                (UserSession.is_active == False) & (UserSession.created_at <= now - timedelta(days=1))
+            ))
+            .limit(batch_size)
+        )).all()
+        if not stale_ids:
+            return 0
+        
+        await db.execute(
+            delete(UserSession)
+            .where(UserSession.id.in_(stale_ids))
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        
+        return len(stale_ids)
@@ -0,0 +1,222 @@
+from typing import AsyncIterator, Dict, Optional
+from pathlib import Path
+import asyncio
+import aiofiles
+import aiofiles.os
+from app.core.config import settings
+
+# Read size for streaming downloads
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# S3 rejects multipart parts smaller than this (except the last one)
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+
+class StorageError(Exception):
+    """Raised when a chunk or object request can't be satisfied"""
+
+class StorageBackend:
+    """Object storage for attachments, with chunked uploads and ranged reads"""
+    
+    async def start_upload(self, key: str, content_type: str) -> Dict:
+        """Prepare a chunked upload and return backend state to persist with it"""
+        raise NotImplementedError
+    
+    async def write_chunk(
+        self,
+        key: str,
+        state: Dict,
+        offset: int,
+        chunks: AsyncIterator[bytes],
+        total_size: int
+    ) -> int:
+        """Write the chunk starting at offset, updating state in place; returns bytes written"""
+        raise NotImplementedError
+    
+    async def complete_upload(self, key: str, state: Dict):
+        raise NotImplementedError
+    
+    async def abort_upload(self, key: str, state: Dict):
+        raise NotImplementedError
+    
+    async def put(self, key: str, data: bytes, content_type: str):
+        """Store a small object in one request"""
+        raise NotImplementedError
+    
+    async def read_range(self, key: str, start: int, end: int) -> AsyncIterator[bytes]:
+        """Stream bytes start..end (inclusive)"""
+        raise NotImplementedError
+    
+    async def presigned_url(self, key: str, expires_in: int, filename: Optional[str] = None) -> Optional[str]:
+        """Direct download URL, or None if downloads must go through the API"""
+        return None
+    
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+class LocalStorageBackend(StorageBackend):
+    """Stores objects as files under LOCAL_STORAGE_PATH"""
+    
+    def __init__(self, root: str):
+        self.root = Path(root).resolve()
+    
+    def _path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if self.root not in path.parents:
+            raise StorageError("Invalid storage key")
+        return path
+    
+    def _partial_path(self, key: str) -> Path:
+        return self._path(key + ".part")
+    
+    async def start_upload(self, key: str, content_type: str) -> Dict:
+        path = self._partial_path(key)
+        await aiofiles.os.makedirs(path.parent, exist_ok=True)
+        async with aiofiles.open(path, "wb"):
+            pass
+        return {}
+    
+    async def write_chunk(self, key, state, offset, chunks, total_size) -> int:
+        written = 0
+        async with aiofiles.open(self._partial_path(key), "r+b") as f:
+            # Drop bytes from an earlier attempt that failed before being acknowledged
+            await f.seek(offset)
+            await f.truncate()
+            async for data in chunks:
+                await f.write(data)
+                written += len(data)
+        return written
+    
+    async def complete_upload(self, key, state):
+        await aiofiles.os.replace(self._partial_path(key), self._path(key))
+    
+    async def abort_upload(self, key, state):
+        path = self._partial_path(key)
+        if await aiofiles.os.path.exists(path):
+            await aiofiles.os.remove(path)
+    
+    async def put(self, key, data, content_type):
+        path = self._path(key)
+        await aiofiles.os.makedirs(path.parent, exist_ok=True)
+        async with aiofiles.open(path, "wb") as f:
+            await f.write(data)
+    
+    async def read_range(self, key, start, end) -> AsyncIterator[bytes]:
+        remaining = end - start + 1
+        async with aiofiles.open(self._path(key), "rb") as f:
+            await f.seek(start)
+            while remaining > 0:
+                data = await f.read(min(STREAM_CHUNK_SIZE, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+    
+    async def delete(self, key):
+        path = self._path(key)
+        if await aiofiles.os.path.exists(path):
+            await aiofiles.os.remove(path)
+
+class S3StorageBackend(StorageBackend):
+    """Stores objects in an S3-compatible bucket using multipart uploads"""
+    
+    def __init__(self, bucket: str):
+        import boto3
+        self.bucket = bucket
+        self.client = boto3.client(
+            "s3",
+            region_name=settings.AWS_REGION,
+            endpoint_url=settings.AWS_S3_ENDPOINT_URL or None,
+            aws_access_key_id=settings.AWS_ACCESS_KEY_ID or None,
+            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY or None
+        )
+    
+    async def start_upload(self, key, content_type) -> Dict:
+        response = await asyncio.to_thread(
+            self.client.create_multipart_upload,
+            Bucket=self.bucket, Key=key, ContentType=content_type
+        )
+        return {"upload_id": response["UploadId"], "parts": []}
+    
+    async def write_chunk(self, key, state, offset, chunks, total_size) -> int:
+        # A chunk becomes one part; its size is capped by MAX_UPLOAD_CHUNK_BYTES
+        buffer = bytearray()
+        async for data in chunks:
+            buffer.extend(data)
+            if len(buffer) > settings.MAX_UPLOAD_CHUNK_BYTES:
+                raise StorageError("Chunk too large")
+        
+        is_final = offset + len(buffer) == total_size
+        if not is_final and len(buffer) < S3_MIN_PART_SIZE:
+            raise StorageError(f"Chunks other than the last must be at least {S3_MIN_PART_SIZE} bytes")
+        
+        # Parts are only ever appended, so a retried offset maps back to the same part number
+        parts = [part for part in state["parts"] if part["Offset"] < offset]
+        part_number = len(parts) + 1
+        response = await asyncio.to_thread(
+            self.client.upload_part,
+            Bucket=self.bucket, Key=key, UploadId=state["upload_id"],
+            PartNumber=part_number, Body=bytes(buffer)
+        )
+        parts.append({"PartNumber": part_number, "ETag": response["ETag"], "Offset": offset})
+        state["parts"] = parts
+        return len(buffer)
+    
+    async def complete_upload(self, key, state):
+        await asyncio.to_thread(
+            self.client.complete_multipart_upload,
+            Bucket=self.bucket, Key=key, UploadId=state["upload_id"],
+            MultipartUpload={"Parts": [
+                {"PartNumber": part["PartNumber"], "ETag": part["ETag"]} for part in state["parts"]
+            ]}
+        )
+    
+    async def abort_upload(self, key, state):
+        await asyncio.to_thread(
+            self.client.abort_multipart_upload,
+            Bucket=self.bucket, Key=key, UploadId=state["upload_id"]
+        )
+    
+    async def put(self, key, data, content_type):
+        await asyncio.to_thread(
+            self.client.put_object,
+            Bucket=self.bucket, Key=key, Body=data, ContentType=content_type
+        )
+    
+    async def read_range(self, key, start, end) -> AsyncIterator[bytes]:
+        response = await asyncio.to_thread(
+            self.client.get_object,
+            Bucket=self.bucket, Key=key, Range=f"bytes={start}-{end}"
+        )
+        body = response["Body"]
+        try:
+            while True:
+                data = await asyncio.to_thread(body.read, STREAM_CHUNK_SIZE)
+                if not data:
+                    break
+                yield data
+        finally:
+            body.close()
+    
+    async def presigned_url(self, key, expires_in, filename=None) -> Optional[str]:
+        params = {"Bucket": self.bucket, "Key": key}
+        if filename:
+            params["ResponseContentDisposition"] = f'attachment; filename="{filename}"'
+        return await asyncio.to_thread(
+            self.client.generate_presigned_url,
+            "get_object", Params=params, ExpiresIn=expires_in
+        )
+    
+    async def delete(self, key):
+        await asyncio.to_thread(self.client.delete_object, Bucket=self.bucket, Key=key)
+
+_storage: Optional[StorageBackend] = None
+
+def get_storage() -> StorageBackend:
+    """Get the configured storage backend (created on first use)"""
+    global _storage
+    if _storage is None:
+        if settings.STORAGE_BACKEND == "s3" and settings.AWS_S3_BUCKET:
+            _storage = S3StorageBackend(settings.AWS_S3_BUCKET)
+        else:
+            _storage = LocalStorageBackend(settings.LOCAL_STORAGE_PATH)
+    return _storage
@@ -0,0 +1,111 @@
+from sqlalchemy import select, update, func
+from typing import List
+import logging
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models.companion import AICompanion, CompanionConversation
+from app.services.llm_client import llm_client, LLMUnavailable
+from app.services.llm_scheduler import llm_caller
+from app.services.llm_usage import usage_user
+from app.services.prompt_builder import count_tokens, truncate_to_tokens
+
+logger = logging.getLogger(__name__)
+
+# Most turns folded into the summary by one pass
+SUMMARY_MAX_FOLD_TURNS = 50
+
+class ConversationSummaryService:
+    """Keeps AICompanion.conversation_summary rolling forward.
+    
+    Turns newer than summarized_through_id are sent to the model verbatim; once
+    enough of them have fallen out of the recent window, the older ones are
+    merged into the summary in the background and the watermark moves on.
+    """
+    
+    @staticmethod
+    def needs_summary(unsummarized_turns: int) -> bool:
+        return unsummarized_turns >= settings.COMPANION_RECENT_TURNS + settings.COMPANION_SUMMARY_BATCH_TURNS
+    
+    @staticmethod
+    def _format_turns(turns: List[CompanionConversation]) -> str:
+        return "\n".join(
+            f"User: {turn.user_message}\nCompanion: {turn.companion_response}"
+            for turn in turns
+        )
+    
+    @staticmethod
+    async def _merge(summary: str, turns: List[CompanionConversation]) -> str:
+        max_tokens = settings.COMPANION_SUMMARY_MAX_TOKENS
+        try:
+            merged = await llm_client.chat(
+                [{
+                    "role": "system",
+                    "content": f"""You maintain a running summary of a user's conversations with their AI companion.
+Merge the new exchanges into the existing summary. Keep facts about the user, their goals, feelings,
+important events and anything they asked to be remembered; drop small talk.
+Write in the third person, under {max_tokens * 3 // 4} words."""
+                }, {
+                    "role": "user",
+                    "content": f"Existing summary:\n{summary or '(none)'}\n\nNew exchanges:\n{ConversationSummaryService._format_turns(turns)}"
+                }],
+                model="gpt-3.5-turbo",
+                site="summary",
+                temperature=0.3,
+                max_tokens=max_tokens
+            )
+        except LLMUnavailable:
+            # Extractive fallback: what the user said, newest kept when it overflows
+            notes = "\n".join(f"- {truncate_to_tokens(turn.user_message, 40)}" for turn in turns)
+            merged = f"{summary}\n{notes}" if summary else notes
+        
+        return truncate_to_tokens(merged.strip(), max_tokens, keep_end=True)
+    
+    @staticmethod
+    async def summarize(companion_id: int) -> bool:
+        """Fold turns older than the recent window into the summary; returns whether it advanced.
+        
+        Runs after the response in its own session. The watermark is updated
+        conditionally, so overlapping runs for one companion can't fold a turn twice.
+        """
+        
+        # BackgroundTasks inherit the request's context; this is background work,
+        # not the user's foreground traffic, so it mustn't take their scheduler slots
+        llm_caller.set(None)
+        
+        async with AsyncSessionLocal() as db:
+            companion = await db.get(AICompanion, companion_id)
+            if companion is None:
+                return False
+            usage_user.set(companion.user_id)
+            watermark = companion.summarized_through_id or 0
+            
+            turns = (await db.scalars(
+                select(CompanionConversation)
+                .where(
+                    CompanionConversation.companion_id == companion_id,
+                    CompanionConversation.id > watermark
+                )
+                .order_by(CompanionConversation.id)
+                .limit(SUMMARY_MAX_FOLD_TURNS + settings.COMPANION_RECENT_TURNS)
+            )).all()
+            
+            fold = turns[:-settings.COMPANION_RECENT_TURNS] if settings.COMPANION_RECENT_TURNS else turns
+            if len(fold) < settings.COMPANION_SUMMARY_BATCH_TURNS:
+                return False
+            
+            summary = await ConversationSummaryService._merge(companion.conversation_summary, fold)
+            
+            result = await db.execute(
+                update(AICompanion)
+                .where(
+                    AICompanion.id == companion_id,
+                    func.coalesce(AICompanion.summarized_through_id, 0) == watermark
+                )
+                .values(conversation_summary=summary, summarized_through_id=fold[-1].id)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+        
+        if result.rowcount:
+            logger.info(f"Folded {len(fold)} turns into companion {companion_id} summary ({count_tokens(summary)} tokens)")
+        return bool(result.rowcount)
@@ -1,6 +1,7 @@
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.message import Message, DeliveryTiming
 from app.models.companion import CompanionConversation
 import random
@@ -9,11 +10,11 @@ class AITimingService:
     """Determines optimal message delivery timing based on user patterns and context"""
     
     @staticmethod
-    def calculate_optimal_delivery(
+    async def calculate_optimal_delivery(
         message_content: str,
         user_id: int,
         delivery_timing: DeliveryTiming,
-        db: Session,
+        db: AsyncSession,
         scheduled_for: Optional[datetime] = None
     ) -> datetime:
         """Calculate when to deliver a message based on AI analysis"""
@@ -22,9 +23,25 @@ class AITimingService:
             return scheduled_for
         
         # AI-based timing
-        user_patterns = AITimingService._analyze_user_patterns(user_id, db)
+        user_patterns = await AITimingService._analyze_user_patterns(user_id, db)
         message_context = AITimingService._analyze_message_context(message_content)
         
+        return AITimingService.calculate_delivery_from_analysis(
+            delivery_timing, user_patterns, message_context, scheduled_for
+        )
+    
+    @staticmethod
+    def calculate_delivery_from_analysis(
+        delivery_timing: DeliveryTiming,
+        user_patterns: Dict,
+        message_context: Dict,
+        scheduled_for: Optional[datetime] = None
+    ) -> datetime:
+        """Calculate delivery time from already analyzed user patterns and message context"""
+        
+        if delivery_timing == DeliveryTiming.SPECIFIC_DATE and scheduled_for:
+            return scheduled_for
+        
         if delivery_timing == DeliveryTiming.AI_OPTIMAL:
             return AITimingService._calculate_ai_optimal(user_patterns, message_context)
         
@@ -43,18 +60,18 @@ class AITimingService:
         return datetime.utcnow() + timedelta(days=30)
     
     @staticmethod
-    def _analyze_user_patterns(user_id: int, db: Session) -> Dict:
+    async def _analyze_user_patterns(user_id: int, db: AsyncSession) -> Dict:
         """Analyze user's historical patterns"""
         
         # Get user's message history
-        messages = db.query(Message).filter(Message.user_id == user_id).all()
+        messages = (await db.scalars(select(Message).where(Message.user_id == user_id))).all()
         
         # Get companion conversations for emotional patterns
-        conversations = db.query(CompanionConversation).join(
+        conversations = (await db.scalars(select(CompanionConversation).join(
             CompanionConversation.companion
-        ).filter(
+        ).where(
             CompanionConversation.companion.has(user_id=user_id)
-        ).order_by(CompanionConversation.created_at.desc()).limit(50).all()
+        ).order_by(CompanionConversation.created_at.desc()).limit(50))).all()
         
         patterns = {
             "total_messages": len(messages),
@@ -191,7 +208,7 @@ class AITimingService:
         return datetime.utcnow() + timedelta(days=base_delay)
     
     @staticmethod
-    def should_deliver_now(message: Message, db: Session) -> bool:
+    def should_deliver_now(message: Message, db: AsyncSession) -> bool:
         """Check if a scheduled message should be delivered now"""
         
         if not message.scheduled_for:
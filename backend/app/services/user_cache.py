@@ -0,0 +1,247 @@
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import DateTime, Enum, event
+from sqlalchemy.orm import Session, make_transient_to_detached
+from typing import Dict, Optional, Set, Tuple
+import asyncio
+import json
+import logging
+import threading
+import time
+from app.core.config import settings
+from app.models.user import User
+
+logger = logging.getLogger(__name__)
+
+# Session.info key collecting user IDs to evict once the transaction commits
+PENDING_INVALIDATIONS = "user_cache_invalidations"
+
+# Pub/sub channel telling every worker which users to evict from its own tier
+INVALIDATION_CHANNEL = "auth:user:invalidations"
+
+# Redis keys are deleted again after this long, in case a reader that loaded
+# the row before the commit wrote it back in between
+REDELETE_AFTER_SECONDS = 1.0
+
+class UserCache:
+    """Bounded TTL cache of authenticated user rows, keyed by user ID.
+    
+    The in-process tier always runs; the Redis tier is shared between workers
+    and only used when AUTH_CACHE_REDIS is set. Entries hold the users row
+    (including the encryption key), so the Redis instance must be private.
+    
+    Invalidations evict the committing worker's tier at once. With Redis they
+    are also published on INVALIDATION_CHANNEL, and every worker's listener
+    (started with start()) evicts its own copy; without Redis, other workers
+    may serve a row for up to ttl_seconds after it changed.
+    """
+    
+    def __init__(self, ttl_seconds: int, max_entries: int, redis_ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.redis_ttl_seconds = redis_ttl_seconds
+        self.entries: "OrderedDict[int, Tuple[float, Dict]]" = OrderedDict()
+        self.generations: Dict[int, int] = {}  # Bumped per invalidation so a stale read can't be cached after it
+        self.lock = threading.Lock()  # Invalidations also arrive from scheduler threads
+        self._redis = None
+        self._redis_sync = None
+        self._pending_deletes: Set[asyncio.Task] = set()
+        self._listener: Optional[asyncio.Task] = None
+    
+    @staticmethod
+    def _key(user_id: int) -> str:
+        return f"auth:user:{user_id}"
+    
+    def _redis_client(self):
+        if self._redis is None and settings.AUTH_CACHE_REDIS:
+            import redis.asyncio
+            self._redis = redis.asyncio.from_url(settings.REDIS_URL)
+        return self._redis
+    
+    def _redis_sync_client(self):
+        if self._redis_sync is None and settings.AUTH_CACHE_REDIS:
+            import redis
+            self._redis_sync = redis.from_url(settings.REDIS_URL)
+        return self._redis_sync
+    
+    @staticmethod
+    def _dumps(snapshot: Dict) -> str:
+        return json.dumps({
+            key: value.isoformat() if isinstance(value, datetime) else value
+            for key, value in snapshot.items()
+        })
+    
+    @staticmethod
+    def _loads(data) -> Dict:
+        snapshot = json.loads(data)
+        for column in User.__table__.columns:
+            value = snapshot.get(column.key)
+            if value is None:
+                continue
+            if isinstance(column.type, DateTime):
+                snapshot[column.key] = datetime.fromisoformat(value)
+            elif isinstance(column.type, Enum) and column.type.enum_class:
+                snapshot[column.key] = column.type.enum_class(value)
+        return snapshot
+    
+    @staticmethod
+    def to_user(snapshot: Dict) -> User:
+        """Build a detached, clean User from a snapshot; add it to a session to use it like a loaded row"""
+        user = User(**snapshot)
+        make_transient_to_detached(user)
+        return user
+    
+    async def get(self, user_id: int) -> Optional[Dict]:
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry and entry[0] > now:
+                self.entries.move_to_end(user_id)
+                return entry[1]
+        
+        client = self._redis_client()
+        if client is None:
+            return None
+        
+        try:
+            data = await client.get(self._key(user_id))
+        except Exception as e:
+            logger.warning(f"Auth cache Redis read failed: {str(e)}")
+            return None
+        
+        if data is None:
+            return None
+        
+        snapshot = self._loads(data)
+        self._store_local(user_id, snapshot)
+        return snapshot
+    
+    def generation(self, user_id: int) -> int:
+        """Read before loading a user from the database, then pass to set()"""
+        with self.lock:
+            return self.generations.get(user_id, 0)
+    
+    async def set(self, user_id: int, snapshot: Dict, generation: int):
+        """Cache a freshly loaded users row, unless it was invalidated while being loaded"""
+        with self.lock:
+            if self.generations.get(user_id, 0) != generation:
+                return
+        self._store_local(user_id, snapshot)
+        
+        client = self._redis_client()
+        if client is not None:
+            try:
+                await client.set(self._key(user_id), self._dumps(snapshot), ex=self.redis_ttl_seconds)
+            except Exception as e:
+                logger.warning(f"Auth cache Redis write failed: {str(e)}")
+    
+    def _store_local(self, user_id: int, snapshot: Dict):
+        with self.lock:
+            self.entries[user_id] = (time.monotonic() + self.ttl_seconds, snapshot)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def _evict_local(self, user_ids):
+        with self.lock:
+            for user_id in user_ids:
+                self.entries.pop(user_id, None)
+                self.generations[user_id] = self.generations.get(user_id, 0) + 1
+    
+    def invalidate(self, *user_ids: int):
+        self._evict_local(user_ids)
+        
+        if not user_ids or not settings.AUTH_CACHE_REDIS:
+            return
+        keys = [self._key(user_id) for user_id in user_ids]
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Scheduler worker thread: blocking here doesn't stall the event loop
+            self._delete_sync(keys)
+            return
+        task = loop.create_task(self._delete(keys))
+        self._pending_deletes.add(task)
+        task.add_done_callback(self._pending_deletes.discard)
+    
+    @staticmethod
+    def _message(keys) -> str:
+        return json.dumps([int(key.rsplit(":", 1)[1]) for key in keys])
+    
+    async def _delete(self, keys):
+        try:
+            client = self._redis_client()
+            await client.delete(*keys)
+            await client.publish(INVALIDATION_CHANNEL, self._message(keys))
+            await asyncio.sleep(REDELETE_AFTER_SECONDS)
+            await client.delete(*keys)
+        except Exception as e:
+            logger.warning(f"Auth cache Redis invalidation failed: {str(e)}")
+    
+    def _delete_sync(self, keys):
+        try:
+            client = self._redis_sync_client()
+            client.delete(*keys)
+            client.publish(INVALIDATION_CHANNEL, self._message(keys))
+        except Exception as e:
+            logger.warning(f"Auth cache Redis invalidation failed: {str(e)}")
+    
+    async def _listen(self):
+        """Evict users other workers invalidated, for as long as the app runs"""
+        while True:
+            try:
+                pubsub = self._redis_client().pubsub()
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self._evict_local(json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Auth cache invalidation listener failed, retrying: {str(e)}")
+            # Invalidations may have been missed while unsubscribed
+            with self.lock:
+                self.entries.clear()
+            await asyncio.sleep(1)
+    
+    def start(self):
+        if self._listener is None and self._redis_client() is not None:
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+    
+    async def shutdown(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+    
+    @staticmethod
+    def invalidate_on_commit(db, *user_ids: int):
+        """Evict users once the session's transaction commits (works for sync and async sessions)"""
+        db.info.setdefault(PENDING_INVALIDATIONS, set()).update(user_ids)
+
+# Global cache instance
+user_cache = UserCache(
+    settings.AUTH_CACHE_TTL_SECONDS,
+    settings.AUTH_CACHE_MAX_ENTRIES,
+    settings.AUTH_CACHE_REDIS_TTL_SECONDS
+)
+
+@event.listens_for(Session, "after_flush")
+def _collect_user_changes(session, flush_context):
+    """Any flushed change to a users row (profile, tier, admin, deactivation) evicts it"""
+    changed = [
+        obj.id for obj in list(session.dirty) + list(session.deleted)
+        if isinstance(obj, User) and obj.id is not None
+    ]
+    if changed:
+        UserCache.invalidate_on_commit(session, *changed)
+
+@event.listens_for(Session, "after_commit")
+def _apply_invalidations(session):
+    user_ids = session.info.pop(PENDING_INVALIDATIONS, None)
+    if user_ids:
+        user_cache.invalidate(*user_ids)
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_invalidations(session, previous_transaction):
+    session.info.pop(PENDING_INVALIDATIONS, None)
@@ -0,0 +1,57 @@
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import List
+from app.models.user import User
+from app.models.companion import CompanionConversation
+from app.services.user_cache import UserCache
+
+class VersionService:
+    """Cheap change counters used as version stamps for conditional GETs.
+    
+    Only per-user counters are bumped on writes, along with the user's
+    data_changed_at. Platform-wide views derive their stamp from indexed
+    maxima (newest user, latest bump, newest conversation) instead of a shared
+    counter row, which every write transaction would otherwise have to lock.
+    """
+    
+    @staticmethod
+    def _bump_statement(user_ids: List[int]):
+        # Keep updated_at untouched - this is bookkeeping, not a profile change
+        return (
+            update(User)
+            .where(User.id.in_(user_ids))
+            .values(data_version=User.data_version + 1, data_changed_at=datetime.utcnow(), updated_at=User.updated_at)
+        )
+    
+    @staticmethod
+    async def bump(db: AsyncSession, *user_ids: int):
+        """Bump the given users' counters in the caller's transaction"""
+        if not user_ids:
+            return
+        await db.execute(VersionService._bump_statement(list(user_ids)))
+        # Cached user rows carry data_version, which feeds ETags
+        UserCache.invalidate_on_commit(db, *user_ids)
+    
+    @staticmethod
+    def bump_sync(db: Session, *user_ids: int):
+        """Same as bump, for the sync session used by the background scheduler"""
+        if not user_ids:
+            return
+        db.execute(VersionService._bump_statement(list(user_ids)))
+        UserCache.invalidate_on_commit(db, *user_ids)
+    
+    @staticmethod
+    def global_stamp_statement():
+        aggregates = [
+            func.max(User.id), func.max(User.data_changed_at), func.max(CompanionConversation.id)
+        ]
+        # One round trip; each max() is answered from the end of an index, never a scan
+        return select(*[select(aggregate).scalar_subquery() for aggregate in aggregates])
+    
+    @staticmethod
+    async def get_global_stamp(db: AsyncSession) -> str:
+        """Stamp that changes when a user signs up or any user's data is bumped"""
+        row = (await db.execute(VersionService.global_stamp_statement())).one()
+        return "/".join(str(value) for value in row)
@@ -0,0 +1,37 @@
+"""
+Label companion conversations with the local emotion classifier
+Usage: python backfill_emotions.py [--relabel] [--batch-size 500]
+
+By default only rows with a missing or non-standard detected_emotion are updated;
+--relabel reclassifies every conversation.
+"""
+
+import argparse
+import asyncio
+from app.core.database import AsyncSessionLocal, async_engine
+from app.models.user import User
+from app.models.message import Message
+from app.models.companion import AICompanion
+from app.models import MessageReaction, UserSession, AuditLog
+from app.services.emotion_service import EmotionService
+
+async def backfill(relabel: bool, batch_size: int):
+    total = 0
+    after_id = 0
+    async with AsyncSessionLocal() as db:
+        while True:
+            updated, after_id = await EmotionService.backfill(db, batch_size=batch_size, after_id=after_id, relabel=relabel)
+            if not updated:
+                break
+            total += updated
+            print(f"  ... {total} conversations labelled")
+    
+    print(f"✅ Labelled {total} conversations")
+    await async_engine.dispose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--relabel", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(backfill(args.relabel, args.batch_size))
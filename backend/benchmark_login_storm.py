@@ -0,0 +1,106 @@
+"""
+Benchmark: latency of an unrelated endpoint while a burst of logins is hashing passwords
+Usage: python benchmark_login_storm.py [--logins 200] [--concurrency 50] [--inline]
+
+--inline hashes on the event loop (the old behaviour) for comparison.
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+# Use a throwaway database; must be set before the app is imported
+DB_DIR = tempfile.mkdtemp(prefix="futureyou-bench-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(DB_DIR, 'bench.db')}"
+os.environ["RATE_LIMIT_ENABLED"] = "false"  # The storm would otherwise trip the login limit
+
+import httpx
+from app.main import app
+from app.core.database import async_engine, Base
+from app.services.password_service import password_hasher
+
+EMAIL = "bench@example.com"
+PASSWORD = "benchmark-password"
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def report(label, samples):
+    print(
+        f"{label:<24} n={len(samples):<5} "
+        f"p50={percentile(samples, 50):7.1f}ms  "
+        f"p99={percentile(samples, 99):7.1f}ms  "
+        f"max={max(samples):7.1f}ms"
+    )
+
+async def probe(client, headers, stop: asyncio.Event, samples, min_samples=0):
+    """Hit an endpoint that never touches passwords, recording latency"""
+    while not stop.is_set() or len(samples) < min_samples:
+        started = time.perf_counter()
+        response = await client.get("/api/messages/", headers=headers)
+        response.raise_for_status()
+        samples.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(0.01)
+
+async def login_storm(client, logins, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    statuses = {}
+    
+    async def login():
+        async with semaphore:
+            response = await client.post("/api/auth/login", json={"email": EMAIL, "password": PASSWORD})
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    
+    started = time.perf_counter()
+    await asyncio.gather(*[login() for _ in range(logins)])
+    return time.perf_counter() - started, statuses
+
+async def main(args):
+    if args.inline:
+        async def run_inline(func, *func_args):
+            return func(*func_args)
+        password_hasher._run = run_inline
+    
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        response = await client.post("/api/auth/signup", json={"email": EMAIL, "password": PASSWORD})
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        
+        # Baseline with no logins in flight
+        baseline = []
+        stop = asyncio.Event()
+        stop.set()
+        await probe(client, headers, stop, baseline, min_samples=args.baseline_samples)
+        
+        # Same probe while the storm runs
+        during = []
+        stop = asyncio.Event()
+        probe_task = asyncio.create_task(probe(client, headers, stop, during))
+        elapsed, statuses = await login_storm(client, args.logins, args.concurrency)
+        stop.set()
+        await probe_task
+    
+    print(f"Hashing: {'inline on the event loop' if args.inline else f'{password_hasher.workers} worker threads'}")
+    print(f"Logins: {args.logins} at concurrency {args.concurrency} in {elapsed:.2f}s, statuses {statuses}")
+    report("GET /api/messages idle", baseline)
+    report("GET /api/messages storm", during)
+    if not args.inline:
+        print(f"Hasher stats: {password_hasher.stats()}")
+    
+    await async_engine.dispose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--baseline-samples", type=int, default=100)
+    parser.add_argument("--inline", action="store_true")
+    asyncio.run(main(parser.parse_args()))
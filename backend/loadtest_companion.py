@@ -0,0 +1,145 @@
+"""
+Load test: /api/companion/* against the fake LLM backend, no provider calls or spend
+Usage: python loadtest_companion.py [--users 20] [--requests 200] [--concurrency 50]
+                                    [--p50-ms 600] [--p99-ms 3000] [--error-rate 0.0]
+
+Every request is a random pick of chat, chat/stream, daily-checkin and
+help-craft-message from a random user; the fake backend is seeded, so runs
+with the same arguments issue the same prompts and see the same latencies.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+# Throwaway database and the fake LLM; must be set before the app is imported
+DB_DIR = tempfile.mkdtemp(prefix="futureyou-loadtest-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(DB_DIR, 'loadtest.db')}"
+os.environ["RATE_LIMIT_ENABLED"] = "false"  # Every user would hit the per-minute companion limits
+os.environ["LLM_BACKEND"] = "fake"
+
+PROMPTS = [
+    "I finally finished the marathon training plan today",
+    "Work has been stressful and I can't sleep",
+    "I want to remember how happy I felt at my sister's wedding",
+    "Should I take the new job offer in Berlin?",
+    "I'm worried about my exams next month",
+    "Today was quiet, just reading and walking the dog"
+]
+
+INTENTS = [
+    "remind myself why I started learning piano",
+    "congratulate future me on paying off the loan",
+    "tell myself to call grandma more often"
+]
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def report(label, samples):
+    if not samples:
+        print(f"{label:<28} n=0")
+        return
+    print(
+        f"{label:<28} n={len(samples):<5} "
+        f"p50={percentile(samples, 50):7.1f}ms  "
+        f"p99={percentile(samples, 99):7.1f}ms  "
+        f"max={max(samples):7.1f}ms"
+    )
+
+async def chat(client, headers, rng):
+    response = await client.post("/api/companion/chat", json={"message": rng.choice(PROMPTS)}, headers=headers)
+    return response.status_code
+
+async def chat_stream(client, headers, rng):
+    # ASGITransport buffers the body, so this times the whole stream; time to
+    # first token is measured server-side (avg_ttft_ms in the LLM client stats)
+    response = await client.post("/api/companion/chat/stream", json={"message": rng.choice(PROMPTS)}, headers=headers)
+    return response.status_code
+
+async def daily_checkin(client, headers, rng):
+    response = await client.get("/api/companion/daily-checkin", headers=headers)
+    return response.status_code
+
+async def help_craft(client, headers, rng):
+    response = await client.post("/api/companion/help-craft-message", json={"intent": rng.choice(INTENTS)}, headers=headers)
+    return response.status_code
+
+ENDPOINTS = {
+    "POST /chat": chat,
+    "POST /chat/stream": chat_stream,
+    "GET /daily-checkin": daily_checkin,
+    "POST /help-craft-message": help_craft
+}
+
+async def main(args):
+    from app.core.config import settings
+    settings.FAKE_LLM_LATENCY_P50_MS = args.p50_ms
+    settings.FAKE_LLM_LATENCY_P99_MS = args.p99_ms
+    settings.FAKE_LLM_ERROR_RATE = args.error_rate
+    
+    import httpx
+    from app.main import app
+    from app.core.database import async_engine, Base
+    from app.services.llm_client import llm_client
+    
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    
+    rng = random.Random(args.seed)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=None) as client:
+        users = []
+        for i in range(args.users):
+            response = await client.post(
+                "/api/auth/signup",
+                json={"email": f"loadtest{i}@example.com", "password": "loadtest-password"}
+            )
+            response.raise_for_status()
+            users.append({"Authorization": f"Bearer {response.json()['access_token']}"})
+        
+        latencies = {label: [] for label in ENDPOINTS}
+        statuses = {}
+        semaphore = asyncio.Semaphore(args.concurrency)
+        plan = [(rng.choice(list(ENDPOINTS)), rng.choice(users)) for _ in range(args.requests)]
+        
+        async def run(label, headers):
+            async with semaphore:
+                started = time.perf_counter()
+                status = await ENDPOINTS[label](client, headers, rng)
+                latencies[label].append((time.perf_counter() - started) * 1000)
+                statuses[status] = statuses.get(status, 0) + 1
+        
+        started = time.perf_counter()
+        await asyncio.gather(*[run(label, headers) for label, headers in plan])
+        elapsed = time.perf_counter() - started
+    
+    print(
+        f"Fake LLM: {settings.FAKE_LLM_LATENCY_DISTRIBUTION} p50={args.p50_ms}ms p99={args.p99_ms}ms, "
+        f"error rate {args.error_rate}"
+    )
+    print(f"Requests: {args.requests} from {args.users} users at concurrency {args.concurrency} in {elapsed:.2f}s "
+          f"({args.requests / elapsed:.1f} req/s), statuses {statuses}")
+    for label, samples in latencies.items():
+        report(label, samples)
+    print(f"LLM client stats: {json.dumps(llm_client.stats())}")
+    
+    await llm_client.close()
+    await async_engine.dispose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--p50-ms", type=float, default=600.0)
+    parser.add_argument("--p99-ms", type=float, default=3000.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
@@ -8,6 +8,7 @@ from app.models.user import User
 from app.models.message import Message
 from app.models.companion import AICompanion
 from app.models import MessageReaction, UserSession, AuditLog
+from app.services import user_cache  # Evicts the cached auth row when the change commits
 
 def make_admin():
     email = input("Enter email address to make admin: ").strip()
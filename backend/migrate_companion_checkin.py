@@ -0,0 +1,40 @@
+"""
+Add checkin_message and checkin_for columns to ai_companions table (pre-generated daily check-ins)
+"""
+
+import sqlite3
+
+def migrate():
+    conn = sqlite3.connect('futureyou.db')
+    cursor = conn.cursor()
+    
+    try:
+        # Check which columns exist
+        cursor.execute("PRAGMA table_info(ai_companions)")
+        columns = [col[1] for col in cursor.fetchall()]
+        
+        if 'checkin_message' in columns and 'checkin_for' in columns:
+            print("✅ Columns 'checkin_message' and 'checkin_for' already exist")
+            return
+        
+        if 'checkin_message' not in columns:
+            cursor.execute("ALTER TABLE ai_companions ADD COLUMN checkin_message TEXT")
+        if 'checkin_for' not in columns:
+            cursor.execute("ALTER TABLE ai_companions ADD COLUMN checkin_for DATE")
+        
+        # Index for the precompute job's scan
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS ix_ai_companions_checkin ON ai_companions (daily_checkin_enabled, checkin_time)"
+        )
+        conn.commit()
+        
+        print("✅ Successfully added check-in columns to ai_companions table")
+    
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
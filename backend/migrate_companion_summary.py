@@ -0,0 +1,33 @@
+"""
+Add summarized_through_id column to ai_companions table (rolling conversation summary)
+"""
+
+import sqlite3
+
+def migrate():
+    conn = sqlite3.connect('futureyou.db')
+    cursor = conn.cursor()
+    
+    try:
+        # Check if column exists
+        cursor.execute("PRAGMA table_info(ai_companions)")
+        columns = [col[1] for col in cursor.fetchall()]
+        
+        if 'summarized_through_id' in columns:
+            print("✅ Column 'summarized_through_id' already exists")
+            return
+        
+        # Add summarized_through_id column
+        cursor.execute("ALTER TABLE ai_companions ADD COLUMN summarized_through_id INTEGER")
+        conn.commit()
+        
+        print("✅ Successfully added 'summarized_through_id' column to ai_companions table")
+    
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
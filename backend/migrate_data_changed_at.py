@@ -0,0 +1,34 @@
+"""
+Add indexed data_changed_at column to users table
+"""
+
+import sqlite3
+
+def migrate():
+    conn = sqlite3.connect('futureyou.db')
+    cursor = conn.cursor()
+    
+    try:
+        # Check if column exists
+        cursor.execute("PRAGMA table_info(users)")
+        columns = [col[1] for col in cursor.fetchall()]
+        
+        if 'data_changed_at' in columns:
+            print("✅ Column 'data_changed_at' already exists")
+            return
+        
+        # Add data_changed_at column; the platform-wide ETag stamp takes its max()
+        cursor.execute("ALTER TABLE users ADD COLUMN data_changed_at DATETIME")
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_users_data_changed_at ON users (data_changed_at)")
+        conn.commit()
+        
+        print("✅ Successfully added 'data_changed_at' column to users table")
+    
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,33 @@
+"""
+Add data_version column to users table
+"""
+
+import sqlite3
+
+def migrate():
+    conn = sqlite3.connect('futureyou.db')
+    cursor = conn.cursor()
+    
+    try:
+        # Check if column exists
+        cursor.execute("PRAGMA table_info(users)")
+        columns = [col[1] for col in cursor.fetchall()]
+        
+        if 'data_version' in columns:
+            print("✅ Column 'data_version' already exists")
+            return
+        
+        # Add data_version column
+        cursor.execute("ALTER TABLE users ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0")
+        conn.commit()
+        
+        print("✅ Successfully added 'data_version' column to users table")
+        
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
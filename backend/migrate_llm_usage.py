@@ -0,0 +1,50 @@
+"""
+Create llm_usage table (per-user daily LLM calls, tokens and estimated cost)
+"""
+
+import sqlite3
+
+def migrate():
+    conn = sqlite3.connect('futureyou.db')
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='llm_usage'")
+        if cursor.fetchone():
+            print("✅ Table 'llm_usage' already exists")
+            return
+        
+        cursor.execute("""
+            CREATE TABLE llm_usage (
+                id INTEGER NOT NULL PRIMARY KEY,
+                user_id INTEGER NOT NULL REFERENCES users (id),
+                day DATE NOT NULL,
+                call_site VARCHAR NOT NULL,
+                model VARCHAR NOT NULL,
+                tier VARCHAR NOT NULL,
+                calls INTEGER NOT NULL DEFAULT 0,
+                errors INTEGER NOT NULL DEFAULT 0,
+                prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                completion_tokens INTEGER NOT NULL DEFAULT 0,
+                cost_usd FLOAT NOT NULL DEFAULT 0,
+                latency_ms FLOAT NOT NULL DEFAULT 0
+            )
+        """)
+        cursor.execute("CREATE INDEX ix_llm_usage_id ON llm_usage (id)")
+        cursor.execute("CREATE INDEX ix_llm_usage_day ON llm_usage (day)")
+        # Flushes upsert on this key
+        cursor.execute(
+            "CREATE UNIQUE INDEX ix_llm_usage_key ON llm_usage (user_id, day, call_site, model, tier)"
+        )
+        conn.commit()
+        
+        print("✅ Successfully created llm_usage table")
+    
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,33 @@
+"""
+Add search_index_enabled column to users table
+"""
+
+import sqlite3
+
+def migrate():
+    conn = sqlite3.connect('futureyou.db')
+    cursor = conn.cursor()
+    
+    try:
+        # Check if column exists
+        cursor.execute("PRAGMA table_info(users)")
+        columns = [col[1] for col in cursor.fetchall()]
+        
+        if 'search_index_enabled' in columns:
+            print("✅ Column 'search_index_enabled' already exists")
+            return
+        
+        # Add search_index_enabled column
+        cursor.execute("ALTER TABLE users ADD COLUMN search_index_enabled BOOLEAN DEFAULT 0")
+        conn.commit()
+        
+        print("✅ Successfully added 'search_index_enabled' column to users table")
+        
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
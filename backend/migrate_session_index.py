@@ -0,0 +1,24 @@
+"""
+Add user_id index to user_sessions table (refresh token sessions)
+"""
+
+import sqlite3
+
+def migrate():
+    conn = sqlite3.connect('futureyou.db')
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_user_sessions_user_id ON user_sessions (user_id)")
+        conn.commit()
+        
+        print("✅ Index 'ix_user_sessions_user_id' is in place")
+        
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,35 @@
+import asyncio
+import os
+import tempfile
+
+# Throwaway database and the fake LLM; must be set before the app is imported
+TEST_DIR = tempfile.mkdtemp(prefix="futureyou-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(TEST_DIR, 'test.db')}"
+os.environ["LOCAL_STORAGE_PATH"] = os.path.join(TEST_DIR, "storage")
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+os.environ["LLM_BACKEND"] = "fake"
+
+import pytest
+from app.core.database import async_engine, Base
+import app.models.user, app.models.message, app.models.companion, app.models.attachment  # noqa: F401 (register tables)
+
+@pytest.fixture
+def run():
+    """Run a coroutine on a fresh event loop against empty tables"""
+    
+    async def reset():
+        async with async_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+    
+    def runner(coro):
+        async def main():
+            try:
+                return await coro
+            finally:
+                # Pooled connections belong to this loop
+                await async_engine.dispose()
+        return asyncio.run(main())
+    
+    runner(reset())
+    return runner
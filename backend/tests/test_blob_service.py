@@ -0,0 +1,74 @@
+from sqlalchemy import delete
+from app.core.database import AsyncSessionLocal
+from app.models.attachment import Blob
+from app.services.blob_service import BlobService
+
+SHA256 = "a" * 64
+
+async def create_blob(ref_count: int):
+    async with AsyncSessionLocal() as db:
+        db.add(Blob(sha256=SHA256, storage_key="attachments/1/original", size=3, ref_count=ref_count))
+        await db.commit()
+
+async def get_blob() -> Blob:
+    async with AsyncSessionLocal() as db:
+        return await db.get(Blob, SHA256)
+
+def fixed_hash(monkeypatch):
+    async def hash_object(storage_key, size):
+        return SHA256
+    
+    monkeypatch.setattr(BlobService, "hash_object", hash_object)
+
+def test_ingest_recreates_a_blob_collected_before_the_reference(run, monkeypatch):
+    fixed_hash(monkeypatch)
+    add_reference = BlobService.add_reference
+    
+    async def collected_first(sha256, db):
+        # Garbage collection removes the unreferenced blob between the lookup and the increment
+        await db.execute(delete(Blob).where(Blob.sha256 == sha256))
+        return await add_reference(sha256, db)
+    
+    monkeypatch.setattr(BlobService, "add_reference", collected_first)
+    
+    async def scenario():
+        await create_blob(ref_count=0)
+        async with AsyncSessionLocal() as db:
+            blob = await BlobService.ingest("attachments/1/upload", 3, db)
+            await db.commit()
+        assert blob.storage_key == "attachments/1/upload"
+        stored = await get_blob()
+        assert (stored.storage_key, stored.ref_count) == ("attachments/1/upload", 1)
+    
+    run(scenario())
+
+def test_ingest_reference_is_committed_by_the_caller(run, monkeypatch):
+    fixed_hash(monkeypatch)
+    
+    async def scenario():
+        await create_blob(ref_count=1)
+        async with AsyncSessionLocal() as db:
+            blob = await BlobService.ingest("attachments/1/upload", 3, db)
+            assert blob.storage_key == "attachments/1/original"
+            # The attachment insert fails, so the reference must not survive
+            await db.rollback()
+        assert (await get_blob()).ref_count == 1
+        
+        async with AsyncSessionLocal() as db:
+            await BlobService.ingest("attachments/1/upload", 3, db)
+            await db.commit()
+        assert (await get_blob()).ref_count == 2
+    
+    run(scenario())
+
+def test_add_reference_reports_a_missing_blob(run):
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            assert not await BlobService.add_reference(SHA256, db)
+        await create_blob(ref_count=0)
+        async with AsyncSessionLocal() as db:
+            assert await BlobService.add_reference(SHA256, db)
+            await db.commit()
+        assert (await get_blob()).ref_count == 1
+    
+    run(scenario())
@@ -0,0 +1,91 @@
+import time
+from app.services.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+def make_breaker() -> CircuitBreaker:
+    return CircuitBreaker(
+        "model",
+        window=4,
+        min_calls=4,
+        error_rate_threshold=0.5,
+        slow_call_seconds=5.0,
+        slow_rate_threshold=0.5,
+        open_seconds=30.0
+    )
+
+def open_breaker(breaker: CircuitBreaker):
+    for failed in (False, True, False, True):
+        assert breaker.allow()
+        breaker.record(failed, 0.1)
+    assert breaker.state == OPEN
+
+def wait_out(breaker: CircuitBreaker):
+    breaker.opened_at = time.monotonic() - breaker.open_seconds
+
+def test_opens_on_error_rate_and_refuses_calls():
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.record(True, 0.1)
+    assert breaker.state == CLOSED  # Fewer than min_calls outcomes
+    
+    breaker.record(False, 0.1)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.rejected == 1
+
+def test_opens_on_slow_rate():
+    breaker = make_breaker()
+    for latency in (6.0, 0.1, 7.0, 0.1):
+        breaker.record(False, latency)
+    assert breaker.state == OPEN
+
+def test_half_open_admits_one_trial_that_closes_the_breaker():
+    breaker = make_breaker()
+    open_breaker(breaker)
+    wait_out(breaker)
+    
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()  # Only one trial at a time
+    
+    breaker.record(False, 0.1, trial=True)
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+def test_failed_or_slow_trial_reopens_the_breaker():
+    for failed, latency in ((True, 0.1), (False, 6.0)):
+        breaker = make_breaker()
+        open_breaker(breaker)
+        wait_out(breaker)
+        assert breaker.allow()
+        
+        breaker.record(failed, latency, trial=True)
+        assert breaker.state == OPEN
+        assert breaker.times_opened == 2
+        assert not breaker.allow()
+
+def test_half_open_ignores_calls_other_than_the_trial():
+    breaker = make_breaker()
+    open_breaker(breaker)
+    wait_out(breaker)
+    assert breaker.allow()
+    
+    # Calls admitted before the breaker opened finish while the trial is running
+    breaker.record(False, 0.1)
+    breaker.record(True, 0.1)
+    breaker.abandon()
+    assert breaker.state == HALF_OPEN
+    assert breaker.trial_in_flight
+    assert not breaker.allow()
+    
+    breaker.record(True, 0.1, trial=True)
+    assert breaker.state == OPEN
+
+def test_abandoned_trial_lets_another_one_through():
+    breaker = make_breaker()
+    open_breaker(breaker)
+    wait_out(breaker)
+    assert breaker.allow()
+    
+    breaker.abandon(trial=True)
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
@@ -0,0 +1,51 @@
+import asyncio
+from typing import Dict, List
+import pytest
+from app.services.llm_backends import Completion, LLMBackend
+from app.services.llm_client import LLMClientManager, LLMOverloaded
+
+class SlowBackend(LLMBackend):
+    """Holds each completion for `seconds` and records the timeout it was given"""
+    
+    name = "slow"
+    
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.timeouts: List[float] = []
+    
+    async def complete(self, messages: List[Dict], model: str, timeout: float, **kwargs) -> Completion:
+        self.timeouts.append(timeout)
+        await asyncio.sleep(self.seconds)
+        return Completion("ok", 1, 1)
+
+def make_client(backend: LLMBackend) -> LLMClientManager:
+    client = LLMClientManager(max_concurrency=1, timeout_seconds=20.0)
+    client._backend = backend
+    return client
+
+def test_time_queued_for_a_slot_counts_against_the_timeout():
+    backend = SlowBackend(0.5)
+    client = make_client(backend)
+    
+    async def scenario():
+        await asyncio.gather(*(client.chat([{"role": "user", "content": "hi"}], "model", timeout=3.0) for _ in range(2)))
+    
+    asyncio.run(scenario())
+    first, second = backend.timeouts
+    assert first > 2.9
+    assert 2.3 < second < 2.6
+
+def test_call_that_cannot_get_a_slot_before_its_deadline_is_shed():
+    backend = SlowBackend(0.5)
+    client = make_client(backend)
+    
+    async def scenario():
+        first = asyncio.create_task(client.chat([{"role": "user", "content": "hi"}], "model"))
+        await asyncio.sleep(0)
+        with pytest.raises(LLMOverloaded):
+            await client.chat([{"role": "user", "content": "hi"}], "model", timeout=0.3)
+        await first
+    
+    asyncio.run(scenario())
+    assert len(backend.timeouts) == 1
+    assert client.scheduler.shed == {"overloaded": 1}
@@ -0,0 +1,106 @@
+import asyncio
+import pytest
+from app.core.config import settings
+from app.models.user import SubscriptionTier
+from app.services.llm_scheduler import FairShareScheduler, LLMShed, bind_caller
+
+async def hold(scheduler: FairShareScheduler, release: asyncio.Event, user_id: int = 1):
+    bind_caller(user_id, SubscriptionTier.FREE)
+    async with scheduler.slot():
+        await release.wait()
+
+async def shed_reason(scheduler: FairShareScheduler, user_id: int = 1) -> str:
+    bind_caller(user_id, SubscriptionTier.FREE)
+    with pytest.raises(LLMShed) as shed:
+        async with scheduler.slot():
+            pass
+    return shed.value.reason
+
+def test_sheds_a_user_with_too_many_calls_queued(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_USER_MAX_QUEUED", 1)
+    scheduler = FairShareScheduler(capacity=1)
+    
+    async def scenario():
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(scheduler, release))
+        queued = asyncio.create_task(hold(scheduler, release))
+        await asyncio.sleep(0)
+        assert scheduler.stats()["waiting"]["free"] == 1
+        
+        assert await shed_reason(scheduler) == "user_queue_full"
+        # Another user still gets in line
+        other = asyncio.create_task(hold(scheduler, release, user_id=2))
+        await asyncio.sleep(0)
+        assert scheduler.stats()["waiting"]["free"] == 2
+        
+        release.set()
+        await asyncio.gather(holder, queued, other)
+    
+    asyncio.run(scenario())
+    assert scheduler.shed == {"user_queue_full": 1}
+    assert scheduler.in_flight == 0
+
+def test_sheds_up_front_when_the_expected_wait_is_too_long():
+    scheduler = FairShareScheduler(capacity=1)
+    scheduler.avg_service_seconds = settings.LLM_MAX_QUEUE_WAIT_SECONDS * 2
+    
+    async def scenario():
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(scheduler, release))
+        await asyncio.sleep(0)
+        
+        with pytest.raises(LLMShed):
+            scheduler.check((2, SubscriptionTier.FREE))
+        assert await shed_reason(scheduler, user_id=2) == "overloaded"
+        
+        release.set()
+        await holder
+    
+    asyncio.run(scenario())
+    assert scheduler.shed == {"overloaded": 2}  # check() counts too
+
+def test_sheds_a_queued_call_that_waits_past_its_budget(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_MAX_QUEUE_WAIT_SECONDS", 0.1)
+    scheduler = FairShareScheduler(capacity=1)
+    scheduler.avg_service_seconds = 0.01
+    
+    async def scenario():
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(scheduler, release))
+        await asyncio.sleep(0)
+        
+        assert await shed_reason(scheduler, user_id=2) == "queue_timeout"
+        assert scheduler.stats()["waiting"]["free"] == 0
+        
+        release.set()
+        await holder
+    
+    asyncio.run(scenario())
+    assert scheduler.shed == {"queue_timeout": 1}
+    assert scheduler.in_flight == 0
+
+def test_background_work_waits_for_queued_users():
+    scheduler = FairShareScheduler(capacity=1)
+    order = []
+    
+    async def call(label: str, user_id=None):
+        if user_id is not None:
+            bind_caller(user_id, SubscriptionTier.FREE)
+        async with scheduler.slot():
+            order.append(label)
+    
+    async def scenario():
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(scheduler, release))
+        await asyncio.sleep(0)
+        # Background work (no caller) queued first is still served after the user
+        background = asyncio.create_task(call("background"))
+        await asyncio.sleep(0)
+        user = asyncio.create_task(call("user", user_id=2))
+        await asyncio.sleep(0)
+        
+        release.set()
+        await asyncio.gather(holder, background, user)
+    
+    asyncio.run(scenario())
+    assert order == ["user", "background"]
@@ -0,0 +1,46 @@
+from sqlalchemy import delete, update
+from app.core.database import AsyncSessionLocal
+from app.models.companion import AICompanion, CompanionMemory
+from app.models.message import Message, MessageStatus
+from app.models.user import User
+from app.services.memory_service import VectorMemory
+
+async def create_user_with_messages(*categories: str):
+    async with AsyncSessionLocal() as db:
+        user = User(email="memory@example.com", hashed_password="x", encryption_key="k")
+        db.add(user)
+        await db.flush()
+        companion = AICompanion(user_id=user.id)
+        messages = [
+            Message(user_id=user.id, encrypted_content="x", category=category, status=MessageStatus.DELIVERED)
+            for category in categories
+        ]
+        db.add_all([companion, *messages])
+        await db.commit()
+        return user.id, companion.id, [message.id for message in messages]
+
+async def recall(memory: VectorMemory, user_id: int, companion_id: int, query: str):
+    async with AsyncSessionLocal() as db:
+        return await memory.recall(user_id, companion_id, query, db)
+
+def test_recall_skips_messages_removed_by_another_worker(run):
+    memory = VectorMemory(max_users=10, ttl_seconds=300)
+    
+    async def scenario():
+        user_id, companion_id, (deleted_id, archived_id, kept_id) = await create_user_with_messages(
+            "marathon training", "marathon recovery", "marathon nutrition"
+        )
+        assert len(await recall(memory, user_id, companion_id, "marathon")) == 3
+        
+        # Another worker deletes one message and archives another; this worker's index stays cached
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(CompanionMemory).where(CompanionMemory.source_id == deleted_id))
+            await db.execute(delete(Message).where(Message.id == deleted_id))
+            await db.execute(update(Message).where(Message.id == archived_id).values(status=MessageStatus.ARCHIVED))
+            await db.commit()
+        
+        snippets = await recall(memory, user_id, companion_id, "marathon")
+        assert len(snippets) == 1
+        assert "nutrition" in snippets[0]
+    
+    run(scenario())
@@ -0,0 +1,27 @@
+import time
+from app.services.rate_limiter import RateLimiter
+
+WINDOW = 60
+
+def test_prune_evicts_expired_windows_then_least_recently_used():
+    limiter = RateLimiter(lease_fraction=1.0, max_keys=3)
+    now = time.time()
+    window_index = int(now // WINDOW)
+    
+    limiter._acquire_local("stale", 5, WINDOW, window_index - 5, 1.0, 1)
+    assert limiter._acquire_local("exhausted", 5, WINDOW, window_index, 1.0, 5) == 5
+    limiter._acquire_local("idle", 5, WINDOW, window_index, 1.0, 1)
+    limiter._acquire_local("busy", 5, WINDOW, window_index, 1.0, 1)
+    limiter._acquire_local("exhausted", 5, WINDOW, window_index, 1.0, 1)
+    
+    with limiter.lock:
+        limiter._prune(now)
+    assert list(limiter.counters) == ["idle", "busy", "exhausted"]
+    
+    limiter._acquire_local("new", 5, WINDOW, window_index, 1.0, 1)
+    with limiter.lock:
+        limiter._prune(now)
+    assert list(limiter.counters) == ["busy", "exhausted", "new"]
+    
+    # Surviving keys keep their counts, so an exhausted key stays limited
+    assert limiter._acquire_local("exhausted", 5, WINDOW, window_index, 1.0, 1) == 0
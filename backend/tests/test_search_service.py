@@ -0,0 +1,71 @@
+import base64
+import os
+from sqlalchemy import func, select
+from app.api.auth import Principal
+from app.api.messages import MessageCreate, create_message
+from app.core.database import AsyncSessionLocal
+from app.core.security import MessageEncryption
+from app.models.message import Message, MessageSearchToken
+from app.models.user import User, SubscriptionTier
+from app.services.search_service import SearchService
+
+async def create_user() -> User:
+    async with AsyncSessionLocal() as db:
+        user = User(email="search@example.com", hashed_password="x", encryption_key=base64.b64encode(os.urandom(32)).decode())
+        db.add(user)
+        await db.commit()
+        return user
+
+async def add_message(user: User, content: str):
+    async with AsyncSessionLocal() as db:
+        db.add(Message(user_id=user.id, encrypted_content=MessageEncryption.encrypt(content, user.encryption_key)))
+        await db.commit()
+
+async def enable(user_id: int) -> int:
+    async with AsyncSessionLocal() as db:
+        return await SearchService.enable(await db.get(User, user_id), db)
+
+async def search(user: User, query: str) -> int:
+    async with AsyncSessionLocal() as db:
+        return len(await SearchService.search(user, query, db))
+
+async def posting_count() -> int:
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(func.count()).select_from(MessageSearchToken))
+
+def test_messages_are_indexed_even_when_the_principal_predates_the_opt_in(run):
+    async def scenario():
+        user = await create_user()
+        # Authenticated (and cached) before another worker enabled search
+        principal = Principal(
+            id=user.id,
+            email=user.email,
+            subscription_tier=SubscriptionTier.PREMIUM,
+            is_admin=False,
+            token_version=0,
+            encryption_key=user.encryption_key,
+            search_index_enabled=False
+        )
+        await enable(user.id)
+        
+        async with AsyncSessionLocal() as db:
+            await create_message(MessageCreate(content="remember the lighthouse"), principal, db)
+        return await search(user, "lighthouse")
+    
+    assert run(scenario()) == 1
+
+def test_enable_backfills_only_messages_without_postings(run):
+    async def scenario():
+        user = await create_user()
+        await add_message(user, "first note")
+        assert await enable(user.id) == 1
+        postings = await posting_count()
+        
+        await add_message(user, "second note")
+        # A retry (or a backfill racing new writes) doesn't index anything twice
+        assert await enable(user.id) == 1
+        assert await enable(user.id) == 0
+        assert await posting_count() == postings + 2
+        return await search(user, "note")
+    
+    assert run(scenario()) == 2
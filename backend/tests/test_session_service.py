@@ -0,0 +1,78 @@
+from sqlalchemy import select
+from app.core.database import AsyncSessionLocal
+from app.models import UserSession
+from app.models.user import User
+from app.services.session_service import SessionService
+
+async def create_user() -> int:
+    async with AsyncSessionLocal() as db:
+        user = User(email="sessions@example.com", hashed_password="x", encryption_key="k")
+        db.add(user)
+        await db.commit()
+        return user.id
+
+async def active_sessions(user_id: int) -> int:
+    async with AsyncSessionLocal() as db:
+        return len(await SessionService.list_active(user_id, db))
+
+def test_rotation_consumes_the_token(run):
+    async def scenario():
+        user_id = await create_user()
+        async with AsyncSessionLocal() as db:
+            token = await SessionService.issue(user_id, db, device_info="phone")
+            rotated_user_id, new_token = await SessionService.rotate(token, db)
+        assert rotated_user_id == user_id
+        assert new_token != token
+        
+        async with AsyncSessionLocal() as db:
+            sessions = await SessionService.list_active(user_id, db)
+        assert [(session.token, session.device_info) for session in sessions] == [
+            (SessionService.hash_token(new_token), "phone")
+        ]
+    
+    run(scenario())
+
+def test_reusing_a_rotated_token_revokes_every_session(run):
+    async def scenario():
+        user_id = await create_user()
+        async with AsyncSessionLocal() as db:
+            token = await SessionService.issue(user_id, db)
+            await SessionService.issue(user_id, db, device_info="laptop")
+            _, new_token = await SessionService.rotate(token, db)
+        assert await active_sessions(user_id) == 2
+        
+        # The old token turns up again, e.g. stolen before the rotation
+        async with AsyncSessionLocal() as db:
+            assert await SessionService.rotate(token, db) is None
+        assert await active_sessions(user_id) == 0
+        
+        async with AsyncSessionLocal() as db:
+            assert await SessionService.rotate(new_token, db) is None
+    
+    run(scenario())
+
+def test_concurrent_refresh_with_the_same_token_is_treated_as_reuse(run, monkeypatch):
+    async def scenario():
+        user_id = await create_user()
+        async with AsyncSessionLocal() as db:
+            token = await SessionService.issue(user_id, db)
+            session = (await db.scalars(select(UserSession).where(UserSession.user_id == user_id))).one()
+            snapshot = {
+                "id": session.id,
+                "user_id": user_id,
+                "device_info": None,
+                "expires_at": session.expires_at.isoformat()
+            }
+        
+        # A second worker read the session from the cache before the first one rotated it
+        async def stale_cache_get(token_hash):
+            return snapshot
+        
+        async with AsyncSessionLocal() as db:
+            assert await SessionService.rotate(token, db) is not None
+        monkeypatch.setattr(SessionService, "_cache_get", stale_cache_get)
+        async with AsyncSessionLocal() as db:
+            assert await SessionService.rotate(token, db) is None
+        assert await active_sessions(user_id) == 0
+    
+    run(scenario())
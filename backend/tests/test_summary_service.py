@@ -0,0 +1,47 @@
+from typing import Tuple
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models.companion import AICompanion, CompanionConversation
+from app.models.user import User, SubscriptionTier
+from app.services.llm_client import llm_client
+from app.services.llm_scheduler import bind_caller, llm_caller
+from app.services.llm_usage import usage_user
+from app.services.summary_service import ConversationSummaryService
+
+async def create_companion_with_turns(turns: int) -> Tuple[int, int]:
+    async with AsyncSessionLocal() as db:
+        user = User(email="summary@example.com", hashed_password="x", encryption_key="k")
+        db.add(user)
+        await db.flush()
+        companion = AICompanion(user_id=user.id)
+        db.add(companion)
+        await db.flush()
+        db.add_all([
+            CompanionConversation(companion_id=companion.id, user_message=f"turn {i}", companion_response="ok")
+            for i in range(turns)
+        ])
+        await db.commit()
+        return companion.id, user.id
+
+def test_summary_runs_outside_the_requesting_users_slots(run, monkeypatch):
+    seen = []
+    
+    async def chat(messages, model, **kwargs):
+        seen.append((llm_caller.get(), usage_user.get(), kwargs.get("site")))
+        return "A short summary."
+    
+    monkeypatch.setattr(llm_client, "chat", chat)
+    
+    async def scenario():
+        companion_id, user_id = await create_companion_with_turns(
+            settings.COMPANION_RECENT_TURNS + settings.COMPANION_SUMMARY_BATCH_TURNS
+        )
+        # What the companion router's dependency does; BackgroundTasks inherit it
+        bind_caller(user_id, SubscriptionTier.FREE)
+        advanced = await ConversationSummaryService.summarize(companion_id)
+        return advanced, user_id
+    
+    advanced, user_id = run(scenario())
+    
+    assert advanced
+    assert seen == [(None, user_id, "summary")]
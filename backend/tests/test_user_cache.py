@@ -0,0 +1,107 @@
+import asyncio
+import json
+from typing import Tuple
+from sqlalchemy import event
+from app.api.auth import _cached_user_snapshot
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal, async_engine
+from app.models.user import User
+from app.services.user_cache import INVALIDATION_CHANNEL, REDELETE_AFTER_SECONDS, UserCache, user_cache
+
+def test_cache_hits_skip_the_users_query(run):
+    statements = []
+    
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+    
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            user = User(email="cache@example.com", hashed_password="x", encryption_key="k")
+            db.add(user)
+            await db.commit()
+            await _cached_user_snapshot(db, user.id)
+        
+        event.listen(async_engine.sync_engine, "before_cursor_execute", count)
+        try:
+            async with AsyncSessionLocal() as db:
+                return await _cached_user_snapshot(db, user.id)
+        finally:
+            event.remove(async_engine.sync_engine, "before_cursor_execute", count)
+    
+    snapshot = run(scenario())
+    assert statements == []
+    assert (snapshot["token_version"], snapshot["data_version"], snapshot["is_active"]) == (0, 0, True)
+
+class FakePubSub:
+    def __init__(self, messages: asyncio.Queue):
+        self.messages = messages
+        self.channels = []
+    
+    async def subscribe(self, channel):
+        self.channels.append(channel)
+    
+    async def listen(self):
+        yield {"type": "subscribe", "data": 1}
+        while True:
+            yield await self.messages.get()
+
+class FakeAsyncRedis:
+    def __init__(self):
+        self.deleted = []
+        self.published = []
+        self.messages: asyncio.Queue = None
+    
+    async def get(self, key):
+        return None
+    
+    async def delete(self, *keys):
+        self.deleted.append(keys)
+    
+    async def publish(self, channel, data):
+        self.published.append((channel, data))
+    
+    def pubsub(self):
+        return FakePubSub(self.messages)
+
+def fake_redis_cache(monkeypatch) -> Tuple[UserCache, FakeAsyncRedis]:
+    cache = UserCache(ttl_seconds=15, max_entries=10, redis_ttl_seconds=300)
+    client = FakeAsyncRedis()
+    monkeypatch.setattr(settings, "AUTH_CACHE_REDIS", True)
+    monkeypatch.setattr(cache, "_redis_client", lambda: client)
+    monkeypatch.setattr(cache, "_redis_sync_client", lambda: (_ for _ in ()).throw(AssertionError("blocking client used")))
+    monkeypatch.setattr("app.services.user_cache.REDELETE_AFTER_SECONDS", 0.01)
+    return cache, client
+
+def test_invalidation_on_the_event_loop_uses_the_async_client(monkeypatch):
+    cache, client = fake_redis_cache(monkeypatch)
+    
+    async def scenario():
+        cache.invalidate(3, 4)
+        assert client.deleted == []  # Nothing ran inline
+        await asyncio.gather(*cache._pending_deletes)
+    
+    asyncio.run(scenario())
+    assert client.deleted == [("auth:user:3", "auth:user:4")] * 2
+    assert client.published == [(INVALIDATION_CHANNEL, "[3, 4]")]
+    assert REDELETE_AFTER_SECONDS > 0
+
+def test_invalidations_from_other_workers_evict_the_local_tier(monkeypatch):
+    cache, client = fake_redis_cache(monkeypatch)
+    
+    async def scenario():
+        client.messages = asyncio.Queue()
+        cache.start()
+        cache._store_local(3, {"id": 3, "token_version": 0})
+        cache._store_local(5, {"id": 5, "token_version": 0})
+        generation = cache.generation(3)
+        
+        await client.messages.put({"type": "message", "data": json.dumps([3])})
+        for _ in range(10):
+            await asyncio.sleep(0)
+        
+        assert await cache.get(3) is None
+        assert await cache.get(5) == {"id": 5, "token_version": 0}
+        assert cache.generation(3) != generation  # A load already in flight isn't cached
+        await cache.shutdown()
+    
+    asyncio.run(scenario())
@@ -0,0 +1,62 @@
+from sqlalchemy import delete, text
+from app.core.database import AsyncSessionLocal
+from app.models.message import Message
+from app.models.user import User
+from app.services.version_service import VersionService
+
+async def create_user(email: str) -> int:
+    async with AsyncSessionLocal() as db:
+        user = User(email=email, hashed_password="x", encryption_key="k")
+        db.add(user)
+        await db.commit()
+        return user.id
+
+def test_bump_only_touches_the_given_users(run):
+    async def scenario():
+        alice = await create_user("alice@example.com")
+        bob = await create_user("bob@example.com")
+        async with AsyncSessionLocal() as db:
+            await VersionService.bump(db, alice)
+            await db.commit()
+            return (await db.get(User, alice)).data_version, (await db.get(User, bob)).data_version
+    
+    assert run(scenario()) == (1, 0)
+
+def test_global_stamp_follows_bumped_writes(run):
+    async def scenario():
+        user_id = await create_user("stamp@example.com")
+        stamps = []
+        async with AsyncSessionLocal() as db:
+            stamps.append(await VersionService.get_global_stamp(db))
+            
+            message = Message(user_id=user_id, encrypted_content="x")
+            db.add(message)
+            await VersionService.bump(db, user_id)
+            await db.commit()
+            stamps.append(await VersionService.get_global_stamp(db))
+            
+            await db.execute(delete(Message).where(Message.id == message.id))
+            await VersionService.bump(db, user_id)
+            await db.commit()
+            stamps.append(await VersionService.get_global_stamp(db))
+            
+            # Nothing changed since
+            stamps.append(await VersionService.get_global_stamp(db))
+            
+            await create_user("newcomer@example.com")
+            stamps.append(await VersionService.get_global_stamp(db))
+        return stamps
+    
+    before, inserted, deleted, unchanged, signed_up = run(scenario())
+    assert len({before, inserted, deleted, signed_up}) == 4
+    assert deleted == unchanged
+
+def test_global_stamp_does_not_scan_tables(run):
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            statement = str(VersionService.global_stamp_statement().compile(compile_kwargs={"literal_binds": True}))
+            return (await db.execute(text(f"EXPLAIN QUERY PLAN {statement}"))).all()
+    
+    plan = [row[-1] for row in run(scenario())]
+    assert plan
+    assert not [step for step in plan if step.startswith("SCAN") and step != "SCAN CONSTANT ROW"], plan
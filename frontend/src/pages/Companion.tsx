@@ -2,7 +2,7 @@ import React, { useState } from 'react';
 import { Box, Container, Typography, TextField, Button, Paper, Avatar } from '@mui/material';
 import { SmartToy, Person } from '@mui/icons-material';
 import { useAppDispatch, useAppSelector } from '../hooks';
-import { addChatMessage } from '../slices/companionSlice';
+import { addChatMessage, appendToLastMessage } from '../slices/companionSlice';
 import { companionAPI } from '../services/api';
 
 const Companion: React.FC = () => {
@@ -21,14 +21,17 @@ const Companion: React.FC = () => {
     dispatch(addChatMessage(userMessage));
     setMessage('');
 
+    // Show the reply as it streams in
+    dispatch(addChatMessage({
+      role: 'companion' as const,
+      content: '',
+      timestamp: new Date().toISOString(),
+    }));
+
     try {
-      const response = await companionAPI.chat(message);
-      const companionMessage = {
-        role: 'companion' as const,
-        content: response.data.response,
-        timestamp: new Date().toISOString(),
-      };
-      dispatch(addChatMessage(companionMessage));
+      await companionAPI.chatStream(message, {
+        onToken: (text) => dispatch(appendToLastMessage(text)),
+      });
     } catch (err) {
       console.error('Failed to send message', err);
     }
@@ -23,6 +23,7 @@ const Login: React.FC = () => {
       dispatch(setCredentials({
         user: response.data.user,
         token: response.data.access_token,
+        refreshToken: response.data.refresh_token,
       }));
       navigate('/dashboard');
     } catch (err: any) {
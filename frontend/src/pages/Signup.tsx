@@ -24,6 +24,7 @@ const Signup: React.FC = () => {
       dispatch(setCredentials({
         user: response.data.user,
         token: response.data.access_token,
+        refreshToken: response.data.refresh_token,
       }));
       navigate('/dashboard');
     } catch (err: any) {
@@ -14,12 +14,53 @@ api.interceptors.request.use((config) => {
   return config;
 });
 
+// Renew an expired access token with the refresh token, then retry once.
+// Concurrent 401s share a single refresh request.
+let refreshing: Promise<string | null> | null = null;
+
+const refreshAccessToken = async (): Promise<string | null> => {
+  const refreshToken = localStorage.getItem('refreshToken');
+  if (!refreshToken) {
+    return null;
+  }
+  try {
+    const response = await axios.post(`${API_URL}/api/auth/refresh`, { refresh_token: refreshToken });
+    localStorage.setItem('token', response.data.access_token);
+    localStorage.setItem('refreshToken', response.data.refresh_token);
+    return response.data.access_token;
+  } catch {
+    localStorage.removeItem('refreshToken');
+    return null;
+  }
+};
+
+api.interceptors.response.use(
+  (response) => response,
+  async (error) => {
+    const original = error.config;
+    if (error.response?.status !== 401 || original._retried || /^\/api\/auth\/(login|signup|refresh)/.test(original.url || '')) {
+      return Promise.reject(error);
+    }
+
+    refreshing = refreshing || refreshAccessToken().finally(() => { refreshing = null; });
+    const token = await refreshing;
+    if (!token) {
+      return Promise.reject(error);
+    }
+
+    original._retried = true;
+    original.headers.Authorization = `Bearer ${token}`;
+    return api(original);
+  }
+);
+
 export const authAPI = {
   signup: (email: string, password: string, full_name?: string) =>
     api.post('/api/auth/signup', { email, password, full_name }),
   login: (email: string, password: string) =>
     api.post('/api/auth/login', { email, password }),
   getMe: () => api.get('/api/auth/me'),
+  logout: (refresh_token: string) => api.post('/api/auth/logout', { refresh_token }),
 };
 
 export const messagesAPI = {
@@ -29,11 +70,74 @@ export const messagesAPI = {
   delete: (id: number) => api.delete(`/api/messages/${id}`),
 };
 
+export interface ChatStreamHandlers {
+  onToken: (text: string) => void;
+  onEmotion?: (emotion: string) => void;
+  onSuggestions?: (suggestions: string[]) => void;
+}
+
+// Server-Sent Events over POST (EventSource only supports GET)
+const chatStream = async (message: string, handlers: ChatStreamHandlers, retried = false): Promise<void> => {
+  const response = await fetch(`${API_URL}/api/companion/chat/stream`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      Authorization: `Bearer ${localStorage.getItem('token')}`,
+    },
+    body: JSON.stringify({ message }),
+  });
+
+  if (response.status === 401 && !retried) {
+    refreshing = refreshing || refreshAccessToken().finally(() => { refreshing = null; });
+    if (await refreshing) {
+      return chatStream(message, handlers, true);
+    }
+  }
+  if (!response.ok || !response.body) {
+    throw new Error(`Chat stream failed with status ${response.status}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) {
+      break;
+    }
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const block = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      const event = block.match(/^event: (.*)$/m)?.[1];
+      const data = block.match(/^data: (.*)$/m)?.[1];
+      if (!event || data === undefined) {
+        continue;
+      }
+      const payload = JSON.parse(data);
+      if (event === 'token') {
+        handlers.onToken(payload.text);
+      } else if (event === 'emotion') {
+        handlers.onEmotion?.(payload);
+      } else if (event === 'suggestions') {
+        handlers.onSuggestions?.(payload);
+      }
+    }
+  }
+};
+
 export const companionAPI = {
   chat: (message: string) => api.post('/api/companion/chat', { message }),
+  chatStream,
   updatePersonality: (personality: string, custom_instructions?: string) =>
     api.put('/api/companion/personality', { personality, custom_instructions }),
   getDailyCheckin: () => api.get('/api/companion/daily-checkin'),
+  updateCheckinSettings: (daily_checkin_enabled: boolean, checkin_time?: string) =>
+    api.put('/api/companion/checkin-settings', { daily_checkin_enabled, checkin_time }),
   helpCraftMessage: (intent: string) =>
     api.post('/api/companion/help-craft-message', { intent }),
 };
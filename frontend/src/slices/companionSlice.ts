@@ -25,6 +25,12 @@ const companionSlice = createSlice({
     addChatMessage: (state, action: PayloadAction<ChatMessage>) => {
       state.messages.push(action.payload);
     },
+    appendToLastMessage: (state, action: PayloadAction<string>) => {
+      const last = state.messages[state.messages.length - 1];
+      if (last) {
+        last.content += action.payload;
+      }
+    },
     setPersonality: (state, action: PayloadAction<string>) => {
       state.personality = action.payload;
     },
@@ -34,5 +40,5 @@ const companionSlice = createSlice({
   },
 });
 
-export const { addChatMessage, setPersonality, setLoading } = companionSlice.actions;
+export const { addChatMessage, appendToLastMessage, setPersonality, setLoading } = companionSlice.actions;
 export default companionSlice.reducer;